@@ -44,11 +44,19 @@ def parse_annotation_file(path):
     return ret
 
 
+def parse_annotation_file_binary(path):
+    # written by write_annotation_file(), keeps sub-pixel precision
+
+    return [Annot(((r[0], r[1]), (r[2], r[3]), r[4]), text) for r, text in pcb_annotations.load(path)]
+
+
 def write_annotation_file(data, to):
     with open(to, 'w') as f:
         for d in data:
             f.write('{:.0f} {:.0f} {:.0f} {:.0f} {:.3f} {}\n'.format(d.rect[0][0], d.rect[0][1], d.rect[1][0], d.rect[1][1], d.rect[2], d.text))
 
+    pcb_annotations.save(os.path.splitext(to)[0] + '.bin', [(d.rect, d.text) for d in data])
+
 
 def mat_to_qimage(mat):
     tmp = cv2.cvtColor(mat, cv2.COLOR_BGR2RGB)
@@ -107,35 +115,19 @@ class Window(QtGui.QWidget):
         if button == 2:
             # remove existing annotation
 
-            id = 0
-            del_id = -1
-            for an in self.annot:
-                tmp = np.zeros(self.image.shape[:2], dtype=np.uint8)
-                bp = cv2.cv.BoxPoints(an.rect)
-                bp = np.int0(bp)
-                cv2.drawContours(tmp, [bp], 0, (255), -1)
-
-                if tmp[y, x] > 0:
-                    del_id = id
-                    break
-
-                id += 1
-
-            if del_id >= 0:
-                del self.annot[del_id]
+            hits = np.flatnonzero(pcb_geometry.points_in_rects([(x, y)], pcb_geometry.as_rects(self.annot))[0])
+            if len(hits) > 0:
+                del self.annot[hits[0]]
 
         self.redraw()
 
     def redraw(self):
         vis = self.image.copy()
-        id = 1
-        for an in self.annot:
-            bp = cv2.cv.BoxPoints(an.rect)
-            bp = np.int0(bp)
-            cv2.drawContours(vis, [bp], 0, (0, 255, 0), 2)
+        polys = pcb_geometry.polygons(pcb_geometry.as_rects(self.annot))
+        cv2.polylines(vis, list(polys), True, (0, 255, 0), 2)
 
-            cv2.putText(vis, '{}'.format(id), (bp[0, 0]+5, bp[0, 1]-5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0))
-            id += 1
+        for id, bp in enumerate(polys.tolist()):
+            cv2.putText(vis, '{}'.format(id+1), (bp[0][0]+5, bp[0][1]-5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0))
 
         for idx in np.arange(self.annot_idx):
             cv2.line(vis, tuple(self.annot_coords[idx]), tuple(self.annot_coords[idx]), (0, 0, 255), 2)
@@ -154,8 +146,16 @@ class Window(QtGui.QWidget):
 
 parser = argparse.ArgumentParser(description='Annotate PCB.')
 parser.add_argument('file', type=str, help='Path to image file')
+parser.add_argument('--api', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'python'), help='Directory that contains the DSLR dataset python API file.')
 args = parser.parse_args()
 
+try:
+    sys.path.insert(0, args.api)
+    import pcb_geometry
+    import pcb_annotations
+except:
+    sys.exit('Failed to import DSLR dataset API .. wrong directory?')
+
 if args.file is None:
     parser.print_help()
     sys.exit(1)
@@ -169,9 +169,13 @@ if os.path.splitext(args.file)[1] != '.jpg':
 img = cv2.imread(args.file)
 
 annot_name = os.path.join(os.path.dirname(args.file), '{}-annot.txt'.format(os.path.splitext(args.file)[0]))
+annot_bin = os.path.splitext(annot_name)[0] + '.bin'
 annot_data = []
 
-if os.path.isfile(annot_name):
+if os.path.isfile(annot_bin) and (not os.path.isfile(annot_name) or os.path.getmtime(annot_bin) >= os.path.getmtime(annot_name)):
+    print('Loading existing annotation file (binary)')
+    annot_data = parse_annotation_file_binary(annot_bin)
+elif os.path.isfile(annot_name):
     print('Loading existing annotation file')
     annot_data = parse_annotation_file(annot_name)
 
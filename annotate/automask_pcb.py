@@ -0,0 +1,240 @@
+
+'''
+Compute masks of unmasked PCB recordings without user interaction.
+The mask of another recording of the same PCB is transferred via the stored homographies
+(see pcb_registration.py) and used to initialize GrabCut (see mask_pcb.py for the interactive version).
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Masks are written as recN-mask.png, a report with confidence and area change of every
+recording is written to the file specified via --report. Recordings that fail the
+confidence checks are not written and have to be masked with mask_pcb.py.
+'''
+
+import cv2
+import numpy as np
+
+import sys
+import os.path
+import argparse
+import json
+import multiprocessing
+
+
+def init_worker(api):
+    '''
+    Initialize a worker process.
+    api: directory that contains the DSLR dataset python API file.
+    '''
+
+    global PCB
+
+    sys.path.insert(0, api)
+    from pcb_dataset import PCB
+
+
+def largest_region(mask):
+    '''
+    Returns a mask that contains only the largest region of the given mask, with holes filled.
+    mask: binary mask.
+    '''
+
+    cnt, _ = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2:]
+
+    ret = np.zeros(mask.shape, dtype=np.uint8)
+    if len(cnt) > 0:
+        cnt = sorted(cnt, key=cv2.contourArea, reverse=True)[0]
+        cv2.fillPoly(ret, [cnt], 255)
+
+    return ret
+
+
+def transfer(small, store, seed, rec, im, kernel, opts, entry):
+    '''
+    Transfer the mask of a seed recording to a recording and refine it with GrabCut.
+    Returns the refined mask, or None if it fails the confidence checks (entry['reason'] is set accordingly).
+    small: PCB object at processing scale.
+    store: registration store of the PCB.
+    seed: seed recording with a mask.
+    rec: destination recording.
+    im: image of the destination recording at processing scale.
+    kernel: structuring element that defines the uncertain region.
+    opts: options.
+    entry: report entry, updated with statistics.
+    '''
+
+    H = small.homography(seed, rec)
+    stats = store.stats(seed, rec) or {'inliers': 0, 'matches': 0}
+    entry.update({'inliers': stats['inliers'], 'matches': stats['matches']})
+
+    if H is None or stats['inliers'] < opts['min_inliers']:
+        entry['reason'] = 'too few keypoint matches'
+        return None
+
+    from_mask = small.mask(seed)
+
+    warped = cv2.warpPerspective(from_mask, H, (im.shape[1], im.shape[0]), flags=cv2.INTER_NEAREST)
+    warped_area = np.count_nonzero(warped)
+    if warped_area == 0:
+        entry['reason'] = 'transferred mask is empty'
+        return None
+
+    # sure fg inside the eroded, sure bg outside the dilated transferred mask
+
+    gcmask = np.full(warped.shape, cv2.GC_BGD, dtype=np.uint8)
+    gcmask[cv2.dilate(warped, kernel) > 0] = cv2.GC_PR_BGD
+    gcmask[warped > 0] = cv2.GC_PR_FGD
+    gcmask[cv2.erode(warped, kernel) > 0] = cv2.GC_FGD
+
+    bgdmodel = np.zeros((1, 65), np.float64)
+    fgdmodel = np.zeros((1, 65), np.float64)
+    cv2.grabCut(im, gcmask, None, bgdmodel, fgdmodel, opts['iterations'], cv2.GC_INIT_WITH_MASK)
+
+    res = largest_region(np.where((gcmask == cv2.GC_FGD) | (gcmask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8))
+
+    area = np.count_nonzero(res)
+    iou = float(np.count_nonzero(res & warped)) / np.count_nonzero(res | warped)
+    change = float(area - warped_area) / warped_area
+    entry.update({'confidence': iou, 'area_change': change})
+
+    if iou < opts['min_confidence']:
+        entry['reason'] = 'GrabCut result deviates from transferred mask'
+        return None
+
+    if abs(change) > opts['max_area_change']:
+        entry['reason'] = 'area change too large'
+        return None
+
+    return res
+
+
+def automask(task):
+    '''
+    Compute the masks of the unmasked recordings of a PCB, seeded from the masks of other recordings.
+    Returns a list of report entries (dicts), errors are reported as 'reason' of the entry.
+    task: (pcb root, pcb id, destination recordings, seed recordings, options).
+    '''
+
+    root, pid, recs, seeds, opts = task
+
+    small = PCB(root, 1.0/opts['scale'])
+    store = small.registration()
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (opts['margin'], opts['margin']))
+
+    ret = []
+    for rec in recs:
+        entry = {'pcb': pid, 'rec': rec, 'status': 'failed', 'reason': 'no seed recording with a mask'}
+        ret.append(entry)
+
+        try:
+            full = PCB(root).image(rec)
+            im = cv2.resize(full, (0, 0), fx=1.0/opts['scale'], fy=1.0/opts['scale'], interpolation=cv2.INTER_AREA)
+        except Exception as e:
+            entry['reason'] = str(e)
+            continue
+
+        for seed in seeds:
+            entry['seed'] = seed
+
+            try:
+                res = transfer(small, store, seed, rec, im, kernel, opts, entry)
+            except Exception as e:  # e.g. unreadable seed mask, try the next seed
+                entry['reason'] = str(e)
+                continue
+
+            if res is None:
+                continue
+
+            entry['status'] = 'ok'
+            del entry['reason']
+
+            if not opts['dry_run']:
+                res = cv2.resize(res, (full.shape[1], full.shape[0]), interpolation=cv2.INTER_NEAREST)
+                entry['written'] = os.path.join(root, 'rec{}-mask.png'.format(rec))
+                cv2.imwrite(entry['written'], res)
+
+            break
+
+    return ret
+
+
+if __name__ == '__main__':
+    # parse and check args
+
+    parser = argparse.ArgumentParser(description='Compute masks of unmasked PCB recordings.')
+    parser.add_argument('--api', type=str, required=True, help='Directory that contains the DSLR dataset python API file.')
+    parser.add_argument('--db', type=str, required=True, help='Root directory of the DSLR dataset.')
+    parser.add_argument('--pcb', type=int, nargs='*', help='IDs of the PCBs to process (default: all).')
+    parser.add_argument('--scale', type=int, default=4, help='Scale factor to apply for faster processing (2 = half size).')
+    parser.add_argument('--iterations', type=int, default=5, help='Number of GrabCut iterations.')
+    parser.add_argument('--margin', type=int, default=15, help='Width of the uncertain region around the transferred mask, in scaled pixels.')
+    parser.add_argument('--min-inliers', type=int, default=20, help='Minimum number of homography inliers.')
+    parser.add_argument('--min-confidence', type=float, default=0.9, help='Minimum IoU between transferred mask and result.')
+    parser.add_argument('--max-area-change', type=float, default=0.1, help='Maximum relative area change between transferred mask and result.')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--report', type=str, default='automask-report.json', help='Path of the report file.')
+    parser.add_argument('--dry-run', action='store_true', help='Do not write masks.')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.api):
+        sys.exit('"{}" is not a directory'.format(args.api))
+
+    if not os.path.isdir(args.db):
+        sys.exit('"{}" is not a directory'.format(args.db))
+
+    if args.scale < 1:
+        sys.exit('--scale must be >= 1')
+
+    try:
+        init_worker(args.api)
+        from pcb_dataset import PCBDataset
+    except:
+        sys.exit('Failed to import DSLR dataset API .. wrong directory?')
+
+    # collect unmasked recordings
+
+    opts = {
+        'scale': args.scale,
+        'iterations': args.iterations,
+        'margin': args.margin,
+        'min_inliers': args.min_inliers,
+        'min_confidence': args.min_confidence,
+        'max_area_change': args.max_area_change,
+        'dry_run': args.dry_run
+    }
+
+    db = PCBDataset(args.db)
+    tasks = []
+
+    for id in (args.pcb or db.pcb_ids()):
+        pcb = db.pcb(id)
+        masked = [r for r in sorted(pcb.recordings()) if os.path.isfile(os.path.join(pcb._root, 'rec{}-mask.png'.format(r)))]
+        unmasked = [r for r in sorted(pcb.recordings()) if r not in masked]
+
+        if unmasked:
+            tasks.append((pcb._root, id, unmasked, masked, opts))
+
+    print('{} unmasked recordings'.format(sum([len(t[2]) for t in tasks])))
+
+    # process them
+
+    pool = multiprocessing.Pool(args.processes, init_worker, (args.api,))
+    report = []
+
+    for entries in pool.imap_unordered(automask, tasks):
+        for entry in entries:
+            report.append(entry)
+            print(' PCB {} rec {}: {}'.format(entry['pcb'], entry['rec'], entry['status']))
+
+    pool.close()
+    pool.join()
+
+    report.sort(key=lambda e: (e['pcb'], e['rec']))
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    failed = [e for e in report if e['status'] != 'ok']
+
+    print('')
+    print('{} masks computed, {} failed, report written to "{}"'.format(len(report)-len(failed), len(failed), args.report))
+    for e in failed:
+        print(' PCB {} rec {}: {} (use mask_pcb.py)'.format(e['pcb'], e['rec'], e['reason']))
@@ -1,6 +1,7 @@
 
 '''
 Transfer IC labels between different images of the same PCB via keypoint-based homography estimation.
+Homographies are estimated once per PCB, at full resolution by default, and stored (see pcb_registration.py).
 ~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
 '''
 
@@ -13,34 +14,12 @@ import argparse
 import copy
 
 
-def filter_matches(kp1, kp2, matches, ratio=0.8):
-    '''
-    Filter descriptor matches using descriptor ratio.
-    kp1: list of 1st set of keypoints.
-    kp2: list of 2nd set of keypoints.
-    matches: list of DMatch objects .
-    ratio: maximum ratio of retained matches.
-    '''
-
-    mkp1, mkp2 = [], []
-    for m in matches:
-        if len(m) == 2 and m[0].distance < m[1].distance * ratio:
-            m = m[0]
-            mkp1.append(kp1[m.queryIdx])
-            mkp2.append(kp2[m.trainIdx])
-
-    p1 = np.float32([kp.pt for kp in mkp1])
-    p2 = np.float32([kp.pt for kp in mkp2])
-
-    return p1, p2, zip(mkp1, mkp2)
-
-
 def visualize_matches(img1, img2, kp_pairs, status=None, H=None):
     '''
     Visualize features matches.
     img1: first image.
     img2: second image.
-    kp_pairs: corresponding keypoint pairs in both images.
+    kp_pairs: corresponding keypoint pairs in both images (may be empty).
     status: list of bool specifying what keypoints to draw (None = all)
     H: homography to use for visualizing transformed image boundaries (optional)
     '''
@@ -57,6 +36,9 @@ def visualize_matches(img1, img2, kp_pairs, status=None, H=None):
         corners = np.int32(cv2.perspectiveTransform(corners.reshape(1, -1, 2), H).reshape(-1, 2) + (w1, 0))
         cv2.polylines(vis, [corners], True, (255, 255, 255))
 
+    if len(kp_pairs) == 0:
+        return vis
+
     if status is None:
         status = np.ones(len(kp_pairs), np.bool_)
 
@@ -89,6 +71,7 @@ parser.add_argument('--db', type=str, required=True, help='Root directory of the
 parser.add_argument('--pcb', type=int, required=True, help='ID of the PCB to process.')
 parser.add_argument('--from', dest='from_', type=int, required=True, help='Source recording.')
 parser.add_argument('--to', type=int, required=True, help='Destination recording.')
+parser.add_argument('--scale', type=float, default=1.0, help='Scale at which homographies are estimated (stored ones estimated at a lower scale are re-estimated).')
 parser.add_argument('--write', action='store_true', help='Write transfered IC data to disk.')
 parser.add_argument('--overwrite', action='store_true', help='Overwrite existing files.')
 args = parser.parse_args()
@@ -105,6 +88,9 @@ if args.from_ == args.to:
 try:
     sys.path.insert(0, args.api)
     from pcb_dataset import PCBDataset
+    import pcb_annotations
+    import pcb_geometry
+    import pcb_registration
 except:
     sys.exit('Failed to import DSLR dataset API .. wrong directory?')
 
@@ -125,64 +111,32 @@ from_ics = pcb.ics(args.from_)
 
 print('PCB {}: {} => {}'.format(args.pcb, args.from_, args.to))
 
-# detect keypoints
-
-detector = cv2.SURF(1000)
+# get the homography, visualize
 
-from_kp, from_desc = detector.detectAndCompute(from_im, None)
-to_kp, to_desc = detector.detectAndCompute(to_im, None)
+store = pcb_registration.RegistrationStore(pcb._root, scale=args.scale)
 
-if len(from_kp) > 5000:  # sorted desc by confidence
-    from_kp = from_kp[:5000]
-    from_desc = from_desc[:5000]
+H = store.homography(args.from_, args.to)
+if H is None:
+    sys.exit('Could not register the recordings')
 
-if len(to_kp) > 5000:  # sorted desc by confidence
-    to_kp = to_kp[:5000]
-    to_desc = to_desc[:5000]
+stats = store.stats(args.from_, args.to)
+print('{} inliers, {} matches ({} registration steps)'.format(stats['inliers'], stats['matches'], stats['hops']))
 
-print('Detected {} / {} keypoints'.format(len(from_kp), len(to_kp)))
-
-# match them, filter, visualize
-
-matcher = cv2.BFMatcher()
-matches = matcher.knnMatch(from_desc, to_desc, k=2)
-
-pt_from, pt_to, matches = filter_matches(from_kp, to_kp, matches)
-
-if len(matches) >= 4:
-    H, status = cv2.findHomography(pt_from, pt_to, cv2.RANSAC, 5.0)
-    print('{} good matches, {} total'.format(np.sum(status), len(status)))
-
-    vis = visualize_matches(from_im, to_im, matches, status, H)
-else:
-    sys.exit('Could not find at least 4 good matches')
+vis = visualize_matches(from_im, to_im, [], None, H)
 
 # transfer IC bounding boxes
 
 to_ics = copy.deepcopy(from_ics)
-for ic in to_ics:
-    bp = cv2.cv.BoxPoints(ic.rect)
-    bpn = np.asarray([bp])
-    bpt = cv2.perspectiveTransform(bpn, H)
-    bpt = np.int0(bpt)
-    ic.rect = cv2.minAreaRect(bpt)
+to_rects = pcb_geometry.transform_rects(pcb_geometry.as_rects(from_ics), H)
+for ic, rect in zip(to_ics, pcb_geometry.as_tuples(to_rects)):
+    ic.rect = rect
 
 # show results
 
-for ic in from_ics:
-    bp = cv2.cv.BoxPoints(ic.rect)
-    bp = np.int0(bp)
-    cv2.drawContours(vis, [bp], 0, (0, 255, 0), 3)
-
 dx = from_im.shape[1]
 
-for ic in to_ics:
-    bp = cv2.cv.BoxPoints(ic.rect)
-    bp = np.int0(bp)
-
-    bp[:, 0] += dx
-
-    cv2.drawContours(vis, [bp], 0, (0, 255, 0), 3)
+cv2.polylines(vis, list(pcb_geometry.polygons(pcb_geometry.as_rects(from_ics))), True, (0, 255, 0), 3)
+cv2.polylines(vis, list(pcb_geometry.polygons(to_rects, (dx, 0))), True, (0, 255, 0), 3)
 
 vis = cv2.resize(vis, (0, 0), fx=0.3, fy=0.3)
 
@@ -198,4 +152,7 @@ if args.write:
         for ic in to_ics:
             f.write('{:.0f} {:.0f} {:.0f} {:.0f} {:.3f} {}\n'.format(ic.rect[0][0], ic.rect[0][1], ic.rect[1][0], ic.rect[1][1], ic.rect[2], ic.text))
 
-    print('Transfered labels written to "{}"'.format(os.path.basename(spath)))
+    bpath = os.path.join(pcb._root, 'rec{}-annot.bin'.format(args.to))
+    pcb_annotations.save(bpath, [(ic.rect, ic.text) for ic in to_ics])
+
+    print('Transfered labels written to "{}" and "{}"'.format(os.path.basename(spath), os.path.basename(bpath)))
@@ -0,0 +1,97 @@
+// Measures the throughput of the DSLR dataset C++ API, synchronous and via Loader.
+// ~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+#include "pcbdataset.hpp"
+
+#include <boost/program_options.hpp>
+#include <boost/algorithm/string.hpp>
+
+#include <string>
+#include <iostream>
+#include <vector>
+#include <chrono>
+
+int main(int argc, char **argv)
+{
+    using std::cout;
+    using std::cerr;
+    using std::endl;
+
+    namespace po = boost::program_options;
+
+    using namespace pcbdataset;
+
+    // parse args
+
+    std::string root, threadsStr;
+    float scale;
+    int maxPending;
+
+    po::options_description desc("Runtime Arguments");
+    desc.add_options()
+        ("help", "Print this message and quit.")
+        ("root", po::value<std::string>(&root)->default_value(""), "Path to the dataset.")
+        ("scale", po::value<float>(&scale)->default_value(0.5), "Scale factor.")
+        ("threads", po::value<std::string>(&threadsStr)->default_value("1,2,4,8"), "Comma-separated numbers of worker threads to test.")
+        ("pending", po::value<int>(&maxPending)->default_value(16), "Maximum number of requests in flight.");
+
+    po::variables_map vm;
+    po::store(po::parse_command_line(argc, argv, desc), vm);
+    po::notify(vm);
+
+    if(vm.count("help")) {
+        cout << desc << endl;
+        return 0;
+    }
+
+    if(root.empty()) {
+        cerr << "--root must be specified" << endl;
+        return 1;
+    }
+
+    std::vector<std::string> split;
+    boost::split(split, threadsStr, boost::is_any_of(","));
+
+    // collect requests
+
+    PCBDataset dataset(root);
+
+    std::vector<Loader::Request> requests;
+    for(int pid : dataset.pcbIDs())
+        for(int rid : dataset.pcb(pid, scale).recordings())
+            requests.push_back(Loader::Request(pid, rid, scale));
+
+    cout << requests.size() << " recordings at scale " << scale << endl;
+
+    // synchronous baseline
+
+    typedef std::chrono::steady_clock clock;
+
+    auto t = clock::now();
+    for(int pid : dataset.pcbIDs()) {
+        PCB pcb = dataset.pcb(pid, scale);
+        for(int rid : pcb.recordings())
+            pcb.imageMasked(rid);
+    }
+
+    double secs = std::chrono::duration<double>(clock::now() - t).count();
+    cout << "synchronous: " << requests.size() / secs << " images/s" << endl;
+
+    // loader
+
+    for(const std::string& s : split) {
+        int threads = std::stoi(s);
+        Loader loader(dataset, threads, maxPending);
+
+        t = clock::now();
+
+        cv::Mat im;
+        loader.start(requests);
+        while(loader.next(im));
+
+        secs = std::chrono::duration<double>(clock::now() - t).count();
+        cout << "loader, " << threads << " threads: " << requests.size() / secs << " images/s" << endl;
+    }
+
+    return 0;
+}
@@ -50,9 +50,57 @@ namespace pcbdataset
 
 
 
-    PCB::PCB(const std::string& root, float scale) :
+    bool DatasetCache::cropinfo(const boost::filesystem::path& pcb, int rec, float scale, cv::Rect& rect) const
+    {
+        boost::shared_lock<boost::shared_mutex> lock(_mutex);
+
+        auto it = _cropinfo.find(std::make_tuple(pcb.string(), rec, scale));
+        if(it == _cropinfo.end())
+            return false;
+
+        rect = it->second;
+
+        return true;
+    }
+
+    void DatasetCache::cacheCropinfo(const boost::filesystem::path& pcb, int rec, float scale, const cv::Rect& rect)
+    {
+        boost::unique_lock<boost::shared_mutex> lock(_mutex);
+        _cropinfo.insert({ std::make_tuple(pcb.string(), rec, scale), rect });
+    }
+
+    std::shared_ptr<const std::vector<Annot> > DatasetCache::annotations(const boost::filesystem::path& pcb, int rec) const
+    {
+        boost::shared_lock<boost::shared_mutex> lock(_mutex);
+
+        auto it = _annotations.find(std::make_pair(pcb.string(), rec));
+        if(it == _annotations.end())
+            return nullptr;
+
+        return it->second;
+    }
+
+    std::shared_ptr<const std::vector<Annot> > DatasetCache::cacheAnnotations(const boost::filesystem::path& pcb, int rec, const std::shared_ptr<const std::vector<Annot> >& annots)
+    {
+        boost::unique_lock<boost::shared_mutex> lock(_mutex);
+
+        return _annotations.insert({ std::make_pair(pcb.string(), rec), annots }).first->second;
+    }
+
+    void DatasetCache::clear()
+    {
+        boost::unique_lock<boost::shared_mutex> lock(_mutex);
+
+        _cropinfo.clear();
+        _annotations.clear();
+    }
+
+
+
+    PCB::PCB(const std::string& root, float scale, std::shared_ptr<DatasetCache> cache) :
         root(root),
-        scale(scale)
+        scale(scale),
+        _cache(cache ? cache : std::make_shared<DatasetCache>())
     {
         if(! boost::filesystem::is_directory(root))
             throw std::invalid_argument("Root path is not a directory.");
@@ -126,7 +174,7 @@ namespace pcbdataset
         return image;
     }
 
-    cv::Mat PCB::imageMasked(int rec)
+    cv::Mat PCB::imageMasked(int rec) const
     {
         cv::Mat im = image(rec);
         cv::Mat msk = mask(rec);
@@ -137,53 +185,31 @@ namespace pcbdataset
         return im(ci);
     }
 
-    std::vector<Annot> PCB::ics(int rec, bool cropped, cv::Vec2f size, cv::Vec2f aspect)
+    std::vector<Annot> PCB::ics(int rec, bool cropped, cv::Vec2f size, cv::Vec2f aspect) const
     {
-        if(_cache_ics.count(rec) == 1)
-            return _cache_ics[rec];
+        std::shared_ptr<const std::vector<Annot> > annots = _annotations(rec);
 
-        if(_recordings.count(rec) == 0)
-            throw std::invalid_argument("Recording does not exist.");
-
-        boost::filesystem::path fpath = _recordings.at(rec);
-        std::stringstream ss; ss << "rec" << rec << "-annot.txt";
-        fpath = fpath.parent_path() / ss.str();
-
-        if(! boost::filesystem::is_regular_file(fpath))
-            throw std::runtime_error("Annotation file does not exist.");
+        cv::Rect ci;
+        if(cropped)
+            ci = _cropinfo(rec);
 
         std::vector<Annot> ret;
 
-        std::string line;
-        std::ifstream file(fpath.string());
-
-        while(std::getline(file, line)) {
-            std::vector<std::string> split;
-            boost::split(split, line, boost::is_any_of(" "));
-
-            if(split.size() < 5)
-                throw std::runtime_error("Invalid line encountered while parsing file.");
-
-            cv::RotatedRect rr(
-                cv::Point2f(std::stof(split[0]), std::stof(split[1])),
-                cv::Size2f(std::stof(split[2]), std::stof(split[3])),
-                std::stof(split[4])
-            );
-
-            Annot tmp(rr, 1.0, "");
-
-            if(size(0) > 0 && tmp.sizeCm2(false) < size(0))
+        for(const Annot& an : *annots) {
+            if(size(0) > 0 && an.sizeCm2(false) < size(0))
                 continue;
 
-            if(size(1) > 0 && tmp.sizeCm2(false) > size(1))
+            if(size(1) > 0 && an.sizeCm2(false) > size(1))
                 continue;
 
-            if(aspect(0) > 0 && tmp.aspect() < aspect(0))
+            if(aspect(0) > 0 && an.aspect() < aspect(0))
                 continue;
 
-            if(aspect(1) > 0 && tmp.aspect() > aspect(1))
+            if(aspect(1) > 0 && an.aspect() > aspect(1))
                 continue;
 
+            cv::RotatedRect rr = an.rect;
+
             if(scale != 1) {
                 rr.center.x *= scale;
                 rr.center.y *= scale;
@@ -192,34 +218,21 @@ namespace pcbdataset
             }
 
             if(cropped) {
-                cv::Rect ci = _cropinfo(rec);
                 rr.center.x -= ci.x;
                 rr.center.y -= ci.y;
             }
 
-            std::stringstream ss;
-            for(size_t i = 5; i < split.size(); i++) {
-                if(! split[i].empty()) {
-                    ss << split[i];
-                    if(i < split.size()-1)
-                        ss << " ";
-                }
-            }
-
-            ret.push_back(Annot(rr, scale, ss.str()));
+            ret.push_back(Annot(rr, scale, an.text));
         }
 
-        file.close();
-
-        _cache_ics.insert({ rec, std::move(ret) });
-
-        return _cache_ics[rec];
+        return ret;
     }
 
-    cv::Rect PCB::_cropinfo(int rec)
+    cv::Rect PCB::_cropinfo(int rec) const
     {
-        if(_cache_cropinfo.count(rec) == 1)
-            return _cache_cropinfo[rec];
+        cv::Rect ret;
+        if(_cache->cropinfo(root, rec, scale, ret))
+            return ret;
 
         cv::Mat im = mask(rec);
 
@@ -233,14 +246,68 @@ namespace pcbdataset
             return ra.size.area() < rb.size.area();
         });
 
-        _cache_cropinfo.insert({ rec, cv::boundingRect(cnt[cnt.size()-1]) });
+        ret = cv::boundingRect(cnt[cnt.size()-1]);
+        _cache->cacheCropinfo(root, rec, scale, ret);
+
+        return ret;
+    }
+
+    std::shared_ptr<const std::vector<Annot> > PCB::_annotations(int rec) const
+    {
+        if(_recordings.count(rec) == 0)
+            throw std::invalid_argument("Recording does not exist.");
+
+        std::shared_ptr<const std::vector<Annot> > cached = _cache->annotations(root, rec);
+        if(cached)
+            return cached;
+
+        boost::filesystem::path fpath = _recordings.at(rec);
+        std::stringstream ss; ss << "rec" << rec << "-annot.txt";
+        fpath = fpath.parent_path() / ss.str();
+
+        if(! boost::filesystem::is_regular_file(fpath))
+            throw std::runtime_error("Annotation file does not exist.");
+
+        auto ret = std::make_shared<std::vector<Annot> >();
+
+        std::string line;
+        std::ifstream file(fpath.string());
+
+        while(std::getline(file, line)) {
+            std::vector<std::string> split;
+            boost::split(split, line, boost::is_any_of(" "));
+
+            if(split.size() < 5)
+                throw std::runtime_error("Invalid line encountered while parsing file.");
+
+            cv::RotatedRect rr(
+                cv::Point2f(std::stof(split[0]), std::stof(split[1])),
+                cv::Size2f(std::stof(split[2]), std::stof(split[3])),
+                std::stof(split[4])
+            );
+
+            std::stringstream ss;
+            for(size_t i = 5; i < split.size(); i++) {
+                if(! split[i].empty()) {
+                    ss << split[i];
+                    if(i < split.size()-1)
+                        ss << " ";
+                }
+            }
+
+            ret->push_back(Annot(rr, 1.0, ss.str()));
+        }
+
+        file.close();
 
-        return _cache_cropinfo[rec];
+        return _cache->cacheAnnotations(root, rec, ret);
     }
 
 
 
-    PCBDataset::PCBDataset(const std::string& root) : root(root)
+    PCBDataset::PCBDataset(const std::string& root) :
+        root(root),
+        _cache(std::make_shared<DatasetCache>())
     {
         if(! boost::filesystem::is_directory(root))
             throw std::invalid_argument("Root path is not a directory.");
@@ -282,6 +349,134 @@ namespace pcbdataset
         if(_pcbPaths.count(id) == 0)
             throw std::invalid_argument("PCB does not exist.");
 
-        return PCB(_pcbPaths.at(id).string(), scale);
+        return PCB(_pcbPaths.at(id).string(), scale, _cache);
+    }
+
+
+
+    Loader::Request::Request(int pcb, int rec, float scale, Type type) :
+        pcb(pcb),
+        rec(rec),
+        scale(scale),
+        type(type)
+    { }
+
+    Loader::Loader(const PCBDataset& dataset, int numThreads, int maxPending) :
+        _dataset(dataset),
+        _maxPending(maxPending),
+        _stop(false)
+    {
+        if(numThreads < 1)
+            throw std::invalid_argument("Number of threads must be >= 1.");
+
+        if(maxPending < 1)
+            throw std::invalid_argument("Maximum number of pending requests must be >= 1.");
+
+        for(int i = 0; i < numThreads; i++)
+            _threads.emplace_back(&Loader::_work, this);
+    }
+
+    Loader::~Loader()
+    {
+        {
+            std::lock_guard<std::mutex> lock(_tasksMutex);
+            _stop = true;
+        }
+
+        _tasksCond.notify_all();
+        for(auto& t : _threads)
+            t.join();
+    }
+
+    std::future<cv::Mat> Loader::submit(const Request& request)
+    {
+        auto task = std::make_shared<std::packaged_task<cv::Mat()> >(std::bind(&Loader::_load, this, request));
+        std::future<cv::Mat> ret = task->get_future();
+
+        {
+            std::lock_guard<std::mutex> lock(_tasksMutex);
+            _tasks.push_back([task]() { (*task)(); });
+        }
+
+        _tasksCond.notify_one();
+
+        return ret;
+    }
+
+    void Loader::start(const std::vector<Request>& requests)
+    {
+        for(auto& f : _pending)  // results of previous requests are discarded
+            f.wait();
+
+        _pending.clear();
+        _requests.assign(requests.begin(), requests.end());
+
+        while(! _requests.empty() && _pending.size() < _maxPending) {
+            _pending.push_back(submit(_requests.front()));
+            _requests.pop_front();
+        }
+    }
+
+    bool Loader::next(cv::Mat& image)
+    {
+        if(_pending.empty())
+            return false;
+
+        std::future<cv::Mat> f = std::move(_pending.front());
+        _pending.pop_front();
+
+        if(! _requests.empty()) {
+            _pending.push_back(submit(_requests.front()));
+            _requests.pop_front();
+        }
+
+        image = f.get();
+
+        return true;
+    }
+
+    std::shared_ptr<PCB> Loader::_pcb(const Request& request)
+    {
+        std::lock_guard<std::mutex> lock(_pcbsMutex);
+
+        auto key = std::make_pair(request.pcb, request.scale);
+        if(_pcbs.count(key) == 0)
+            _pcbs.insert({ key, std::make_shared<PCB>(_dataset.pcb(request.pcb, request.scale)) });
+
+        return _pcbs[key];
+    }
+
+    cv::Mat Loader::_load(const Request& request)
+    {
+        std::shared_ptr<PCB> pcb = _pcb(request);
+
+        switch(request.type) {
+            case Type::Image:
+                return pcb->image(request.rec);
+            case Type::Mask:
+                return pcb->mask(request.rec);
+            default:
+                return pcb->imageMasked(request.rec);
+        }
+    }
+
+    void Loader::_work()
+    {
+        while(true) {
+            std::function<void()> task;
+
+            {
+                std::unique_lock<std::mutex> lock(_tasksMutex);
+                _tasksCond.wait(lock, [this]() { return _stop || ! _tasks.empty(); });
+
+                if(_stop && _tasks.empty())
+                    return;
+
+                task = std::move(_tasks.front());
+                _tasks.pop_front();
+            }
+
+            task();
+        }
     }
 }
@@ -6,10 +6,20 @@
 
 #include <opencv2/core/core.hpp>
 #include <boost/filesystem.hpp>
+#include <boost/thread/shared_mutex.hpp>
 
 #include <string>
 #include <vector>
 #include <unordered_map>
+#include <map>
+#include <tuple>
+#include <deque>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <future>
+#include <functional>
+#include <condition_variable>
 
 namespace pcbdataset
 {
@@ -45,6 +55,55 @@ namespace pcbdataset
 
 
 
+    /// Crop regions and parsed annotations, shared by all PCB objects of a dataset.
+    /// All methods are thread-safe.
+    class DatasetCache
+    {
+    public :
+
+        /// Returns whether the crop region of the given recording is cached.
+        /// @param pcb PCB root directory path.
+        /// @param rec recording ID.
+        /// @param scale scale factor.
+        /// @param rect the cached crop region.
+        bool cropinfo(const boost::filesystem::path& pcb, int rec, float scale, cv::Rect& rect) const;
+
+        /// Caches the crop region of the given recording.
+        /// @param pcb PCB root directory path.
+        /// @param rec recording ID.
+        /// @param scale scale factor.
+        /// @param rect crop region.
+        void cacheCropinfo(const boost::filesystem::path& pcb, int rec, float scale, const cv::Rect& rect);
+
+        /// Returns the cached annotations (unscaled and unfiltered) of the given recording, nullptr if not cached.
+        /// @param pcb PCB root directory path.
+        /// @param rec recording ID.
+        std::shared_ptr<const std::vector<Annot> > annotations(const boost::filesystem::path& pcb, int rec) const;
+
+        /// Caches the annotations of the given recording.
+        /// Returns the cached annotations, which differ from annots if another thread was faster.
+        /// @param pcb PCB root directory path.
+        /// @param rec recording ID.
+        /// @param annots unscaled and unfiltered annotations.
+        std::shared_ptr<const std::vector<Annot> > cacheAnnotations(const boost::filesystem::path& pcb, int rec, const std::shared_ptr<const std::vector<Annot> >& annots);
+
+        /// Removes all cached data.
+        void clear();
+
+    private :
+
+        /// Guards the caches.
+        mutable boost::shared_mutex _mutex;
+
+        /// (pcb, rec, scale) -> crop pairs.
+        std::map<std::tuple<std::string, int, float>, cv::Rect> _cropinfo;
+
+        /// (pcb, rec) -> annotations pairs.
+        std::map<std::pair<std::string, int>, std::shared_ptr<const std::vector<Annot> > > _annotations;
+    };
+
+
+
     /// A printed circuit board.
     class PCB
     {
@@ -59,7 +118,8 @@ namespace pcbdataset
         /// Constructor.
         /// @param root root directory path (no trailing /).
         /// @param scale scale factor (1 = original size).
-        PCB(const std::string& root, float scale);
+        /// @param cache cache to use, shared with other PCB objects (nullptr = create one).
+        PCB(const std::string& root, float scale, std::shared_ptr<DatasetCache> cache = nullptr);
 
         /// Returns the PCB ID.
         int id() const;
@@ -81,7 +141,7 @@ namespace pcbdataset
         /// masked by the corresponding mask and cropped to remove background.
         /// @param rec desired recording.
         /// @see recordings().
-        cv::Mat imageMasked(int rec);
+        cv::Mat imageMasked(int rec) const;
 
         /// Returns a list of IC chips as a vector of Annot objects.
         /// @param rec desired recording.
@@ -89,23 +149,25 @@ namespace pcbdataset
         /// @param size (min, max) size of returned ICs in cm^2, disregarding the scale factor (0 = all).
         /// @param aspect (min, max) aspect ratio of returned ICs (0 = all).
         /// @see recordings(), imageMasked().
-        std::vector<Annot> ics(int rec, bool cropped, cv::Vec2f size, cv::Vec2f aspect);
+        std::vector<Annot> ics(int rec, bool cropped, cv::Vec2f size, cv::Vec2f aspect) const;
 
     private :
 
         /// id -> image_path pairs.
         std::unordered_map<int, boost::filesystem::path> _recordings;
 
-        /// id -> crop pairs (cropinfo cache).
-        std::unordered_map<int, cv::Rect> _cache_cropinfo;
-
-        /// id -> ics pairs (ics cache).
-        std::unordered_map<int, std::vector<Annot> > _cache_ics;
+        /// Crop region and annotation cache.
+        std::shared_ptr<DatasetCache> _cache;
 
         /// Return (and cache) information for auto cropping a PCB image.
         /// @param rec desired recording.
         /// @see recordings().
-        cv::Rect _cropinfo(int rec);
+        cv::Rect _cropinfo(int rec) const;
+
+        /// Return (and cache) the unscaled and unfiltered annotations of a recording.
+        /// @param rec desired recording.
+        /// @see recordings().
+        std::shared_ptr<const std::vector<Annot> > _annotations(int rec) const;
     };
 
 
@@ -128,6 +190,7 @@ namespace pcbdataset
         std::vector<int> pcbIDs() const;
 
         /// Returns the PCB with the given ID.
+        /// All PCB objects of a dataset share crop region and annotation caches.
         /// @param id PCB ID
         /// @param scale scale factor (1 = original size).
         /// @see pcbIDs().
@@ -137,5 +200,115 @@ namespace pcbdataset
 
         /// ID -> PCB path pairs.
         std::unordered_map<int, boost::filesystem::path> _pcbPaths;
+
+        /// Cache shared by all PCB objects.
+        std::shared_ptr<DatasetCache> _cache;
+    };
+
+
+
+    /// Decodes images asynchronously on a pool of worker threads.
+    class Loader
+    {
+    public :
+
+        /// What to load.
+        enum class Type { Image, Mask, ImageMasked };
+
+        /// A load request.
+        struct Request
+        {
+            /// PCB ID.
+            int pcb;
+
+            /// Recording ID.
+            int rec;
+
+            /// Scale factor.
+            float scale;
+
+            /// What to load.
+            Type type;
+
+            /// Constructor.
+            /// @param pcb PCB ID.
+            /// @param rec recording ID.
+            /// @param scale scale factor.
+            /// @param type what to load.
+            Request(int pcb, int rec, float scale, Type type = Type::ImageMasked);
+        };
+
+        /// Constructor.
+        /// @param dataset dataset to load from.
+        /// @param numThreads number of worker threads.
+        /// @param maxPending maximum number of requests in flight when using start() / next().
+        Loader(const PCBDataset& dataset, int numThreads, int maxPending);
+
+        /// Destructor, waits for running requests to finish.
+        ~Loader();
+
+        Loader(const Loader&) = delete;
+        Loader& operator=(const Loader&) = delete;
+
+        /// Enqueues a request.
+        /// Returns a future that holds the loaded image or rethrows errors.
+        /// @param request what to load.
+        std::future<cv::Mat> submit(const Request& request);
+
+        /// Starts loading the given requests, replacing previously started ones.
+        /// Results are obtained via next() in request order.
+        /// @param requests what to load.
+        void start(const std::vector<Request>& requests);
+
+        /// Waits for the result of the next request passed to start().
+        /// Returns false if there are no more requests, rethrows errors.
+        /// @param image the loaded image.
+        bool next(cv::Mat& image);
+
+    private :
+
+        /// Dataset to load from.
+        const PCBDataset _dataset;
+
+        /// Maximum number of requests in flight when using start() / next().
+        const size_t _maxPending;
+
+        /// (PCB ID, scale) -> PCB pairs (shared by all threads).
+        std::map<std::pair<int, float>, std::shared_ptr<PCB> > _pcbs;
+
+        /// Guards _pcbs.
+        std::mutex _pcbsMutex;
+
+        /// Worker threads.
+        std::vector<std::thread> _threads;
+
+        /// Queued tasks.
+        std::deque<std::function<void()> > _tasks;
+
+        /// Guards _tasks and _stop.
+        std::mutex _tasksMutex;
+
+        /// Signals new tasks or stop requests.
+        std::condition_variable _tasksCond;
+
+        /// Whether the threads should terminate.
+        bool _stop;
+
+        /// Requests passed to start() that have not been submitted yet.
+        std::deque<Request> _requests;
+
+        /// Results of submitted requests passed to start(), in request order.
+        std::deque<std::future<cv::Mat> > _pending;
+
+        /// Returns the PCB object for the given request.
+        /// @param request load request.
+        std::shared_ptr<PCB> _pcb(const Request& request);
+
+        /// Loads the given request.
+        /// @param request load request.
+        cv::Mat _load(const Request& request);
+
+        /// Worker thread loop.
+        void _work();
     };
 }
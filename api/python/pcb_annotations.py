@@ -0,0 +1,140 @@
+
+'''
+Binary storage of IC annotations for the Python2 API.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Annotations are stored in recN-annot.bin files alongside recN-annot.txt: an 8 byte magic string,
+the number of ICs and the size of the label table as uint32, followed by fixed-width records of
+(cx, cy, w, h, angle) as float32, the start offsets of all labels (plus the end offset of the
+last one) as uint32 and the label table (UTF-8). Unlike the text files, coordinates keep their
+sub-pixel precision. Files are read with a few bulk reads without text parsing.
+'''
+
+import os
+import os.path
+import sys
+import array
+import struct
+import argparse
+import tempfile
+
+
+_MAGIC = b'PCBANN1\0'
+_HEADER = '<8sII'
+
+
+def _read_array(f, typecode, n):
+    '''
+    Reads n little-endian values of the given array type code from a file.
+    '''
+
+    ret = array.array(typecode)
+    ret.fromfile(f, n)
+    if sys.byteorder != 'little':
+        ret.byteswap()
+
+    return ret
+
+
+def _write_array(f, values):
+    '''
+    Writes an array in little-endian byte order to a file.
+    '''
+
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    values.tofile(f)
+
+
+def load(path):
+    '''
+    Loads annotations from a .bin file, returns a list of ([cx, cy, w, h, angle], text).
+    path: file path.
+    '''
+
+    with open(path, 'rb') as f:
+        header = f.read(struct.calcsize(_HEADER))
+        if len(header) != struct.calcsize(_HEADER):
+            raise Exception('"{}" is not a valid annotation file'.format(path))
+
+        magic, n, tsize = struct.unpack(_HEADER, header)
+        if magic != _MAGIC:
+            raise Exception('"{}" is not a valid annotation file'.format(path))
+
+        try:
+            rects = _read_array(f, 'f', 5*n)
+            offsets = _read_array(f, 'I', n+1)
+        except EOFError:
+            raise Exception('"{}" is truncated'.format(path))
+
+        table = f.read(tsize)
+        if len(table) != tsize:
+            raise Exception('"{}" is truncated'.format(path))
+
+    rects = rects.tolist()
+    return [(rects[5*i:5*i+5], table[offsets[i]:offsets[i+1]].decode('utf-8')) for i in range(n)]
+
+
+def save(path, annotations):
+    '''
+    Saves annotations to a .bin file (atomically, via a unique temporary file so that concurrent writers do not interfere).
+    path: file path.
+    annotations: list of (rect, text), rect is ((cx, cy), (w, h), angle) as in OpenCV.
+    '''
+
+    rects, offsets, table = array.array('f'), array.array('I', [0]), []
+
+    for rect, text in annotations:
+        rects.extend([rect[0][0], rect[0][1], rect[1][0], rect[1][1], rect[2]])
+
+        label = text.encode('utf-8')
+        table.append(label)
+        offsets.append(offsets[-1] + len(label))
+
+    table = b''.join(table)
+
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack(_HEADER, _MAGIC, len(offsets)-1, len(table)))
+            _write_array(f, rects)
+            _write_array(f, offsets)
+            f.write(table)
+
+        os.chmod(tmp, 0o644)  # mkstemp() creates files readable only by the owner
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+if __name__ == "__main__":
+    from pcb_dataset import PCB
+
+    parser = argparse.ArgumentParser(description='Convert recN-annot.txt files to binary recN-annot.bin files')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite existing .bin files')
+    args = parser.parse_args()
+
+    for d in sorted(os.listdir(args.root)):
+        if not d.startswith('pcb') or not os.path.isdir(os.path.join(args.root, d)):
+            continue
+
+        pcb = PCB(os.path.join(args.root, d))
+
+        for rec in sorted(pcb.recordings()):
+            src = os.path.join(pcb._root, 'rec{}-annot.txt'.format(rec))
+            dst = os.path.join(pcb._root, 'rec{}-annot.bin'.format(rec))
+            if not os.path.isfile(src) or (os.path.exists(dst) and not args.overwrite):
+                continue
+
+            try:
+                records, _ = pcb._annotations(rec, False)
+            except Exception as e:
+                print('Could not load "{}": {}'.format(src, e))
+                continue
+
+            save(dst, [(((r[0], r[1]), (r[2], r[3]), r[4]), text) for r, text in records])
+            print('{}: {} ICs ({} -> {} bytes)'.format(src, len(records), os.path.getsize(src), os.path.getsize(dst)))
@@ -0,0 +1,222 @@
+
+'''
+Data augmentation for training on the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Rotation, scaling, flipping, shifting and perspective distortion are composed into a single 3x3
+matrix that maps full-resolution image coordinates to output coordinates. Images are decoded at
+the smallest JPEG reduction that still provides the output resolution and warped only once,
+directly to the output size. The corners of all IC boxes are transformed in one call.
+samples() loads (optionally augmented) samples in parallel worker processes.
+'''
+
+import os.path
+import random
+import multiprocessing
+
+from pcb_dataset import PCB, Annot, cv2, np
+from pcb_export import bounded_imap
+from pcb_geometry import as_rects, transform_rects
+
+
+# reduction factor -> (image flag, mask flag)
+_REDUCED = {
+    1: ('IMREAD_COLOR', 'IMREAD_GRAYSCALE'),
+    2: ('IMREAD_REDUCED_COLOR_2', 'IMREAD_REDUCED_GRAYSCALE_2'),
+    4: ('IMREAD_REDUCED_COLOR_4', 'IMREAD_REDUCED_GRAYSCALE_4'),
+    8: ('IMREAD_REDUCED_COLOR_8', 'IMREAD_REDUCED_GRAYSCALE_8')
+}
+
+
+def _translation(tx, ty):
+    '''
+    Returns a 3x3 translation matrix.
+    '''
+
+    return np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]], dtype=np.float64)
+
+
+class Augmentation:
+
+    '''
+    A random geometric transformation of images and IC annotations.
+    '''
+
+    def __init__(self, size=(512, 512), rotation=0, scale=(1, 1), shift=0, perspective=0, flip=False, cropped=True):
+        '''
+        Constructor.
+        size: (width, height) of output images.
+        rotation: maximum rotation in degrees (uniform in [-rotation, rotation]).
+        scale: (min, max) scale factor relative to fitting the PCB into the output image.
+        shift: maximum shift as a fraction of the output size.
+        perspective: strength of the random perspective distortion (0 = affine transforms only).
+        flip: whether to flip images horizontally with a probability of 0.5.
+        cropped: whether to fit the PCB (the bounding box of the mask) or the whole image into the output image.
+        '''
+
+        self.size = size
+        self.rotation = rotation
+        self.scale = scale
+        self.shift = shift
+        self.perspective = perspective
+        self.flip = flip
+        self.cropped = cropped
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'Augmentation to {}x{}, rotation {}, scale {}, shift {}, perspective {}, flip {}'.format(
+            self.size[0], self.size[1], self.rotation, self.scale, self.shift, self.perspective, self.flip)
+
+    def matrix(self, region, rng):
+        '''
+        Returns a random 3x3 matrix that maps the given image region to the output image.
+        region: (x, y, w, h) of the source region.
+        rng: numpy RandomState.
+        '''
+
+        x, y, w, h = region
+        ow, oh = self.size
+
+        s = min(float(ow)/w, float(oh)/h) * rng.uniform(self.scale[0], self.scale[1])
+        a = np.deg2rad(rng.uniform(-self.rotation, self.rotation))
+        f = -1 if self.flip and rng.rand() < 0.5 else 1
+
+        M = np.array([[f*s*np.cos(a), -s*np.sin(a), 0], [f*s*np.sin(a), s*np.cos(a), 0], [0, 0, 1]])
+        M = M.dot(_translation(-(x + w/2.0), -(y + h/2.0)))
+
+        if self.perspective > 0:
+            P = np.eye(3)
+            P[2, :2] = rng.uniform(-self.perspective, self.perspective, 2) / max(ow, oh)
+            M = P.dot(M)
+
+        dx, dy = rng.uniform(-self.shift, self.shift, 2) * (ow, oh)
+        return _translation(ow/2.0 + dx, oh/2.0 + dy).dot(M)
+
+    def apply(self, pcb, rec, rng=None):
+        '''
+        Returns the augmented masked image of a recording and its ICs (a list of Annot objects) in output coordinates.
+        The scale factor of the PCB is ignored, ICs may lie partially or completely outside the output image.
+        pcb: PCB object.
+        rec: recording ID.
+        rng: numpy RandomState (None = global state).
+        '''
+
+        rng = rng or np.random
+        if pcb._scale != 1:
+            pcb = PCB(pcb._root, 1, pcb._stats)
+
+        small = self._read(pcb, rec, 8, True)
+
+        if self.cropped:
+            x, y, w, h = cv2.boundingRect(cv2.findNonZero(small))
+            region = (8*x, 8*y, 8*w, 8*h)
+        else:
+            region = (0, 0, 8*small.shape[1], 8*small.shape[0])
+
+        M = self.matrix(region, rng)
+
+        # decode at the smallest reduction that does not undersample the output
+
+        s = np.sqrt(abs(np.linalg.det(M[:2, :2])))
+        r = max([f for f in (1, 2, 4, 8) if f*s <= 1] or [1])
+
+        Mr = M.dot(np.diag([r, r, 1.0]))
+        mask = self._warp(small if r == 8 else self._read(pcb, rec, r, True), Mr, cv2.INTER_NEAREST)
+        im = self._warp(self._read(pcb, rec, r, False), Mr, cv2.INTER_LINEAR)
+
+        t = pcb._tic()
+        im[mask == 0] = 0
+        pcb._toc('mask', t)
+
+        ics = pcb.ics(rec)
+        rects = transform_rects(as_rects(ics), M, False)
+
+        return im, [Annot(((r[0], r[1]), (r[2], r[3]), r[4]), s, ic.text) for r, ic in zip(rects.tolist(), ics)]
+
+    def _read(self, pcb, rec, r, mask):
+        '''
+        Returns the image or mask of a recording, decoded at a reduced size.
+        pcb: PCB object.
+        rec: recording ID.
+        r: reduction factor (1, 2, 4 or 8).
+        mask: whether to read the mask.
+        '''
+
+        if mask:
+            if pcb._mask_rle_path(rec) is not None:
+                return pcb.mask_rle(rec).decode(1.0/r)
+
+        fpath = os.path.join(pcb._root, 'rec{}{}'.format(rec, '-mask.png' if mask else '.jpg'))
+        im = pcb._imread(fpath, getattr(cv2, _REDUCED[r][1 if mask else 0]))
+        if im is None or im.size == 0:
+            raise Exception('Could not load the {}'.format('mask' if mask else 'image'))
+
+        return im
+
+    def _warp(self, im, M, interpolation):
+        '''
+        Warps an image to the output size.
+        im: image.
+        M: 3x3 matrix.
+        interpolation: OpenCV interpolation flag.
+        '''
+
+        if M[2, 0] == 0 and M[2, 1] == 0:
+            return cv2.warpAffine(im, M[:2], self.size, flags=interpolation)
+
+        return cv2.warpPerspective(im, M, self.size, flags=interpolation)
+
+
+def load_sample(task):
+    '''
+    Returns (PCB ID, recording ID, image, ICs) of a single recording.
+    task: (PCB root, recording ID, scale factor, Augmentation or None, seed).
+    '''
+
+    root, rec, scale, augmentation, seed = task
+
+    pcb = PCB(root, scale)
+    if augmentation is None:
+        return pcb.id(), rec, pcb.image_masked(rec), pcb.ics(rec, True)
+
+    rng = np.random.RandomState(hash((seed, pcb.id(), rec)) & 0xffffffff)
+    im, ics = augmentation.apply(pcb, rec, rng)
+
+    return pcb.id(), rec, im, ics
+
+
+def samples(db, scale=1, augmentation=None, processes=None, shuffle=False, seed=0):
+    '''
+    Generator function for returning (PCB ID, recording ID, image, ICs) of all annotated recordings, loaded by worker processes.
+    Without augmentation, images and ICs are as returned by PCB.image_masked() and PCB.ics(rec, True).
+    db: PCBDataset.
+    scale: scale factor (ignored if augmentation is used).
+    augmentation: Augmentation object (None = no augmentation).
+    processes: number of worker processes (None = number of CPUs).
+    shuffle: whether to return samples in random order.
+    seed: seed for shuffling and augmentation, use a different one per epoch to obtain different samples.
+    '''
+
+    tasks = []
+    for id in db.pcb_ids():
+        root = db._pcb_paths[id]
+        pcb = PCB(root)
+        for rec in sorted(pcb.recordings()):
+            if pcb.has_annotations(rec):
+                tasks.append((root, rec, scale, augmentation, seed))
+
+    if shuffle:
+        random.Random(seed).shuffle(tasks)
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        for s in bounded_imap(pool, load_sample, tasks, 2*processes):
+            yield s
+    finally:
+        pool.terminate()
+        pool.join()
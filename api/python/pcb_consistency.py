@@ -0,0 +1,143 @@
+
+'''
+Check the consistency of IC annotations between the recordings of each PCB of the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+The ICs of every recording are projected into all other recordings of the same PCB using the
+stored homographies (see pcb_registration.py) and compared to the ICs annotated there via the
+IoU of all pairs of boxes at once. ICs without a counterpart of sufficient overlap are reported
+as mismatched (misaligned box) or missing (no overlapping box although the projected IC lies on
+the board), overlapping boxes within a recording as duplicated and matched ICs with different
+labels as such. PCBs are checked in parallel.
+'''
+
+import os.path
+import sys
+import json
+import argparse
+import multiprocessing
+
+from pcb_dataset import PCB, PCBDataset, np
+from pcb_geometry import as_rects, box_points, polygon_iou, transform_points
+
+
+def check_pcb(task):
+    '''
+    Checks the annotations of all recordings of a PCB, returns a list of issues (dicts).
+    task: (PCB root, minimum IoU of matching ICs, maximum IoU of ICs within a recording).
+    '''
+
+    root, min_iou, max_dup_iou = task
+
+    pcb = PCB(root)
+    recs = [r for r in sorted(pcb.recordings()) if pcb.has_annotations(r)]
+
+    ics, corners, masks = {}, {}, {}
+    for r in recs:
+        ics[r] = pcb.ics(r)
+        corners[r] = box_points(as_rects(ics[r]))
+
+    ret = []
+
+    def issue(kind, rec, i, **kwargs):
+        kwargs.update({'pcb': pcb.id(), 'rec': rec, 'ic': i, 'text': ics[rec][i].text, 'type': kind})
+        ret.append(kwargs)
+
+    for a in recs:
+        iou = polygon_iou(corners[a], corners[a])
+        for i, j in zip(*np.nonzero(np.triu(iou, 1) > max_dup_iou)):
+            issue('duplicated', a, int(i), other_ic=int(j), iou=float(iou[i, j]))
+
+    for a in recs:
+        for b in recs:
+            if a == b or len(corners[a]) == 0:
+                continue
+
+            H = pcb.homography(a, b)
+            if H is None:
+                issue('unregistered', a, 0, other_rec=b)
+                continue
+
+            if b not in masks:
+                if any(os.path.isfile(os.path.join(root, 'rec{}-mask.{}'.format(b, e))) for e in ('png', 'rle')):
+                    rle = pcb.mask_rle(b)
+                    masks[b] = (rle.decode(0.125), rle.shape)
+                else:  # use the image bounds
+                    masks[b] = (np.ones((1, 1), dtype=np.uint8), pcb.image(b).shape[:2])
+
+            proj = transform_points(corners[a], H)
+            iou = polygon_iou(proj, corners[b])
+
+            best = iou.argmax(axis=1) if iou.shape[1] > 0 else np.zeros(len(proj), dtype=np.int64)
+            best_iou = iou.max(axis=1) if iou.shape[1] > 0 else np.zeros(len(proj))
+
+            # only ICs whose projected center lies on the board are expected to be annotated
+
+            mask, shape = masks[b]
+            c = proj.mean(axis=1)
+            x = np.clip(np.floor(c[:, 0] * mask.shape[1] / shape[1]).astype(np.int64), 0, mask.shape[1]-1)
+            y = np.clip(np.floor(c[:, 1] * mask.shape[0] / shape[0]).astype(np.int64), 0, mask.shape[0]-1)
+            visible = (c[:, 0] >= 0) & (c[:, 1] >= 0) & (c[:, 0] < shape[1]) & (c[:, 1] < shape[0]) & (mask[y, x] > 0)
+
+            for i in range(len(proj)):
+                if best_iou[i] >= min_iou:
+                    if ics[a][i].text != ics[b][best[i]].text:
+                        issue('label differs', a, i, other_rec=b, other_ic=int(best[i]), other_text=ics[b][best[i]].text)
+                elif best_iou[i] > 0:
+                    issue('mismatched', a, i, other_rec=b, other_ic=int(best[i]), iou=float(best_iou[i]))
+                elif visible[i]:
+                    issue('missing', a, i, other_rec=b)
+
+    return ret
+
+
+def check(db, min_iou=0.5, max_dup_iou=0.5, processes=None, callback=None):
+    '''
+    Checks all PCBs of a dataset, returns a list of issues (dicts with keys 'pcb', 'rec', 'ic', 'text', 'type' and depending on the type
+    'other_rec', 'other_ic', 'other_text' and 'iou'). ICs are referenced by their index in PCB.ics() without filters.
+    db: PCBDataset.
+    min_iou: minimum IoU between a projected IC and its counterpart.
+    max_dup_iou: maximum IoU between ICs of the same recording.
+    processes: number of worker processes (None = number of CPUs).
+    callback: optional function that is called with the issues of every PCB.
+    '''
+
+    tasks = [(db._pcb_paths[id], min_iou, max_dup_iou) for id in db.pcb_ids()]
+    ret = []
+
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for issues in pool.imap_unordered(check_pcb, tasks):
+            ret.extend(issues)
+            if callback is not None:
+                callback(issues)
+    finally:
+        pool.close()
+        pool.join()
+
+    ret.sort(key=lambda e: (e['pcb'], e['rec'], e['ic'], e.get('other_rec', 0)))
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the consistency of IC annotations between recordings of the same PCB')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--min-iou', type=float, dest='min_iou', default=0.5, help='Minimum IoU between a projected IC and its counterpart')
+    parser.add_argument('--max-dup-iou', type=float, dest='max_dup_iou', default=0.5, help='Maximum IoU between ICs of the same recording')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--report', type=str, dest='report', help='Write the issues to this JSON file')
+    args = parser.parse_args()
+
+    issues = check(PCBDataset(args.root), args.min_iou, args.max_dup_iou, args.processes)
+
+    for e in issues:
+        other = ' (rec {})'.format(e['other_rec']) if 'other_rec' in e else ''
+        print('PCB {} rec {} IC {} "{}": {}{}'.format(e['pcb'], e['rec'], e['ic'], e['text'], e['type'], other))
+
+    print('{} issues'.format(len(issues)))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(issues, f, indent=2, sort_keys=True)
+
+    sys.exit(1 if issues else 0)
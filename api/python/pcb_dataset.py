@@ -4,12 +4,318 @@ Python2 API for the PCB DSLR dataset.
 ~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
 '''
 
-import cv2
-import numpy as np
-
 import os
 import os.path
 import argparse
+import importlib
+import collections
+import threading
+import timeit
+
+
+class _LazyModule:
+
+    '''
+    A module that is imported on first attribute access.
+    This keeps importing this file and metadata access (PCB IDs, recordings, annotations) cheap.
+    '''
+
+    def __init__(self, name):
+        '''
+        Constructor.
+        name: module name.
+        '''
+
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        '''
+        Imports the module if necessary and returns the requested attribute.
+        '''
+
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attr)
+
+
+cv2 = _LazyModule('cv2')
+np = _LazyModule('numpy')
+pcb_masks = _LazyModule('pcb_masks')
+pcb_index = _LazyModule('pcb_index')
+pcb_registration = _LazyModule('pcb_registration')
+pcb_augment = _LazyModule('pcb_augment')
+pcb_annotations = _LazyModule('pcb_annotations')
+pcb_watch = _LazyModule('pcb_watch')
+pcb_geometry = _LazyModule('pcb_geometry')
+pcb_split = _LazyModule('pcb_split')
+
+
+class Stats:
+
+    '''
+    Instrumentation data: number of calls, cumulative wall time and bytes read per operation,
+    and hits / misses per cache. Stats objects can be pickled and merged, e.g. to aggregate
+    the stats of worker processes.
+
+    Operations are 'read' (file I/O), 'decode' (image decoding), 'resize', 'mask' (masking and cropping),
+    'parse' (annotation parsing) and 'cropinfo' (crop region computation).
+    '''
+
+    def __init__(self, callback=None):
+        '''
+        Constructor.
+        callback: optional function that is called with (operation, seconds, bytes) after every operation.
+        '''
+
+        self.ops = {}
+        self.caches = {}
+        self._callback = callback
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        lines = ['Stats']
+        for op in sorted(self.ops):
+            o = self.ops[op]
+            lines.append(' {}: {} calls, {:.3f} s, {} bytes'.format(op, o['calls'], o['time'], o['bytes']))
+
+        for c in sorted(self.caches):
+            lines.append(' {} cache: {:.1f}% hits ({} / {})'.format(c, 100*self.hit_rate(c), self.caches[c]['hits'], self.caches[c]['hits'] + self.caches[c]['misses']))
+
+        return '\n'.join(lines)
+
+    def __getstate__(self):
+        '''
+        Returns the state for pickling (without callback and lock).
+        '''
+
+        return {'ops': self.ops, 'caches': self.caches}
+
+    def __setstate__(self, state):
+        '''
+        Restores the state after unpickling.
+        '''
+
+        self.ops = state['ops']
+        self.caches = state['caches']
+        self._callback = None
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds, nbytes=0):
+        '''
+        Records an operation.
+        op: operation name.
+        seconds: wall time.
+        nbytes: number of bytes read.
+        '''
+
+        with self._lock:
+            o = self.ops.setdefault(op, {'calls': 0, 'time': 0.0, 'bytes': 0})
+            o['calls'] += 1
+            o['time'] += seconds
+            o['bytes'] += nbytes
+
+        if self._callback is not None:
+            self._callback(op, seconds, nbytes)
+
+    def record_cache(self, cache, hit):
+        '''
+        Records a cache access.
+        cache: cache name.
+        hit: whether the access was a hit.
+        '''
+
+        with self._lock:
+            c = self.caches.setdefault(cache, {'hits': 0, 'misses': 0})
+            c['hits' if hit else 'misses'] += 1
+
+    def hit_rate(self, cache):
+        '''
+        Returns the hit rate of the given cache (0 if it was never accessed).
+        cache: cache name.
+        '''
+
+        c = self.caches.get(cache, {'hits': 0, 'misses': 0})
+        total = c['hits'] + c['misses']
+
+        return float(c['hits']) / total if total > 0 else 0.0
+
+    def merge(self, other):
+        '''
+        Adds the counters of another Stats object to this one.
+        other: Stats object.
+        '''
+
+        with self._lock:
+            for op, o in other.ops.items():
+                t = self.ops.setdefault(op, {'calls': 0, 'time': 0.0, 'bytes': 0})
+                for k in t:
+                    t[k] += o[k]
+
+            for cache, c in other.caches.items():
+                t = self.caches.setdefault(cache, {'hits': 0, 'misses': 0})
+                for k in t:
+                    t[k] += c[k]
+
+        return self
+
+    def reset(self):
+        '''
+        Resets all counters.
+        '''
+
+        with self._lock:
+            self.ops = {}
+            self.caches = {}
+
+
+class FrameCache:
+
+    '''
+    Thread-safe LRU cache of decoded images with a budget in bytes (not items).
+    Cached images are read-only, so they can be returned without copying.
+    '''
+
+    def __init__(self, max_bytes, stats=None):
+        '''
+        Constructor.
+        max_bytes: maximum total size of cached images in bytes.
+        stats: Stats object for recording hits and misses (cache 'frames', None = disabled).
+        '''
+
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._bytes = 0
+        self._items = collections.OrderedDict()
+        self._stats = stats
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'FrameCache ({} images, {:.1f} / {:.1f} MB, {} hits, {} misses)'.format(
+            len(self._items), self._bytes / 1048576.0, self.max_bytes / 1048576.0, self.hits, self.misses)
+
+    def __len__(self):
+        '''
+        Returns the number of cached images.
+        '''
+
+        return len(self._items)
+
+    def nbytes(self):
+        '''
+        Returns the total size of cached images in bytes.
+        '''
+
+        return self._bytes
+
+    def get(self, key):
+        '''
+        Returns the cached image for key, None if not cached.
+        '''
+
+        with self._lock:
+            im = self._items.pop(key, None)
+            if im is not None:
+                self._items[key] = im  # most recently used
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if self._stats is not None:
+            self._stats.record_cache('frames', im is not None)
+
+        return im
+
+    def put(self, key, im):
+        '''
+        Adds an image, evicting the least recently used ones if necessary. Returns the image, made read-only.
+        Images larger than the budget are not cached.
+        '''
+
+        im.flags.writeable = False
+
+        with self._lock:
+            if key in self._items or im.nbytes > self.max_bytes:
+                return im
+
+            self._items[key] = im
+            self._bytes += im.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= old.nbytes
+
+        return im
+
+    def clear(self):
+        '''
+        Removes all images and resets the hit and miss counters.
+        '''
+
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class Workspace:
+
+    '''
+    Reusable per-thread buffers for PCB.image(), PCB.mask() and PCB.image_masked() (see their out parameter).
+    Buffers grow to the largest requested size and are reused afterwards. They hold the raw file data, resized
+    images and masks, masks decoded from .rle files and masked images. Decoding JPEG and PNG files still allocates,
+    as cv2.imdecode() cannot write to a given array. At scale <= 0.5 images are decoded at 1/2, 1/4 or 1/8 of their
+    size, so this allocation is at most a quarter of the full-resolution image. At scale 1 image() and PNG-based mask()
+    return the full-resolution decoded arrays. Results that are views of the buffers remain valid only until the next
+    call in the same thread.
+    '''
+
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+
+        self._local = threading.local()
+
+    def buffer(self, name, shape, dtype='uint8'):
+        '''
+        Returns an uninitialized array of the given shape and type that uses the named buffer of the calling thread.
+        name: buffer name.
+        shape: array shape.
+        dtype: array type.
+        '''
+
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        dtype = np.dtype(dtype)
+
+        n = dtype.itemsize
+        for s in shape:
+            n *= s
+
+        buf = buffers.get(name)
+        if buf is None or buf.size < n:
+            buf = buffers[name] = np.empty(n, dtype=np.uint8)
+
+        return buf[:n].view(dtype).reshape(shape)
+
+    def nbytes(self):
+        '''
+        Returns the total size of the buffers of the calling thread in bytes.
+        '''
+
+        return sum(b.nbytes for b in self._local.__dict__.get('buffers', {}).values())
 
 
 class Annot:
@@ -75,11 +381,13 @@ class PCB:
     A printed circuit board.
     '''
 
-    def __init__(self, root, scale=1):
+    def __init__(self, root, scale=1, stats=None, cache=None):
         '''
         Constructor.
         root: root directory path.
         scale: scale factor (1 = original size).
+        stats: Stats object for recording instrumentation data (None = disabled).
+        cache: FrameCache for decoded images (None = disabled), if used image(), mask() and image_masked() return read-only arrays.
         '''
 
         if not os.path.isdir(root):
@@ -92,6 +400,10 @@ class PCB:
         self._scale = scale
         self._recordings = [int(os.path.splitext(p)[0][3:]) for p in os.listdir(root) if p.startswith('rec') and p.endswith('.jpg') and 'mask' not in p]
         self._cache_cropinfo = {}
+        self._cache_rle = {}  # rec -> (PNG signature, MaskRLE) of masks without .rle file
+        self._stats = stats
+        self._cache = cache
+        self._registration = None
 
     def __repr__(self):
         '''
@@ -114,55 +426,211 @@ class PCB:
 
         return self._recordings
 
-    def image(self, rec=1):
+    def image(self, rec=1, out=None):
         '''
         Returns the image of the specified recording.
+        At scale <= 0.5 the JPEG is decoded at the largest reduction (1/2, 1/4 or 1/8) that is not smaller than the result,
+        so only this reduced image is allocated before resizing. At scale 1 the full-resolution image is allocated (and
+        returned unless out is an array).
         rec: desired recording (see recordings()).
+        out: array of the right shape and type to write the image to, or a Workspace whose buffers are used where possible (see Workspace, None = allocate).
         '''
 
         if rec not in self._recordings:
             raise Exception('Recording {} does not exist for this PCB'.format(rec))
 
-        im = cv2.imread(os.path.join(self._root, 'rec{}.jpg'.format(rec)), cv2.IMREAD_UNCHANGED)
-        if im.size == 0:
+        return self._cached(rec, 'image', self._load_image, out)
+
+    def _load_image(self, rec, out):
+        '''
+        Loads the image of the specified recording.
+        '''
+
+        path = os.path.join(self._root, 'rec{}.jpg'.format(rec))
+
+        r = max([f for f in (2, 4, 8) if self._scale * f <= 1] or [1])
+        flags = getattr(cv2, 'IMREAD_REDUCED_COLOR_{}'.format(r)) | cv2.IMREAD_IGNORE_ORIENTATION if r > 1 else cv2.IMREAD_UNCHANGED
+
+        im = self._imread(path, flags, out)
+        if im is None or im.size == 0:
             raise Exception('Could not load the image')
 
-        if self._scale != 1:
-            im = cv2.resize(im, (0, 0), im, self._scale, self._scale)
+        if r == 1:
+            return self._resize(im, 'image', out)
 
-        return im
+        w, h = pcb_index.jpeg_size(path)  # the reduced size is rounded up
+        return self._resize(im, 'image', out, (h, w))
 
-    def mask(self, rec=1):
+    def mask(self, rec=1, out=None):
         '''
         Returns the mask of the specified recording.
+        Masks are read from recN-mask.rle if available and not older than recN-mask.png (see pcb_masks.py), otherwise from recN-mask.png.
+        rec: desired recording (see recordings()).
+        out: see image().
+        '''
+
+        if rec not in self._recordings:
+            raise Exception('Recording {} does not exist for this PCB'.format(rec))
+
+        return self._cached(rec, 'mask', self._load_mask, out)
+
+    def _load_mask(self, rec, out):
+        '''
+        Loads the mask of the specified recording.
+        '''
+
+        fpath = self._mask_rle_path(rec)
+        if fpath is not None:
+            t = self._tic()
+            rle = pcb_masks.MaskRLE.load(fpath)
+            self._toc('read', t, os.path.getsize(fpath) if t is not None else 0)
+
+            w, h = rle.size(self._scale)
+
+            t = self._tic()
+            im = rle.decode(self._scale, self._output(out, 'mask', (h, w), np.uint8))
+            self._toc('decode', t)
+
+            return im
+
+        im = self._imread(os.path.join(self._root, 'rec{}-mask.png'.format(rec)), cv2.IMREAD_GRAYSCALE, out)
+        if im is None or im.size == 0:
+            raise Exception('Could not load the mask')
+
+        return self._resize(im, 'mask', out)
+
+    def mask_rle(self, rec=1):
+        '''
+        Returns the mask of the specified recording in run-length encoded form (a MaskRLE object).
+        Area and bounding box are available without decoding, see MaskRLE.area() and MaskRLE.bbox().
+        The scale factor is not applied, use MaskRLE.decode(scale). If there is no up-to-date recN-mask.rle, the mask is
+        encoded from recN-mask.png and cached until the file changes.
         rec: desired recording (see recordings()).
         '''
 
         if rec not in self._recordings:
             raise Exception('Recording {} does not exist for this PCB'.format(rec))
 
-        im = cv2.imread(os.path.join(self._root, 'rec{}-mask.png'.format(rec)), cv2.IMREAD_GRAYSCALE)
-        if im.size == 0:
+        fpath = self._mask_rle_path(rec)
+        if fpath is not None:
+            return pcb_masks.MaskRLE.load(fpath)
+
+        fpath = os.path.join(self._root, 'rec{}-mask.png'.format(rec))
+        try:
+            st = os.stat(fpath)
+            sig = (st.st_size, st.st_mtime)
+        except OSError:
             raise Exception('Could not load the mask')
 
-        if self._scale != 1:
-            im = cv2.resize(im, (0, 0), im, self._scale, self._scale)
+        hit = rec in self._cache_rle and self._cache_rle[rec][0] == sig
+        if self._stats is not None:
+            self._stats.record_cache('rle', hit)
 
-        return im
+        if not hit:
+            self._cache_rle[rec] = (sig, pcb_masks.MaskRLE.encode(PCB(self._root).mask(rec)))
+
+        return self._cache_rle[rec][1]
+
+    def _mask_rle_path(self, rec):
+        '''
+        Returns the path of recN-mask.rle if it exists and is not older than recN-mask.png, None otherwise.
+        Masks are edited as PNG files (see annotate/), so an older .rle is outdated.
+        rec: desired recording (see recordings()).
+        '''
+
+        fpath = os.path.join(self._root, 'rec{}-mask.rle'.format(rec))
+        try:
+            mtime = os.stat(fpath).st_mtime
+        except OSError:
+            return None
+
+        try:
+            if mtime < os.path.getmtime(os.path.join(self._root, 'rec{}-mask.png'.format(rec))):
+                return None
+        except OSError:  # no PNG
+            pass
+
+        return fpath
+
+    def area_cm2(self, rec=1):
+        '''
+        Returns the area of the PCB in the specified recording in cm^2, disregarding the scale factor.
+        This is the exact number of mask pixels and is computed from the run-length encoded mask (see mask_rle()),
+        which requires no decoding if recN-mask.rle exists and is encoded only once per PCB object otherwise.
+        See PCBDataset.geometry() for all recordings at once, with values stored in the index.
+        rec: desired recording (see recordings()).
+        '''
+
+        return self.mask_rle(rec).area() / (87.4**2)
+
+    def min_area_rect(self, rec=1):
+        '''
+        Returns the minimum area rotated rect ((cx, cy), (w, h), angle) that encloses the PCB in the specified recording,
+        regarding the scale factor. Computed from the run-length encoded mask like area_cm2(). Compared to cv2.minAreaRect()
+        applied to the mask contour, the sides are 1 to sqrt(2) pixels longer depending on the angle and the center is offset
+        by (+0.5, +0.5) pixels, times the scale factor (see MaskRLE.min_area_rect()).
+        rec: desired recording (see recordings()).
+        '''
+
+        return self.mask_rle(rec).min_area_rect(self._scale)
 
-    def image_masked(self, rec=1):
+    def registration(self):
+        '''
+        Returns the RegistrationStore of this PCB (see pcb_registration.py), which holds homographies between recordings.
+        '''
+
+        if self._registration is None:
+            self._registration = pcb_registration.RegistrationStore(self._root)
+
+        return self._registration
+
+    def homography(self, from_rec, to_rec):
+        '''
+        Returns the 3x3 homography that maps image coordinates of a recording to those of another recording (for the scale factor of this PCB),
+        None if the recordings could not be registered. Homographies are estimated only once and stored in .pcb-registration.json.
+        from_rec: source recording (see recordings()).
+        to_rec: destination recording (see recordings()).
+        '''
+
+        for rec in (from_rec, to_rec):
+            if rec not in self._recordings:
+                raise Exception('Recording {} does not exist for this PCB'.format(rec))
+
+        return self.registration().homography(from_rec, to_rec, self._scale)
+
+    def image_masked(self, rec=1, out=None):
         '''
         Returns the image of the specified recording, masked by the corresponding mask and cropped to remove background.
         rec: desired recording (see recordings()).
+        out: see image(), with a Workspace the image and mask are loaded into its buffers as well.
+        '''
+
+        return self._cached(rec, 'masked', self._load_masked, out)
+
+    def _load_masked(self, rec, out):
+        '''
+        Computes the masked and cropped image of the specified recording from image() and mask().
         '''
 
-        im = self.image(rec)
-        mask = self.mask(rec)
+        ws = out if isinstance(out, Workspace) else None
 
-        im[mask == 0, :] = 0
-        ci = self._cropinfo(rec)
+        im = self.image(rec, ws)
+        mask = self.mask(rec, ws)
+        x, y, w, h = self._cropinfo(rec, mask)
 
-        return im[ci[1]:ci[1]+ci[3], ci[0]:ci[0]+ci[2]]
+        # copy the foreground of the crop region only, the background of the result is zero
+
+        t = self._tic()
+        ret = self._output(out, 'masked', (h, w) + im.shape[2:], im.dtype)
+        if ret is None:
+            ret = np.zeros((h, w) + im.shape[2:], dtype=im.dtype)
+        else:
+            ret[...] = 0
+
+        cv2.bitwise_and(im[y:y+h, x:x+w], im[y:y+h, x:x+w], ret, mask[y:y+h, x:x+w])
+        self._toc('mask', t)
+
+        return ret
 
     def ics(self, rec=1, cropped=False, size=(0, 0), aspect=(0, 0)):
         '''
@@ -176,23 +644,11 @@ class PCB:
         if rec not in self._recordings:
             raise Exception('Recording {} does not exist for this PCB'.format(rec))
 
-        fpath = os.path.join(self._root, 'rec{}-annot.txt'.format(rec))
-        if not os.path.isfile(fpath):
-            raise Exception('"{}" is not a file'.format(fpath))
-
-        lines = None
-        with open(fpath) as f:
-            lines = [l.strip().split() for l in f.readlines()]
+        t = self._tic()
+        records, fpath = self._annotations(rec)
 
         ret = []
-        for l in lines:
-            l = [x.strip() for x in l]
-            if len(l) < 5:
-                raise Exception('Failed to parse line "{}"'.format(l))
-
-            rect = [float(s) for s in l[:5]]
-            text = '' if len(l) == 5 else ' '.join(l[5:])
-
+        for rect, text in records:
             sz = (rect[2]/87.4, rect[3]/87.4)
             asp = max(sz[0], sz[1]) / min(sz[0], sz[1])
             sz = sz[0]*sz[1]
@@ -222,18 +678,70 @@ class PCB:
 
             ret.append(Annot((tuple(rect[0:2]), tuple(rect[2:4]), rect[4]), self._scale, text))
 
+        self._toc('parse', t, os.path.getsize(fpath) if t is not None else 0)
+
         return ret
 
-    def _cropinfo(self, rec):
+    def has_annotations(self, rec=1):
+        '''
+        Returns whether the specified recording is annotated, i.e. whether recN-annot.txt or recN-annot.bin exists (see ics()).
+        rec: desired recording (see recordings()).
+        '''
+
+        return any(os.path.isfile(os.path.join(self._root, 'rec{}-annot.{}'.format(rec, e))) for e in ('txt', 'bin'))
+
+    def _annotations(self, rec, binary=True):
+        '''
+        Reads the annotations of a recording, returns a list of ([cx, cy, w, h, angle], text) and the path of the file read.
+        recN-annot.bin is used if available and not older than recN-annot.txt (see pcb_annotations.py).
+        rec: desired recording (see recordings()).
+        binary: whether to consider binary files.
+        '''
+
+        fpath = os.path.join(self._root, 'rec{}-annot.txt'.format(rec))
+        bpath = os.path.join(self._root, 'rec{}-annot.bin'.format(rec))
+
+        if binary:
+            try:
+                bmtime = os.stat(bpath).st_mtime
+            except OSError:
+                bmtime = None
+
+            if bmtime is not None and (not os.path.isfile(fpath) or bmtime >= os.path.getmtime(fpath)):
+                return pcb_annotations.load(bpath), bpath
+
+        try:
+            with open(fpath) as f:
+                lines = [l.strip().split() for l in f.readlines()]
+        except IOError:
+            raise Exception('"{}" is not a file'.format(fpath))
+
+        ret = []
+        for l in lines:
+            l = [x.strip() for x in l]
+            if len(l) < 5:
+                raise Exception('Failed to parse line "{}"'.format(l))
+
+            ret.append(([float(s) for s in l[:5]], '' if len(l) == 5 else ' '.join(l[5:])))
+
+        return ret, fpath
+
+    def _cropinfo(self, rec, mask=None):
         '''
         Return (and cache) information for auto cropping a PCB image.
         rec: desired recording (see recordings()).
+        mask: the mask of the recording if already loaded.
         '''
 
+        if self._stats is not None:
+            self._stats.record_cache('cropinfo', rec in self._cache_cropinfo)
+
         if rec in self._cache_cropinfo:
             return self._cache_cropinfo[rec]
 
-        im = self.mask(rec)
+        im = self.mask(rec) if mask is None else mask
+
+        t = self._tic()
         cnt, _ = cv2.findContours(im, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
 
         if len(cnt) > 1:  # use largest region if there are multiple
@@ -245,9 +753,145 @@ class PCB:
 
         cx, cy, cw, ch = cv2.boundingRect(cnt[0])
         self._cache_cropinfo[rec] = (cx, cy, cw, ch)
+        self._toc('cropinfo', t)
 
         return self._cache_cropinfo[rec]
 
+    def _cached(self, rec, kind, load, out=None):
+        '''
+        Returns an image from the cache, loading and caching it on a miss.
+        The cache key includes the size and modification time of the image and mask files, so changed files are reloaded.
+        rec: desired recording (see recordings()).
+        kind: 'image', 'mask' or 'masked'.
+        load: function(rec, out) that loads the image.
+        out: see image(), cached images are copied to arrays and returned as they are for workspaces.
+        '''
+
+        if self._cache is None:
+            return load(rec, out)
+
+        sig = []
+        for suffix in ('.jpg', '-mask.png', '-mask.rle'):
+            try:
+                st = os.stat(os.path.join(self._root, 'rec{}{}'.format(rec, suffix)))
+                sig.append((st.st_size, st.st_mtime))
+            except OSError:
+                sig.append(None)
+
+        key = (self._root, rec, kind, self._scale, tuple(sig))
+
+        im = self._cache.get(key)
+        if im is None:
+            if out is not None and not isinstance(out, Workspace):
+                return load(rec, out)
+
+            im = self._cache.put(key, load(rec, None))
+
+        if out is None or isinstance(out, Workspace):
+            return im
+
+        ret = self._output(out, kind, im.shape, im.dtype)
+        ret[...] = im
+
+        return ret
+
+    def _output(self, out, name, shape, dtype):
+        '''
+        Returns the array to write a result to (None = allocate a new one).
+        out: see image().
+        name: buffer name if out is a Workspace.
+        shape: shape of the result.
+        dtype: type of the result.
+        '''
+
+        if out is None:
+            return None
+
+        if isinstance(out, Workspace):
+            return out.buffer(name, shape, dtype)
+
+        if out.shape != tuple(shape) or out.dtype != dtype:
+            raise Exception('out must be an array of shape {} and type {}'.format(tuple(shape), np.dtype(dtype)))
+
+        return out
+
+    def _resize(self, im, name, out, full=None):
+        '''
+        Applies the scale factor to a loaded image or mask, writing the result to out (see image()).
+        full: (height, width) of the full-resolution image if im was decoded at a reduced size.
+        '''
+
+        if self._scale == 1:
+            if out is None or isinstance(out, Workspace):  # already a new array, copying it to a buffer would not avoid the allocation
+                return im
+
+            ret = self._output(out, name, im.shape, im.dtype)
+            ret[...] = im
+
+            return ret
+
+        # same size as computed by cv2.resize() from the full-resolution image, cv2.resize() writes to dst if it fits
+        h, w = full or im.shape[:2]
+        shape = (int(round(h*self._scale)), int(round(w*self._scale))) + im.shape[2:]
+
+        t = self._tic()
+        if full is None:
+            im = cv2.resize(im, (0, 0), self._output(out, name, shape, im.dtype), self._scale, self._scale)
+        else:
+            im = cv2.resize(im, (shape[1], shape[0]), self._output(out, name, shape, im.dtype))
+        self._toc('resize', t)
+
+        return im
+
+    def _imread(self, path, flags, out=None):
+        '''
+        Loads an image like cv2.imread(), recording file I/O and decoding separately if instrumentation is enabled.
+        path: image file path.
+        flags: cv2.IMREAD_* flags.
+        out: if a Workspace, the file is read into its buffer.
+        '''
+
+        if self._stats is None and not isinstance(out, Workspace):
+            return cv2.imread(path, flags)
+
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        t = self._tic()
+        with f:
+            if isinstance(out, Workspace):
+                data = out.buffer('file', (os.fstat(f.fileno()).st_size,))
+                data = data[:f.readinto(data)]
+            else:
+                data = f.read()
+        self._toc('read', t, len(data))
+
+        t = self._tic()
+        im = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        self._toc('decode', t)
+
+        return im
+
+    def _tic(self):
+        '''
+        Returns the current time if instrumentation is enabled, None otherwise.
+        '''
+
+        return timeit.default_timer() if self._stats is not None else None
+
+    def _toc(self, op, t, nbytes=0):
+        '''
+        Records an operation that started at time t (see _tic()).
+        op: operation name.
+        t: start time as returned by _tic().
+        nbytes: number of bytes read.
+        '''
+
+        if t is not None:
+            self._stats.record(op, timeit.default_timer() - t, nbytes)
+
 
 class PCBDataset:
 
@@ -255,21 +899,141 @@ class PCBDataset:
     A PCB dataset.
     '''
 
-    def __init__(self, root):
+    def __init__(self, root, instrument=False, callback=None, index='', cache_bytes=0):
         '''
         Constructor.
         root: root path to the dataset.
+        instrument: whether to record instrumentation data (see stats()).
+        callback: optional function that is called with (operation, seconds, bytes) after every operation, enables instrumentation.
+        index: path of the index file (see index(), '' = .pcb-index.json in root, None = do not persist).
+        cache_bytes: size of the cache for decoded images shared by all PCBs obtained from this dataset (see cache(), 0 = disabled).
         '''
 
         if not os.path.isdir(root):
             raise Exception('Path "{}" is not a directory'.format(root))
 
         self._root = root
+        self._pcb_paths = self._scan()
+
+        self._stats = Stats(callback) if instrument or callback is not None else None
+        self._index_path = os.path.join(root, '.pcb-index.json') if index == '' else index
+        self._index = None
+        self._refresh_lock = threading.Lock()
+        self._cache = FrameCache(cache_bytes, self._stats) if cache_bytes > 0 else None
+
+    def stats(self):
+        '''
+        Returns instrumentation data of all PCBs obtained from this dataset as a Stats object (None if disabled).
+        '''
+
+        return self._stats
+
+    def cache(self):
+        '''
+        Returns the FrameCache of decoded images (None if disabled). Hits and misses are also recorded in stats() as cache 'frames'.
+        Images, masks and masked images of a (PCB, recording, scale) are decoded only once while cached,
+        and are returned as read-only arrays (copy them before modifying).
+        '''
+
+        return self._cache
+
+    def index(self, update=True, fields=(), processes=1):
+        '''
+        Returns the metadata index of the dataset (a pcb_index.DatasetIndex object).
+        The index is loaded from disk or built on first access. Like refresh(), updates are done on a copy
+        that then replaces the current index, so the returned object is never modified by other threads.
+        update: whether to synchronize the index with the dataset first (only rescans changed files).
+        fields: names of fields to compute if update is True, see pcb_index.DatasetIndex.update().
+        processes: number of worker processes for computing changed fields (None = number of CPUs).
+        '''
+
+        with self._refresh_lock:
+            if self._index is None:
+                index, update = pcb_index.DatasetIndex(self, self._index_path), True  # not shared yet, updated in place
+            else:
+                index = self._index.copy() if update else self._index
 
-        self._pcb_paths = {}
-        for p in [os.path.join(root, f) for f in os.listdir(root) if f.startswith('pcb') and os.path.isdir(os.path.join(root, f))]:
+            if update:
+                index.update(processes=processes, fields=fields)
+
+            self._index = index
+
+        return index
+
+    def refresh(self, pcbs=None, processes=1):
+        '''
+        Picks up added, changed and removed PCBs and recordings, returns the set of (pcb, rec) pairs whose index records changed.
+        Only changed fields of the given PCBs are recomputed. This is done on a copy of the index that then replaces the
+        current one, so other threads always see a consistent index. Does not build the index if it was not used before.
+        pcbs: IDs of PCBs to rescan (None = all).
+        processes: number of worker processes for computing changed fields (None = number of CPUs).
+        '''
+
+        with self._refresh_lock:
+            self._pcb_paths = self._scan()
+            if self._index is None:
+                return set()
+
+            index = self._index.copy()
+            updated = index.update(pcbs, processes)
+            self._index = index
+
+        return updated
+
+    def watch(self, interval=2.0, callback=None, processes=1, error_callback=None):
+        '''
+        Starts watching the dataset for changes in a background thread that calls refresh() for affected PCBs,
+        returns the pcb_watch.Watcher object (call stop() to stop watching).
+        interval: seconds between scans (maximum reaction time if inotify is available).
+        callback: optional function that is called with (changed files, updated (pcb, rec) pairs) after every refresh.
+        processes: see refresh().
+        error_callback: optional function that is called with the exception if a refresh fails (failed refreshes are retried).
+        '''
+
+        watcher = pcb_watch.Watcher(self, interval, callback, processes, error_callback=error_callback)
+        watcher.start()
+
+        return watcher
+
+    def find_ics(self, query, mode='substring'):
+        '''
+        Returns a sorted list of (pcb, rec, index) of all ICs whose label text matches the query.
+        index refers to the list returned by PCB.ics() without filters.
+        The index is synchronized with the dataset on first use, call index() to pick up later changes.
+        query: query text, case-insensitive, all tokens must match (e.g. '74HC', 'SN74 TI').
+        mode: how query tokens match label tokens: 'token' (equal), 'prefix' or 'substring'.
+        '''
+
+        return self.index(self._index is None).find_ics(query, mode)
+
+    def geometry(self, processes=None):
+        '''
+        Returns a dict that maps (pcb, rec) to (area in cm^2, minimum area rect at original size) of all recordings with a mask, see PCB.area_cm2() and PCB.min_area_rect().
+        The values are stored in the index (field 'geometry') and only recomputed, in parallel, for masks that changed.
+        processes: number of worker processes (None = number of CPUs).
+        '''
+
+        index = self.index(fields=('geometry',), processes=processes)
+
+        ret = {}
+        for key in index.keys():
+            g = index.get(key[0], key[1], 'geometry')
+            if g is not None:
+                ret[key] = (g[0], ((g[1], g[2]), (g[3], g[4]), g[5]))
+
+        return ret
+
+    def _scan(self):
+        '''
+        Returns a dict that maps the IDs of all PCBs in the dataset to their root paths.
+        '''
+
+        ret = {}
+        for p in [os.path.join(self._root, f) for f in os.listdir(self._root) if f.startswith('pcb') and os.path.isdir(os.path.join(self._root, f))]:
             id = int(os.path.splitext(os.path.basename(p))[0][3:])
-            self._pcb_paths[id] = p
+            ret[id] = p
+
+        return ret
 
     def num_pcbs(self):
         '''
@@ -292,10 +1056,11 @@ class PCBDataset:
         scale: scale factor (1 = original size).
         '''
 
-        if id not in self._pcb_paths:
+        paths = self._pcb_paths  # replaced by refresh()
+        if id not in paths:
             raise Exception('Unknown PCB ID')
 
-        return PCB(self._pcb_paths[id], scale)
+        return PCB(paths[id], scale, self._stats, self._cache)
 
     def pcbs(self, scale=1):
         '''
@@ -303,8 +1068,45 @@ class PCBDataset:
         scale: scale factor (1 = original size).
         '''
 
-        for id in self._pcb_paths:
-            yield PCB(self._pcb_paths[id], scale)
+        paths = self._pcb_paths
+        for id in paths:
+            yield PCB(paths[id], scale, self._stats, self._cache)
+
+    def samples(self, scale=1, augmentation=None, processes=None, shuffle=False, seed=0):
+        '''
+        Generator function for returning (PCB ID, recording ID, image, ICs) of all annotated recordings, loaded in parallel by worker processes.
+        Without augmentation, images and ICs are as returned by PCB.image_masked() and PCB.ics(rec, True).
+        scale: scale factor (ignored if augmentation is used).
+        augmentation: pcb_augment.Augmentation object (None = no augmentation).
+        processes: number of worker processes (None = number of CPUs).
+        shuffle: whether to return samples in random order.
+        seed: seed for shuffling and augmentation, use a different one per epoch to obtain different samples.
+        '''
+
+        return pcb_augment.samples(self, scale, augmentation, processes, shuffle, seed)
+
+    def split(self, n, labels=None, seed=0, balance=True):
+        '''
+        Splits the recordings into n parts of whole PCBs (e.g. cross-validation folds), returns a list of n sorted lists of (pcb, rec).
+        PCBs of every label are spread evenly over the parts and parts are balanced by image pixels (see pcb_split.py).
+        n: number of parts.
+        labels: dict that maps PCB IDs to labels for stratification (None = no stratification).
+        seed: seed for the assignment of PCBs.
+        balance: whether to balance by image pixels (stored in the index), otherwise by number of recordings.
+        '''
+
+        return pcb_split.split(self, n, labels, seed, balance)
+
+    def shard(self, rank, world_size, seed=0, labels=None, balance=True):
+        '''
+        Returns the sorted list of (pcb, rec) a worker should process, the part rank of split(world_size, labels, seed, balance).
+        All workers must use the same arguments except for rank.
+        rank: index of the worker (0 to world_size-1).
+        world_size: number of workers.
+        seed, labels, balance: see split().
+        '''
+
+        return pcb_split.shard(self, rank, world_size, seed, labels, balance)
 
 
 # a simple visualizer to demonstrate the API
@@ -342,10 +1144,7 @@ if __name__ == "__main__":
 
     img = pcb.image_masked(args.rec)
 
-    for ic in ics:
-        bp = cv2.cv.BoxPoints(ic.rect)
-        bp = np.int0(bp)
-        cv2.drawContours(img, [bp], 0, (0, 255, 0), 2)
+    cv2.polylines(img, list(pcb_geometry.polygons(pcb_geometry.as_rects(ics))), True, (0, 255, 0), 2)
 
     cv2.imshow('PCB', img)
     cv2.waitKey(0)
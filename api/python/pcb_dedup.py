@@ -0,0 +1,177 @@
+
+'''
+Detect near-duplicate recordings of the DSLR dataset via perceptual hashes.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Every image is decoded at 1/8 resolution and represented by a 64 bit DCT hash, which is stored
+in the dataset index (field 'phash', see pcb_index.py) and thus only recomputed if the image
+changes. Near-duplicates are pairs of recordings whose hashes differ in at most a given number of
+bits, found via a BK-tree instead of comparing all pairs.
+'''
+
+import os.path
+import sys
+import json
+import argparse
+import multiprocessing
+
+from pcb_dataset import PCBDataset, cv2, np
+
+
+def phash(im):
+    '''
+    Returns the 64 bit perceptual hash of an image as an int.
+    im: grayscale or BGR image.
+    '''
+
+    if im.ndim == 3:
+        im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.resize(im, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:8, :8].ravel()
+
+    bits = dct > np.median(dct[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def recording_hash(pcb, rec):
+    '''
+    Returns the perceptual hash of the image of a recording, decoded at 1/8 resolution.
+    pcb: PCB object.
+    rec: recording ID.
+    '''
+
+    im = pcb._imread(os.path.join(pcb._root, 'rec{}.jpg'.format(rec)), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if im is None or im.size == 0:
+        raise Exception('Could not load the image')
+
+    return phash(im)
+
+
+def hamming(a, b):
+    '''
+    Returns the number of differing bits of two hashes.
+    '''
+
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+
+    '''
+    A BK-tree for finding hashes within a given Hamming distance.
+    '''
+
+    def __init__(self):
+        '''
+        Constructor, creates an empty tree.
+        '''
+
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        '''
+        Returns the number of items in the tree.
+        '''
+
+        return self._size
+
+    def add(self, h, item):
+        '''
+        Adds an item.
+        h: hash of the item.
+        item: arbitrary value returned by find().
+        '''
+
+        self._size += 1
+
+        if self._root is None:
+            self._root = (h, [item], {})
+            return
+
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+
+            if d not in node[2]:
+                node[2][d] = (h, [item], {})
+                return
+
+            node = node[2][d]
+
+    def find(self, h, max_distance):
+        '''
+        Returns a list of (distance, item) of all items whose hash differs in at most max_distance bits.
+        h: query hash.
+        max_distance: maximum Hamming distance.
+        '''
+
+        ret = []
+        todo = [self._root] if self._root is not None else []
+
+        while todo:
+            node = todo.pop()
+            d = hamming(h, node[0])
+            if d <= max_distance:
+                ret.extend([(d, item) for item in node[1]])
+
+            for cd, child in node[2].items():
+                if d - max_distance <= cd <= d + max_distance:
+                    todo.append(child)
+
+        return sorted(ret)
+
+
+def find_duplicates(db, max_distance=8, processes=None):
+    '''
+    Returns a sorted list of (distance, (pcb, rec), (pcb, rec)) of all pairs of near-duplicate recordings.
+    Missing or outdated hashes are computed first and stored in the dataset index.
+    db: PCBDataset.
+    max_distance: maximum Hamming distance of the hashes of near-duplicates.
+    processes: number of worker processes for computing hashes (None = number of CPUs).
+    '''
+
+    index = db.index(fields=('phash',), processes=processes)
+
+    tree = BKTree()
+    hashes = []
+
+    for key in index.keys():
+        h = index.get(key[0], key[1], 'phash')
+        if h is not None:
+            hashes.append((int(h, 16), key))
+            tree.add(int(h, 16), key)
+
+    ret = []
+    for h, key in hashes:
+        for d, other in tree.find(h, max_distance):
+            if key < other:
+                ret.append((d, key, other))
+
+    return sorted(ret)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find near-duplicate recordings in the dataset')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--max-distance', type=int, dest='max_distance', default=8, help='Maximum number of differing hash bits (of 64)')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--report', type=str, dest='report', help='Write the pairs to this JSON file')
+    args = parser.parse_args()
+
+    pairs = find_duplicates(PCBDataset(args.root), args.max_distance, args.processes)
+
+    for d, a, b in pairs:
+        print('PCB {} rec {} ~ PCB {} rec {}: distance {}{}'.format(a[0], a[1], b[0], b[1], d, '' if a[0] == b[0] else ' (different PCBs)'))
+
+    print('{} near-duplicate pairs'.format(len(pairs)))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump([{'distance': d, 'a': list(a), 'b': list(b)} for d, a, b in pairs], f, indent=2)
+
+    sys.exit(1 if pairs else 0)
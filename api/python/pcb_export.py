@@ -0,0 +1,213 @@
+
+'''
+Export the DSLR dataset to COCO-style JSON or JSON Lines for training object detectors.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+PCBs are processed in parallel and the output is written incrementally, so memory usage does not
+depend on the dataset size. Coordinates follow PCB.ics() for the given scale and cropping.
+Every IC is exported with its rotated rect [cx, cy, w, h, angle], its corners as polygon and its
+axis-aligned bounding box. Board masks are exported as uncompressed COCO RLE (column-major counts).
+'''
+
+import os
+import os.path
+import json
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+from pcb_dataset import PCB, PCBDataset, np
+from pcb_geometry import box_points
+from pcb_index import jpeg_size
+
+
+def coco_rle(mask):
+    '''
+    Returns the uncompressed COCO RLE of a mask as a dict with keys 'size' and 'counts'.
+    mask: mask as a 2D array, nonzero pixels are foreground.
+    '''
+
+    m = (mask.T > 0).ravel()
+    change = np.flatnonzero(m[1:] != m[:-1]) + 1
+
+    counts = np.diff(np.concatenate(([0], change, [m.size]))).tolist()
+    if m.size > 0 and m[0]:
+        counts.insert(0, 0)
+
+    return {'size': [int(mask.shape[0]), int(mask.shape[1])], 'counts': counts}
+
+
+def export_pcb(task):
+    '''
+    Returns the export records of all recordings of a PCB, and a list of (pcb, rec, reason) of recordings that could not be exported.
+    task: (PCB root, scale, cropped, include masks).
+    '''
+
+    root, scale, cropped, masks = task
+
+    pcb = PCB(root, scale)
+    ret, skipped = [], []
+
+    for rec in sorted(pcb.recordings()):
+        try:
+            ret.append(export_recording(pcb, rec, cropped, masks))
+        except Exception as e:  # e.g. missing mask or annotations
+            skipped.append((pcb.id(), rec, str(e)))
+
+    return ret, skipped
+
+
+def export_recording(pcb, rec, cropped=False, masks=True):
+    '''
+    Returns the export record of a recording.
+    Masks are decoded only if they are exported or required for cropping, the image size is read from the JPEG header.
+    pcb: PCB object.
+    rec: recording ID.
+    cropped: whether to use coordinates of cropped images (see PCB.image_masked()).
+    masks: whether to include the board mask.
+    '''
+
+    record = {'pcb': pcb.id(), 'rec': rec, 'file_name': '{}/rec{}.jpg'.format(os.path.basename(pcb._root), rec), 'scale': pcb._scale}
+    mask = pcb.mask(rec) if masks else None
+
+    if cropped:
+        x, y, w, h = pcb._cropinfo(rec, mask)
+        record['crop'] = [x, y, w, h]
+        if mask is not None:
+            mask = mask[y:y+h, x:x+w]
+    else:
+        w, h = jpeg_size(os.path.join(pcb._root, 'rec{}.jpg'.format(rec)))
+        w, h = int(round(w*pcb._scale)), int(round(h*pcb._scale))  # see cv2.resize()
+
+    record['height'], record['width'] = int(h), int(w)
+
+    if mask is not None:
+        record['mask'] = coco_rle(mask)
+
+    ics = pcb.ics(rec, cropped)
+    rects = [[ic.rect[0][0], ic.rect[0][1], ic.rect[1][0], ic.rect[1][1], ic.rect[2]] for ic in ics]
+    corners = box_points(rects)
+
+    record['ics'] = []
+    for ic, r, c in zip(ics, rects, corners):
+        x0, y0 = c.min(axis=0)
+        x1, y1 = c.max(axis=0)
+
+        record['ics'].append({
+            'rect': r,
+            'polygon': c.ravel().tolist(),
+            'bbox': [float(x0), float(y0), float(x1-x0), float(y1-y0)],
+            'area': ic.size_pixels(),
+            'text': ic.text
+        })
+
+    return record
+
+
+def bounded_imap(pool, fn, items, window):
+    '''
+    Like pool.imap() but with at most window tasks in flight, which bounds memory usage.
+    pool: multiprocessing pool.
+    fn: function to apply.
+    items: task arguments.
+    window: maximum number of pending tasks.
+    '''
+
+    pending = []
+    for item in items:
+        pending.append(pool.apply_async(fn, (item,)))
+        if len(pending) >= window:
+            yield pending.pop(0).get()
+
+    for p in pending:
+        yield p.get()
+
+
+def export(db, out, fmt='coco', scale=1, cropped=False, masks=True, processes=None):
+    '''
+    Export a dataset, returns (number of images, number of ICs, list of (pcb, rec, reason) of skipped recordings).
+    db: PCBDataset.
+    out: output file path.
+    fmt: 'coco' (COCO-style JSON) or 'jsonl' (JSON Lines, one line per recording).
+    scale: scale factor.
+    cropped: whether to use coordinates of cropped images (see PCB.image_masked()).
+    masks: whether to export board masks.
+    processes: number of worker processes (None = number of CPUs).
+    '''
+
+    if fmt not in ('coco', 'jsonl'):
+        raise Exception('Unknown format "{}"'.format(fmt))
+
+    processes = processes or multiprocessing.cpu_count()
+    tasks = [(db._pcb_paths[id], scale, cropped, masks) for id in db.pcb_ids()]
+
+    pool = multiprocessing.Pool(processes)
+    num_images, num_ics, skipped = 0, 0, []
+
+    try:
+        with open(out, 'w') as f:
+            if fmt == 'jsonl':
+                for records, sk in bounded_imap(pool, export_pcb, tasks, 2*processes):
+                    skipped.extend(sk)
+                    for r in records:
+                        f.write(json.dumps(r) + '\n')
+                        num_images += 1
+                        num_ics += len(r['ics'])
+            else:
+                # images are written directly, annotations are buffered in a temporary file
+
+                info = {'description': 'PCB DSLR dataset', 'scale': scale, 'cropped': cropped}
+                categories = [{'id': 1, 'name': 'ic', 'supercategory': 'component'}]
+                f.write('{{"info": {},\n "categories": {},\n "images": ['.format(json.dumps(info), json.dumps(categories)))
+
+                with tempfile.TemporaryFile('w+') as annots:
+                    for records, sk in bounded_imap(pool, export_pcb, tasks, 2*processes):
+                        skipped.extend(sk)
+                        for r in records:
+                            num_images += 1
+                            ics = r.pop('ics')
+                            r['id'] = num_images
+                            f.write('{}\n  {}'.format(',' if num_images > 1 else '', json.dumps(r)))
+
+                            for ic in ics:
+                                num_ics += 1
+                                a = {
+                                    'id': num_ics,
+                                    'image_id': r['id'],
+                                    'category_id': 1,
+                                    'bbox': ic['bbox'],
+                                    'segmentation': [ic['polygon']],
+                                    'area': ic['area'],
+                                    'iscrowd': 0,
+                                    'rbox': ic['rect'],
+                                    'text': ic['text']
+                                }
+                                annots.write('{}\n  {}'.format(',' if num_ics > 1 else '', json.dumps(a)))
+
+                    f.write('\n ],\n "annotations": [')
+                    annots.seek(0)
+                    shutil.copyfileobj(annots, f)
+                    f.write('\n ]\n}\n')
+    finally:
+        pool.close()
+        pool.join()
+
+    return num_images, num_ics, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the dataset to COCO-style JSON or JSON Lines')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--out', type=str, dest='out', required=True, help='Output file')
+    parser.add_argument('--format', type=str, dest='format', choices=('coco', 'jsonl'), default='coco', help='Output format')
+    parser.add_argument('--scale', type=float, dest='scale', default=1, help='Scale factor')
+    parser.add_argument('--cropped', action='store_true', help='Use coordinates of cropped images (see PCB.image_masked())')
+    parser.add_argument('--no-masks', action='store_true', help='Do not export board masks')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    ni, nic, skipped = export(PCBDataset(args.root), args.out, args.format, args.scale, args.cropped, not args.no_masks, args.processes)
+    for pcb, rec, reason in skipped:
+        print('Skipped PCB {} rec {}: {}'.format(pcb, rec, reason))
+    print('Exported {} images with {} ICs to "{}"'.format(ni, nic, args.out))
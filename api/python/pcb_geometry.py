@@ -0,0 +1,308 @@
+
+'''
+Vectorized geometry of rotated rects (IC annotations) for the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Rects are handled as Nx5 arrays of (cx, cy, w, h, angle in degrees), see as_rects(), and processed
+all at once instead of one cv2 call per rect: corners (like cv2.boxPoints()), integer polygons
+for drawing, point-in-rect tests, minimum area rects of quadrilaterals (like cv2.minAreaRect()),
+affine and perspective transforms and IoU matrices of rotated rects.
+'''
+
+from pcb_dataset import np
+
+
+def as_rects(items):
+    '''
+    Returns rotated rects as a Nx5 array of (cx, cy, w, h, angle in degrees).
+    items: Annot objects (or other objects with a rect attribute), OpenCV-style rects ((cx, cy), (w, h), angle)
+           or rows of 5 values, or an array of shape (..., 5).
+    '''
+
+    if hasattr(items, 'shape'):
+        return np.asarray(items, dtype=np.float64).reshape(-1, 5)
+
+    ret = np.empty((len(items), 5))
+    for i, r in enumerate(items):
+        r = getattr(r, 'rect', r)
+        ret[i] = (r[0][0], r[0][1], r[1][0], r[1][1], r[2]) if len(r) == 3 else r
+
+    return ret
+
+
+def as_tuples(rects):
+    '''
+    Returns rotated rects as a list of OpenCV-style rects ((cx, cy), (w, h), angle).
+    rects: Nx5 array.
+    '''
+
+    return [((r[0], r[1]), (r[2], r[3]), r[4]) for r in np.asarray(rects, dtype=np.float64).reshape(-1, 5).tolist()]
+
+
+def box_points(rects):
+    '''
+    Returns the corners of rotated rects as an Nx4x2 array, ordered as by cv2.boxPoints().
+    rects: Nx5 array of (cx, cy, w, h, angle in degrees).
+    '''
+
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 5)
+    cx, cy, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+
+    a = np.sin(np.deg2rad(rects[:, 4])) * 0.5
+    b = np.cos(np.deg2rad(rects[:, 4])) * 0.5
+
+    ret = np.empty((len(rects), 4, 2))
+    ret[:, 0, 0] = cx - a*h - b*w
+    ret[:, 0, 1] = cy + b*h - a*w
+    ret[:, 1, 0] = cx + a*h - b*w
+    ret[:, 1, 1] = cy - b*h - a*w
+    ret[:, 2] = 2*rects[:, :2] - ret[:, 0]
+    ret[:, 3] = 2*rects[:, :2] - ret[:, 1]
+
+    return ret
+
+
+def polygons(rects, offset=(0, 0)):
+    '''
+    Returns the corners of rotated rects rounded to int32 as an Nx4x2 array, for cv2.polylines(), cv2.fillPoly() and cv2.drawContours().
+    rects: Nx5 array of (cx, cy, w, h, angle in degrees).
+    offset: (dx, dy) added to all corners.
+    '''
+
+    return np.round(box_points(rects) + offset).astype(np.int32)
+
+
+def points_in_rects(points, rects):
+    '''
+    Returns whether points lie inside (or on the border of) rotated rects as a MxN boolean array.
+    points: Mx2 array of (x, y).
+    rects: Nx5 array of (cx, cy, w, h, angle in degrees).
+    '''
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 5)
+
+    c = np.cos(np.deg2rad(rects[:, 4]))
+    s = np.sin(np.deg2rad(rects[:, 4]))
+
+    dx = points[:, None, 0] - rects[None, :, 0]
+    dy = points[:, None, 1] - rects[None, :, 1]
+
+    # coordinates along the width and height axes of the rects
+    u = dx*c + dy*s
+    v = dy*c - dx*s
+
+    return (np.abs(u) <= rects[:, 2] / 2.0) & (np.abs(v) <= rects[:, 3] / 2.0)
+
+
+def rects_from_corners(corners):
+    '''
+    Returns rotated rects as a Nx5 array of (cx, cy, w, h, angle in degrees) from their corners.
+    Exact for corners of rects transformed by similarity transforms, otherwise an approximation that
+    preserves which side is the width (unlike min_area_rects()).
+    corners: Nx4x2 array, ordered as by box_points().
+    '''
+
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+
+    dw = corners[:, 2] - corners[:, 1]
+    dh = corners[:, 1] - corners[:, 0]
+
+    ret = np.empty((len(corners), 5))
+    ret[:, :2] = corners.mean(axis=1)
+    ret[:, 2] = np.hypot(dw[:, 0], dw[:, 1])
+    ret[:, 3] = np.hypot(dh[:, 0], dh[:, 1])
+    ret[:, 4] = np.rad2deg(np.arctan2(dw[:, 1], dw[:, 0]))
+
+    return ret
+
+
+def min_area_rects(polys):
+    '''
+    Returns the minimum area rotated rects that enclose convex polygons as a Nx5 array of (cx, cy, w, h, angle in degrees).
+    Like cv2.minAreaRect() applied to every polygon, but the angle is that of the polygon edge the rect is aligned with.
+    polys: NxKx2 array, vertices in order (e.g. transformed corners of rects).
+    '''
+
+    polys = np.asarray(polys, dtype=np.float64)
+    n = len(polys)
+    if n == 0:
+        return np.zeros((0, 5))
+
+    # one side of the minimum area rect is collinear with a polygon edge, try all edges
+
+    edges = np.roll(polys, -1, axis=1) - polys
+    length = np.maximum(np.hypot(edges[..., 0], edges[..., 1]), 1e-12)
+    ux, uy = edges[..., 0] / length, edges[..., 1] / length
+
+    # project all vertices onto every edge direction (u) and its normal (v): NxKxK
+
+    u = polys[:, None, :, 0] * ux[..., None] + polys[:, None, :, 1] * uy[..., None]
+    v = polys[:, None, :, 1] * ux[..., None] - polys[:, None, :, 0] * uy[..., None]
+
+    umin, umax = u.min(axis=2), u.max(axis=2)
+    vmin, vmax = v.min(axis=2), v.max(axis=2)
+
+    best = np.argmin((umax - umin) * (vmax - vmin), axis=1)
+    i = np.arange(n)
+
+    bx, by = ux[i, best], uy[i, best]
+    cu = (umin[i, best] + umax[i, best]) / 2.0
+    cv = (vmin[i, best] + vmax[i, best]) / 2.0
+
+    ret = np.empty((n, 5))
+    ret[:, 0] = cu*bx - cv*by
+    ret[:, 1] = cu*by + cv*bx
+    ret[:, 2] = umax[i, best] - umin[i, best]
+    ret[:, 3] = vmax[i, best] - vmin[i, best]
+    ret[:, 4] = np.rad2deg(np.arctan2(by, bx))
+
+    return ret
+
+
+def transform_points(points, M):
+    '''
+    Returns points transformed by an affine or perspective transform.
+    points: array of shape (..., 2).
+    M: 2x3 affine matrix or 3x3 homography.
+    '''
+
+    points = np.asarray(points, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    p = points.dot(M[:2, :2].T) + M[:2, 2]
+    if M.shape[0] == 2:
+        return p
+
+    w = points.dot(M[2, :2]) + M[2, 2]
+    return p / w[..., None]
+
+
+def transform_rects(rects, M, min_area=True):
+    '''
+    Returns rotated rects transformed by an affine or perspective transform as a Nx5 array.
+    rects: Nx5 array of (cx, cy, w, h, angle in degrees).
+    M: 2x3 affine matrix or 3x3 homography.
+    min_area: whether to return the minimum area rects of the transformed corners (see min_area_rects()),
+              otherwise the approximation of rects_from_corners() that preserves the orientation of the rects.
+    '''
+
+    corners = transform_points(box_points(rects), M)
+    return min_area_rects(corners) if min_area else rects_from_corners(corners)
+
+
+def polygon_area(polys):
+    '''
+    Returns the areas of polygons.
+    polys: array of shape (..., K, 2), vertices in order.
+    '''
+
+    x, y = polys[..., 0], polys[..., 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1))
+
+
+def _cross(a, b):
+    '''
+    Returns the z component of the cross products of 2D vectors.
+    '''
+
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _inside(points, polys, eps=1e-9):
+    '''
+    Returns whether points lie inside convex polygons (regardless of orientation).
+    points: array of shape (..., P, 2).
+    polys: array of shape (..., K, 2), broadcastable against points.
+    '''
+
+    edges = np.roll(polys, -1, axis=-2) - polys
+    cross = _cross(edges[..., None, :, :], points[..., :, None, :] - polys[..., None, :, :])
+
+    return np.all(cross >= -eps, axis=-1) | np.all(cross <= eps, axis=-1)
+
+
+def _intersection_area(pa, pb):
+    '''
+    Returns the intersection areas of all pairs of convex polygons as a NxM array.
+    pa: Nx1xKx2 array.
+    pb: 1xMxLx2 array.
+    '''
+
+    # candidate vertices: vertices of one polygon inside the other one and edge intersections
+
+    a0, b0 = pa[:, :, :, None, :], pb[:, :, None, :, :]
+    da = np.roll(pa, -1, axis=2)[:, :, :, None, :] - a0
+    db = np.roll(pb, -1, axis=2)[:, :, None, :, :] - b0
+
+    denom = _cross(da, db)
+    parallel = np.abs(denom) < 1e-12
+    denom = np.where(parallel, 1.0, denom)
+
+    t = _cross(b0 - a0, db) / denom
+    u = _cross(b0 - a0, da) / denom
+
+    n, m, k, l = denom.shape
+    pts = np.concatenate((
+        np.broadcast_to(pa, (n, m, k, 2)),
+        np.broadcast_to(pb, (n, m, l, 2)),
+        (a0 + t[..., None] * da).reshape(n, m, k*l, 2)
+    ), axis=2)
+
+    valid = np.concatenate((
+        _inside(pa, pb),
+        _inside(pb, pa),
+        (~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)).reshape(n, m, k*l)
+    ), axis=2)
+
+    # order the valid vertices by angle around their centroid, invalid ones are moved to the end and
+    # replaced by the first vertex so that they do not contribute to the area
+
+    cnt = np.maximum(valid.sum(axis=2), 1)
+    center = (pts * valid[..., None]).sum(axis=2) / cnt[..., None]
+
+    angle = np.arctan2(pts[..., 1] - center[..., None, 1], pts[..., 0] - center[..., None, 0])
+    angle[~valid] = np.inf
+
+    order = np.argsort(angle, axis=2)
+    pts = np.take_along_axis(pts, order[..., None], axis=2)
+    valid = np.take_along_axis(valid, order, axis=2)
+    pts = np.where(valid[..., None], pts, pts[:, :, :1, :])
+
+    return np.where(valid.sum(axis=2) >= 3, polygon_area(pts), 0.0)
+
+
+def polygon_iou(pa, pb, chunk=1 << 14):
+    '''
+    Returns the IoU of all pairs of convex polygons as a NxM array.
+    pa: NxKx2 array of polygons.
+    pb: MxLx2 array of polygons.
+    chunk: maximum number of pairs processed at once, bounds memory usage.
+    '''
+
+    pa = np.asarray(pa, dtype=np.float64)
+    pb = np.asarray(pb, dtype=np.float64)
+
+    ret = np.zeros((len(pa), len(pb)))
+    if len(pa) == 0 or len(pb) == 0:
+        return ret
+
+    area_a, area_b = polygon_area(pa), polygon_area(pb)
+    rows = max(1, chunk // len(pb))
+
+    for i in range(0, len(pa), rows):
+        inter = _intersection_area(pa[i:i+rows, None], pb[None])
+        union = area_a[i:i+rows, None] + area_b[None, :] - inter
+        ret[i:i+rows] = np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+    return ret
+
+
+def rotated_iou(rects_a, rects_b):
+    '''
+    Returns the IoU of all pairs of rotated rects as a NxM array.
+    rects_a: Nx5 array of (cx, cy, w, h, angle in degrees).
+    rects_b: Mx5 array of (cx, cy, w, h, angle in degrees).
+    '''
+
+    return polygon_iou(box_points(rects_a), box_points(rects_b))
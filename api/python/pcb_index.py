@@ -0,0 +1,407 @@
+
+'''
+Persistent, incrementally updated index of per-recording metadata of the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+The index stores, for every (pcb, rec), values computed from the files of that recording
+(see FIELDS) together with the size and modification time of these files. update() only
+recomputes values whose files changed, optionally in parallel. The IC label texts are additionally kept in an
+inverted index for fast lookup of ICs by their marking (see find_ics()).
+'''
+
+import os
+import os.path
+import re
+import json
+import bisect
+import struct
+import tempfile
+import multiprocessing
+
+from pcb_dataset import PCB
+import pcb_dedup
+
+
+def _index_ics(pcb, rec):
+    '''
+    Returns the annotations of a recording as a list of [cx, cy, w, h, angle, text].
+    pcb: PCB object.
+    rec: recording ID.
+    '''
+
+    return [[ic.rect[0][0], ic.rect[0][1], ic.rect[1][0], ic.rect[1][1], ic.rect[2], ic.text] for ic in pcb.ics(rec)]
+
+
+def _index_phash(pcb, rec):
+    '''
+    Returns the perceptual hash of the image of a recording as a hex string (see pcb_dedup.py).
+    pcb: PCB object.
+    rec: recording ID.
+    '''
+
+    return '{:016x}'.format(pcb_dedup.recording_hash(pcb, rec))
+
+
+def _index_geometry(pcb, rec):
+    '''
+    Returns [area in cm^2, cx, cy, w, h, angle] of the PCB in a recording (see PCB.area_cm2() and PCB.min_area_rect()).
+    pcb: PCB object.
+    rec: recording ID.
+    '''
+
+    rle = pcb.mask_rle(rec)
+    (cx, cy), (w, h), angle = rle.min_area_rect()
+
+    return [rle.area() / (87.4**2), cx, cy, w, h, angle]
+
+
+def jpeg_size(path):
+    '''
+    Returns (width, height) of a JPEG image, read from its header without decoding.
+    path: file path.
+    '''
+
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            raise Exception('"{}" is not a JPEG file'.format(path))
+
+        while True:
+            marker = f.read(4)
+            if len(marker) != 4 or marker[0:1] != b'\xff':
+                raise Exception('"{}" has no frame header'.format(path))
+
+            code = struct.unpack('>B', marker[1:2])[0]
+            if code in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                h, w = struct.unpack('>xHH', f.read(5))
+                return w, h
+
+            f.seek(struct.unpack('>H', marker[2:4])[0] - 2, os.SEEK_CUR)
+
+
+def _index_size(pcb, rec):
+    '''
+    Returns [width, height] of the image of a recording (see jpeg_size()).
+    pcb: PCB object.
+    rec: recording ID.
+    '''
+
+    return list(jpeg_size(os.path.join(pcb._root, 'rec{}.jpg'.format(rec))))
+
+
+# field name -> (suffixes of the files it is computed from, function(pcb, rec) that computes the value, whether update() always computes it or only on request and once computed)
+FIELDS = {
+    'ics': (('-annot.txt', '-annot.bin'), _index_ics, True),
+    'phash': (('.jpg',), _index_phash, False),
+    'geometry': (('-mask.png', '-mask.rle'), _index_geometry, False),
+    'size': (('.jpg',), _index_size, False)
+}
+
+
+def _compute_fields(task):
+    '''
+    Computes fields of a recording, returns a dict that maps field names to values (None on failure).
+    task: (PCB root, recording ID, field names).
+    '''
+
+    root, rec, fields = task
+
+    pcb = PCB(root)
+    ret = {}
+
+    for field in fields:
+        try:
+            ret[field] = FIELDS[field][1](pcb, rec)
+        except Exception:  # invalid files are reported by pcb_verify.py
+            ret[field] = None
+
+    return ret
+
+
+def normalize(text):
+    '''
+    Returns the normalized tokens of a label text (upper case, split at non-alphanumeric characters).
+    text: label text.
+    '''
+
+    return [t for t in re.split('[^0-9A-Z]+', text.upper()) if t]
+
+
+def _grams(token, n=3):
+    '''
+    Returns the set of n-grams of a token.
+    token: normalized token.
+    n: n-gram length.
+    '''
+
+    return set(token[i:i+n] for i in range(len(token)-n+1))
+
+
+class DatasetIndex:
+
+    '''
+    Index of per-recording metadata of a dataset.
+    '''
+
+    def __init__(self, db, path=None):
+        '''
+        Constructor, loads the index file if it exists and is valid. Call update() to synchronize with the dataset.
+        db: PCBDataset.
+        path: path of the index file (None = do not persist).
+        '''
+
+        self._db = db
+        self._path = path
+        self._records = {}
+
+        self._postings = {}
+        self._grams = {}
+        self._tokens = None
+
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+
+                if data.get('root') == os.path.abspath(db._root):
+                    for key, r in data['records'].items():
+                        self._set_record(tuple(map(int, key.split('/'))), r)
+            except (IOError, OSError, ValueError, KeyError, AttributeError, TypeError):  # unreadable, start with an empty index
+                self._records, self._postings, self._grams = {}, {}, {}
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'DatasetIndex ({} recordings, {} label tokens)'.format(len(self._records), len(self._postings))
+
+    def keys(self):
+        '''
+        Returns a sorted list of all indexed (pcb, rec) pairs.
+        '''
+
+        return sorted(self._records.keys())
+
+    def get(self, pcb, rec, field):
+        '''
+        Returns the value of a field of a recording, None if not available.
+        pcb: PCB ID.
+        rec: recording ID.
+        field: field name (see FIELDS).
+        '''
+
+        return self._records.get((pcb, rec), {}).get(field)
+
+    def update(self, pcbs=None, processes=1, fields=()):
+        '''
+        Synchronizes the index with the dataset and saves it, returns the set of updated (pcb, rec) pairs.
+        pcbs: IDs of PCBs to update (None = all), records of PCBs that no longer exist are removed.
+        processes: number of worker processes for computing changed fields (None = number of CPUs).
+        fields: names of fields to compute in addition to those that are always computed or were computed before (see FIELDS).
+        '''
+
+        updated = set()
+        existing = self._db.pcb_ids()
+        ids = existing if pcbs is None else [id for id in pcbs if id in existing]
+
+        for key in [k for k in self._records if k[0] not in existing and (pcbs is None or k[0] in pcbs)]:
+            self._set_record(key, None)
+            updated.add(key)
+
+        pending = []
+        for id in ids:
+            pcb = self._db.pcb(id)
+            recs = pcb.recordings()
+
+            for key in [k for k in self._records if k[0] == id and k[1] not in recs]:
+                self._set_record(key, None)
+                updated.add(key)
+
+            for rec in recs:
+                record, stale = self._check_record(pcb, rec, fields)
+                if stale:
+                    pending.append(((id, rec), record, (pcb._root, rec, stale)))
+                elif record != self._records.get((id, rec)):
+                    self._set_record((id, rec), record)
+                    updated.add((id, rec))
+
+        processes = processes or multiprocessing.cpu_count()
+        if processes > 1 and len(pending) > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                values = pool.map(_compute_fields, [p[2] for p in pending])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            values = [_compute_fields(p[2]) for p in pending]
+
+        for (key, record, _), v in zip(pending, values):
+            record.update(v)
+            if record != self._records.get(key):
+                self._set_record(key, record)
+                updated.add(key)
+
+        if updated:
+            self.save()
+
+        return updated
+
+    def copy(self):
+        '''
+        Returns a copy of the index that can be updated without affecting this one.
+        '''
+
+        ret = DatasetIndex(self._db)
+        ret._path = self._path
+        ret._records = dict(self._records)  # records are replaced, not modified
+        ret._postings = dict((t, set(v)) for t, v in self._postings.items())
+        ret._grams = dict((g, set(v)) for g, v in self._grams.items())
+
+        return ret
+
+    def save(self):
+        '''
+        Writes the index file (atomically, via a unique temporary file so that concurrent writers do not interfere).
+        Does nothing if the index is not persisted.
+        '''
+
+        if self._path is None:
+            return
+
+        data = {'root': os.path.abspath(self._db._root), 'records': dict(('{}/{}'.format(*k), r) for k, r in self._records.items())}
+
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self._path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(self._path)))
+        except (IOError, OSError):  # e.g. read-only dataset, the index is kept in memory
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.chmod(tmp, 0o644)  # mkstemp() creates files readable only by the owner
+            os.rename(tmp, self._path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def find_ics(self, query, mode='substring'):
+        '''
+        Returns a sorted list of (pcb, rec, index) of all ICs whose label matches the query,
+        index refers to the list returned by PCB.ics() without filters.
+        All tokens of the query must match a label token.
+        query: query text, normalized like labels (case-insensitive, punctuation is ignored).
+        mode: how query tokens match label tokens: 'token' (equal), 'prefix' or 'substring'.
+        '''
+
+        if mode not in ('token', 'prefix', 'substring'):
+            raise Exception('Unknown mode "{}"'.format(mode))
+
+        ret = None
+        for qt in normalize(query):
+            hits = set()
+            for t in self._match_tokens(qt, mode):
+                hits |= self._postings[t]
+
+            ret = hits if ret is None else ret & hits
+            if not ret:
+                return []
+
+        return sorted(ret) if ret else []
+
+    def _match_tokens(self, qt, mode):
+        '''
+        Returns the label tokens that match a query token.
+        qt: normalized query token.
+        mode: see find_ics().
+        '''
+
+        if mode == 'token':
+            return [qt] if qt in self._postings else []
+
+        if mode == 'prefix':
+            if self._tokens is None:
+                self._tokens = sorted(self._postings)
+
+            ret = []
+            i = bisect.bisect_left(self._tokens, qt)
+            while i < len(self._tokens) and self._tokens[i].startswith(qt):
+                ret.append(self._tokens[i])
+                i += 1
+
+            return ret
+
+        grams = _grams(qt)
+        if not grams:  # shorter than a n-gram
+            return [t for t in self._postings if qt in t]
+
+        candidates = None
+        for g in grams:
+            candidates = set(self._grams.get(g, ())) if candidates is None else candidates & self._grams.get(g, set())
+            if not candidates:
+                return []
+
+        return [t for t in candidates if qt in t]
+
+    def _check_record(self, pcb, rec, fields):
+        '''
+        Returns the record of a recording with the values of unchanged fields and the list of fields to recompute.
+        pcb: PCB object.
+        rec: recording ID.
+        fields: see update().
+        '''
+
+        old = self._records.get((pcb.id(), rec), {'sig': {}})
+        new = {'sig': {}}
+        stale = []
+
+        for field, (suffixes, fn, always) in sorted(FIELDS.items()):
+            for suffix in suffixes:
+                if suffix not in new['sig']:
+                    path = os.path.join(pcb._root, 'rec{}{}'.format(rec, suffix))
+                    try:
+                        st = os.stat(path)
+                        new['sig'][suffix] = [st.st_size, st.st_mtime]
+                    except OSError:
+                        new['sig'][suffix] = None
+
+            if field in old and all(old['sig'].get(s) == new['sig'][s] for s in suffixes):
+                new[field] = old[field]
+            elif any(new['sig'][s] is not None for s in suffixes) and (always or field in fields or field in old):
+                stale.append(field)
+
+        return new, stale
+
+    def _set_record(self, key, record):
+        '''
+        Replaces a record and updates the label index accordingly.
+        key: (pcb, rec).
+        record: new record (None = remove).
+        '''
+
+        old = self._records.pop(key, None)
+        if old is not None:
+            for i, ic in enumerate(old.get('ics') or []):
+                for t in set(normalize(ic[5])):
+                    self._postings[t].discard(key + (i,))
+                    if not self._postings[t]:
+                        del self._postings[t]
+                        for g in _grams(t):
+                            self._grams[g].discard(t)
+                        self._tokens = None
+
+        if record is None:
+            return
+
+        self._records[key] = record
+        for i, ic in enumerate(record.get('ics') or []):
+            for t in set(normalize(ic[5])):
+                if t not in self._postings:
+                    self._postings[t] = set()
+                    for g in _grams(t):
+                        self._grams.setdefault(g, set()).add(t)
+                    self._tokens = None
+
+                self._postings[t].add(key + (i,))
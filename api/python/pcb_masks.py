@@ -0,0 +1,276 @@
+
+'''
+Compact run-length encoded storage of PCB masks for the Python2 API.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+A mask is stored as the runs of foreground pixels of every row in a recN-mask.rle file:
+an 8 byte magic string, width and height as uint32 and the number of runs as uint32, followed
+by the row, start column and end column (exclusive) of all runs as uint16 arrays.
+'''
+
+import cv2
+import numpy as np
+
+import os
+import os.path
+import struct
+import argparse
+
+
+_MAGIC = b'PCBRLE1\0'
+_HEADER = '<8sIII'
+
+
+class MaskRLE:
+
+    '''
+    A binary mask, represented by runs of foreground pixels in each row.
+    '''
+
+    def __init__(self, shape, rows, starts, ends):
+        '''
+        Constructor.
+        shape: (height, width) of the mask.
+        rows: row of each run, sorted in ascending order.
+        starts: first column of each run.
+        ends: last column of each run + 1.
+        '''
+
+        self.shape = tuple(shape)
+        self.rows = rows
+        self.starts = starts
+        self.ends = ends
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'MaskRLE {}x{} ({} runs)'.format(self.shape[1], self.shape[0], len(self.rows))
+
+    @staticmethod
+    def encode(mask):
+        '''
+        Returns the run-length encoding of a mask.
+        mask: mask as a 2D array, nonzero pixels are foreground.
+        '''
+
+        if mask.ndim != 2:
+            raise Exception('Mask must be a 2D array')
+
+        if max(mask.shape) > 65535:
+            raise Exception('Masks larger than 65535 pixels are not supported')
+
+        fg = np.zeros((mask.shape[0], mask.shape[1]+2), dtype=np.int8)
+        fg[:, 1:-1] = mask > 0
+
+        d = np.diff(fg, axis=1)
+        rows, starts = np.nonzero(d == 1)
+        _, ends = np.nonzero(d == -1)
+
+        return MaskRLE(mask.shape, rows.astype(np.uint16), starts.astype(np.uint16), ends.astype(np.uint16))
+
+    @staticmethod
+    def load(path):
+        '''
+        Loads a mask from a .rle file.
+        path: file path.
+        '''
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        hsz = struct.calcsize(_HEADER)
+        if len(data) < hsz:
+            raise Exception('"{}" is not a valid mask file'.format(path))
+
+        magic, w, h, n = struct.unpack(_HEADER, data[:hsz])
+        if magic != _MAGIC or len(data) != hsz + 6*n:
+            raise Exception('"{}" is not a valid mask file'.format(path))
+
+        runs = np.frombuffer(data, dtype='<u2', offset=hsz).reshape(3, n)
+
+        return MaskRLE((h, w), runs[0], runs[1], runs[2])
+
+    def save(self, path):
+        '''
+        Writes the mask to a .rle file.
+        path: file path.
+        '''
+
+        with open(path, 'wb') as f:
+            f.write(struct.pack(_HEADER, _MAGIC, self.shape[1], self.shape[0], len(self.rows)))
+            for a in (self.rows, self.starts, self.ends):
+                f.write(np.asarray(a, dtype='<u2').tobytes())
+
+    def area(self, scale=1):
+        '''
+        Returns the number of foreground pixels, without rasterizing the mask.
+        scale: scale factor, the result is the area of decode(scale).
+        '''
+
+        if scale == 1:
+            return int(np.sum(self.ends.astype(np.int64) - self.starts))
+
+        ty, xs, xe = self._scaled_runs(scale)
+        return int(np.sum(xe - xs))
+
+    def bbox(self, scale=1):
+        '''
+        Returns the bounding box (x, y, w, h) of all foreground pixels, without rasterizing the mask.
+        scale: scale factor, the result is the bounding box of decode(scale).
+        '''
+
+        ty, xs, xe = self._scaled_runs(scale)
+        if len(ty) == 0:
+            return (0, 0, 0, 0)
+
+        x, y = int(xs.min()), int(ty[0])
+        return (x, y, int(xe.max()) - x, int(ty[-1]) - y + 1)
+
+    def min_area_rect(self, scale=1):
+        '''
+        Returns the minimum area rotated rect ((cx, cy), (w, h), angle) that encloses all foreground pixels, without rasterizing the mask.
+        Pixels are regarded as unit squares, compared to cv2.minAreaRect() applied to the contour of the mask (which passes
+        through pixel centers at integer coordinates) both sides are |cos(angle)| + |sin(angle)| pixels longer, so between 1
+        (axis-aligned) and sqrt(2) (45 degrees), and the center is offset by (+0.5, +0.5) pixels. All times scale.
+        scale: scale factor applied to the resulting coordinates.
+        '''
+
+        if len(self.rows) == 0:
+            return ((0.0, 0.0), (0.0, 0.0), 0.0)
+
+        # only the leftmost and rightmost pixel of every row can lie on the convex hull
+
+        first = np.flatnonzero(np.concatenate(([True], self.rows[1:] != self.rows[:-1])))
+        y = self.rows[first].astype(np.float32)
+        x0 = np.minimum.reduceat(self.starts, first).astype(np.float32)
+        x1 = np.maximum.reduceat(self.ends, first).astype(np.float32)
+
+        pts = np.concatenate((np.c_[x0, y], np.c_[x1, y], np.c_[x0, y+1], np.c_[x1, y+1])) * np.float32(scale)
+        return cv2.minAreaRect(pts)
+
+    def size(self, scale=1):
+        '''
+        Returns the size (width, height) of decode(scale), following cv2.resize() conventions.
+        scale: scale factor.
+        '''
+
+        return (int(round(self.shape[1]*scale)), int(round(self.shape[0]*scale)))
+
+    def decode(self, scale=1, out=None):
+        '''
+        Rasterizes the mask at the given scale.
+        Returns an uint8 array with 255 for foreground and 0 for background pixels.
+        The mask is sampled at target pixel centers, not interpolated, which is what cv2.resize() with INTER_NEAREST_EXACT does.
+        scale: scale factor.
+        out: optional uint8 array of shape (h, w) (see size()) to write the mask to.
+        '''
+
+        w, h = self.size(scale)
+        ty, xs, xe = self._scaled_runs(scale)
+
+        # +1 at run starts and -1 (mod 256) at run ends, a cumulative sum fills the runs
+
+        if out is None:
+            ret = np.zeros((h, w), dtype=np.uint8)
+        elif out.shape != (h, w) or out.dtype != np.uint8:
+            raise Exception('out must be an uint8 array of shape {}'.format((h, w)))
+        else:
+            ret = out
+            ret[...] = 0
+
+        ret[ty, xs] = 1  # runs do not touch (see _merge()), so no marker overwrites another
+
+        inside = xe < w
+        ret[ty[inside], xe[inside]] = 255
+
+        np.cumsum(ret, axis=1, dtype=np.uint8, out=ret)
+        ret *= 255
+
+        return ret
+
+    def _scaled_runs(self, scale):
+        '''
+        Returns the (row, start, end) arrays of the nonempty runs of decode(scale).
+        scale: scale factor.
+        '''
+
+        rows = self.rows.astype(np.intp)
+        starts = self.starts.astype(np.intp)
+        ends = self.ends.astype(np.intp)
+
+        if scale == 1:
+            return self._merge(rows, starts, ends)
+
+        w, h = self.size(scale)
+        sw, sh = self.shape[1], self.shape[0]
+
+        # source row of every target row (the row of the target pixel centers), and the runs of these rows
+
+        src = (2*np.arange(h) + 1) * sh // (2*h)
+        ptr = np.searchsorted(rows, np.arange(sh+1))
+
+        first = ptr[src]
+        count = ptr[src+1] - first
+
+        ty = np.repeat(np.arange(h), count)
+        idx = np.arange(len(ty)) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)
+
+        # target pixels whose centers lie within a run, the center of target column x is at source column (2x+1)*sw/(2w)
+
+        xs = np.clip(-((sw - 2*w*starts[idx]) // (2*sw)), 0, w)
+        xe = np.clip(-((sw - 2*w*ends[idx]) // (2*sw)), 0, w)
+
+        keep = xe > xs
+        return self._merge(ty[keep], xs[keep], xe[keep])
+
+    @staticmethod
+    def _merge(rows, starts, ends):
+        '''
+        Returns (row, start, end) arrays in which runs that touch (end of a run == start of the next run in the same row) are joined.
+        Downscaling can make neighboring runs touch, decode() requires that they do not.
+        rows: row of each run.
+        starts: first column of each run.
+        ends: last column of each run + 1.
+        '''
+
+        touch = (rows[1:] == rows[:-1]) & (starts[1:] == ends[:-1])
+        if not touch.any():
+            return rows, starts, ends
+
+        first = np.concatenate(([True], ~touch))
+        last = np.concatenate((~touch, [True]))
+
+        return rows[first], starts[first], ends[last]
+
+
+# convert the masks of a dataset
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert recN-mask.png files to run-length encoded recN-mask.rle files')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite existing .rle files (outdated ones are always overwritten)')
+    args = parser.parse_args()
+
+    for d in sorted(os.listdir(args.root)):
+        if not d.startswith('pcb') or not os.path.isdir(os.path.join(args.root, d)):
+            continue
+
+        for f in sorted(os.listdir(os.path.join(args.root, d))):
+            if not f.endswith('-mask.png'):
+                continue
+
+            src = os.path.join(args.root, d, f)
+            dst = os.path.splitext(src)[0] + '.rle'
+            if os.path.exists(dst) and not args.overwrite and os.path.getmtime(dst) >= os.path.getmtime(src):
+                continue
+
+            im = cv2.imread(src, cv2.IMREAD_GRAYSCALE)
+            if im is None:
+                print('Could not load "{}"'.format(src))
+                continue
+
+            rle = MaskRLE.encode(im)
+            rle.save(dst)
+            print('{}: {} ({} -> {} bytes)'.format(src, rle, os.path.getsize(src), os.path.getsize(dst)))
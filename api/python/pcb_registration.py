@@ -0,0 +1,408 @@
+
+'''
+Registration of the recordings of a PCB via keypoint-based homography estimation.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Homographies are estimated once for a spanning set of recording pairs and stored, together with
+inlier statistics, in .pcb-registration.json in the PCB directory. Pairs that could not be registered
+are stored as well. Homographies between arbitrary recordings are obtained by composition, so no
+feature matching is required at query time unless images changed or recordings were added.
+Running this file computes the stores of all PCBs of a dataset in parallel.
+'''
+
+import os
+import os.path
+import json
+import argparse
+import tempfile
+import multiprocessing
+
+from pcb_dataset import PCB, PCBDataset, cv2, np
+
+
+def create_detector():
+    '''
+    Returns a keypoint detector / descriptor extractor with float descriptors.
+    '''
+
+    if hasattr(cv2, 'SURF'):  # OpenCV 2.4 with nonfree module
+        return cv2.SURF(1000)
+
+    return cv2.SIFT_create(5000)
+
+
+def estimate_homography(from_im, from_mask, to_im, to_mask=None, ratio=0.8, threshold=3.0):
+    '''
+    Estimate the homography that maps from_im to to_im.
+    Returns (H, number of inliers, number of matches), H is None on failure.
+    from_im: source image.
+    from_mask: mask of the source image (only keypoints on the PCB are used, None = all).
+    to_im: destination image.
+    to_mask: mask of the destination image (None = all).
+    ratio: maximum descriptor ratio of retained matches.
+    threshold: RANSAC reprojection threshold in pixels.
+    '''
+
+    detector = create_detector()
+
+    from_kp, from_desc = detector.detectAndCompute(cv2.cvtColor(from_im, cv2.COLOR_BGR2GRAY), from_mask)
+    to_kp, to_desc = detector.detectAndCompute(cv2.cvtColor(to_im, cv2.COLOR_BGR2GRAY), to_mask)
+
+    if from_desc is None or to_desc is None or len(from_kp) < 2 or len(to_kp) < 2:
+        return None, 0, 0
+
+    matches = cv2.BFMatcher().knnMatch(from_desc, to_desc, k=2)
+    matches = [m[0] for m in matches if len(m) == 2 and m[0].distance < m[1].distance * ratio]
+
+    if len(matches) < 4:
+        return None, 0, len(matches)
+
+    pt_from = np.float32([from_kp[m.queryIdx].pt for m in matches])
+    pt_to = np.float32([to_kp[m.trainIdx].pt for m in matches])
+
+    H, status = cv2.findHomography(pt_from, pt_to, cv2.RANSAC, threshold)
+    if H is None:
+        return None, 0, len(matches)
+
+    return H, int(np.sum(status)), len(matches)
+
+
+def scale_homography(H, scale):
+    '''
+    Returns the homography that corresponds to H for images scaled by the given factor.
+    H: 3x3 homography.
+    scale: scale factor.
+    '''
+
+    if scale == 1:
+        return H
+
+    S = np.diag([scale, scale, 1.0])
+    return S.dot(H).dot(np.diag([1.0/scale, 1.0/scale, 1.0]))
+
+
+class RegistrationStore:
+
+    '''
+    Homographies between the recordings of a PCB.
+    '''
+
+    def __init__(self, root, path=None, scale=0.25, min_inliers=20):
+        '''
+        Constructor, loads stored homographies if available (a store file that cannot be read is treated as empty).
+        root: PCB root directory path.
+        path: path of the store file (None = .pcb-registration.json in root).
+        scale: scale factor at which homographies are estimated, stored homographies estimated at a lower scale are re-estimated.
+        min_inliers: minimum number of inliers for accepting an estimate.
+        '''
+
+        self._root = root
+        self._path = path or os.path.join(root, '.pcb-registration.json')
+        self._scale = scale
+        self._min_inliers = min_inliers
+        self._edges = {}
+        self._failed = {}  # pairs that could not be registered, same format as edges but without 'H' (and 'reason' if loading failed)
+
+        if os.path.isfile(self._path):
+            try:
+                with open(self._path) as f:
+                    data = json.load(f)
+
+                for e in data['edges']:
+                    e['H'] = np.array(e['H'], dtype=np.float64).reshape(3, 3)
+                    self._edges[(e['from'], e['to'])] = e
+
+                for e in data.get('failed', []):
+                    self._failed[(e['from'], e['to'])] = e
+            except (IOError, OSError, ValueError, KeyError, AttributeError, TypeError):  # unreadable, start with an empty store
+                self._edges, self._failed = {}, {}
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'RegistrationStore of "{}" ({} pairs)'.format(self._root, len(self._edges))
+
+    def homography(self, from_rec, to_rec, scale=1):
+        '''
+        Returns the 3x3 homography that maps coordinates of from_rec to to_rec, None if the recordings could not be registered.
+        Stored homographies of recordings whose image changed are discarded, missing ones are estimated and stored first.
+        from_rec: source recording.
+        to_rec: destination recording.
+        scale: scale factor of the image coordinates.
+        '''
+
+        path = self._path_between(from_rec, to_rec)
+        if path is None:
+            return None
+
+        H = np.eye(3)
+        for a, b in path:
+            H = self._edge_homography(a, b).dot(H)
+
+        return scale_homography(H / H[2, 2], scale)
+
+    def stats(self, from_rec, to_rec):
+        '''
+        Returns inlier statistics of the composed homography from_rec -> to_rec as a dict
+        with keys 'hops', 'inliers' and 'matches' (minimum over all hops), None if not registered.
+        from_rec: source recording.
+        to_rec: destination recording.
+        '''
+
+        path = self._path_between(from_rec, to_rec)
+        if path is None:
+            return None
+
+        edges = [self._edges[(a, b)] if (a, b) in self._edges else self._edges[(b, a)] for a, b in path]
+        return {
+            'hops': len(path),
+            'inliers': min([e['inliers'] for e in edges]) if edges else 0,
+            'matches': min([e['matches'] for e in edges]) if edges else 0
+        }
+
+    def compute(self):
+        '''
+        Estimates homographies until all recordings are connected (if possible) and saves the store.
+        Stored results of recordings whose image changed are discarded, pairs that failed before are not tried again.
+        Pairs with a recording that cannot be loaded are stored as failed, with the error message as 'reason'.
+        Returns the number of estimated homographies.
+        '''
+
+        pcb = PCB(self._root, self._scale)
+        recs = sorted(pcb.recordings())
+
+        sigs, changed = self._discard_outdated()
+
+        if len(recs) < 2:
+            if changed:
+                self.save()
+            return 0
+
+        # the reference is a recording with a mask if possible, all others are connected to it directly or indirectly
+
+        masked = [r for r in recs if self._has_mask(r)]
+        ref = masked[0] if masked else recs[0]
+        connected = self._component(ref)
+
+        data = {}
+
+        def load(r):
+            if r not in data:
+                try:
+                    data[r] = (pcb.image(r), pcb.mask(r) if self._has_mask(r) else None)
+                except Exception as e:  # e.g. corrupt image, stored as the reason of failed pairs
+                    data[r] = str(e)
+            return data[r]
+
+        num = 0
+        for r in recs:
+            if r in connected:
+                continue
+
+            for c in [ref] + sorted(connected - set([ref])):
+                if (c, r) in self._failed:
+                    continue
+
+                e = {'from': c, 'to': r, 'inliers': 0, 'matches': 0, 'sig': [sigs[c], sigs[r]], 'scale': self._scale}
+
+                errors = ['rec{}: {}'.format(x, load(x)) for x in (c, r) if isinstance(load(x), str)]
+                if errors:
+                    e['reason'] = ', '.join(errors)
+                    self._failed[(c, r)] = e
+                    changed = True
+                    continue
+
+                (from_im, from_mask), (to_im, to_mask) = load(c), load(r)
+                H, inliers, matches = estimate_homography(from_im, from_mask, to_im, to_mask)
+                num += 1
+
+                e['inliers'], e['matches'] = inliers, matches
+
+                if H is not None and inliers >= self._min_inliers:
+                    e['H'] = scale_homography(H, 1.0/self._scale)
+                    self._edges[(c, r)] = e
+
+                    connected = self._component(ref)
+                    break
+
+                self._failed[(c, r)] = e
+
+        if num > 0 or changed:
+            self.save()
+
+        return num
+
+    def save(self):
+        '''
+        Writes the store file (atomically, via a unique temporary file so that concurrent writers do not interfere).
+        Does nothing if the PCB directory is not writable.
+        '''
+
+        edges = []
+        for k in sorted(self._edges):
+            e = dict(self._edges[k])
+            e['H'] = e['H'].ravel().tolist()
+            edges.append(e)
+
+        failed = [self._failed[k] for k in sorted(self._failed)]
+
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self._path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(self._path)))
+        except (IOError, OSError):  # read-only dataset, the store is kept in memory
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'edges': edges, 'failed': failed}, f, indent=1)
+            os.chmod(tmp, 0o644)  # mkstemp() creates files readable only by the owner
+            os.rename(tmp, self._path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _signature(self, rec):
+        '''
+        Returns [size, mtime] of the image file of a recording.
+        rec: recording ID.
+        '''
+
+        st = os.stat(os.path.join(self._root, 'rec{}.jpg'.format(rec)))
+        return [st.st_size, st.st_mtime]
+
+    def _discard_outdated(self):
+        '''
+        Removes stored results of recordings that no longer exist or whose image changed, and those estimated at a lower scale.
+        Returns a dict that maps all recordings to their signature (see _signature()) and whether results were removed.
+        '''
+
+        sigs = dict((r, self._signature(r)) for r in PCB(self._root).recordings())
+        changed = False
+
+        for results in (self._edges, self._failed):
+            for k in list(results):
+                e = results[k]
+                if k[0] not in sigs or k[1] not in sigs or e['sig'] != [sigs[k[0]], sigs[k[1]]] or e.get('scale', 0) < self._scale:
+                    del results[k]
+                    changed = True
+
+        return sigs, changed
+
+    def _has_mask(self, rec):
+        '''
+        Returns whether a recording has a mask.
+        rec: recording ID.
+        '''
+
+        return any(os.path.isfile(os.path.join(self._root, 'rec{}-mask.{}'.format(rec, e))) for e in ('png', 'rle'))
+
+    def _edge_homography(self, a, b):
+        '''
+        Returns the stored homography a -> b (inverting b -> a if necessary).
+        a: source recording.
+        b: destination recording.
+        '''
+
+        if (a, b) in self._edges:
+            return self._edges[(a, b)]['H']
+
+        return np.linalg.inv(self._edges[(b, a)]['H'])
+
+    def _neighbors(self):
+        '''
+        Returns a dict that maps recordings to sets of directly registered recordings.
+        '''
+
+        ret = {}
+        for a, b in self._edges:
+            ret.setdefault(a, set()).add(b)
+            ret.setdefault(b, set()).add(a)
+
+        return ret
+
+    def _component(self, rec):
+        '''
+        Returns the set of recordings connected to rec.
+        rec: recording ID.
+        '''
+
+        nb = self._neighbors()
+        ret, todo = set([rec]), [rec]
+        while todo:
+            for n in nb.get(todo.pop(), ()):
+                if n not in ret:
+                    ret.add(n)
+                    todo.append(n)
+
+        return ret
+
+    def _path_between(self, from_rec, to_rec, compute=True):
+        '''
+        Returns the shortest list of (a, b) edges that connects from_rec to to_rec, None if not connected.
+        from_rec: source recording.
+        to_rec: destination recording.
+        compute: whether to discard outdated homographies first and run compute() if the recordings are not connected.
+        '''
+
+        if compute:
+            self._discard_outdated()
+
+        nb = self._neighbors()
+        prev, todo = {from_rec: None}, [from_rec]
+
+        while todo and to_rec not in prev:
+            nxt = []
+            for r in todo:
+                for n in sorted(nb.get(r, ())):
+                    if n not in prev:
+                        prev[n] = r
+                        nxt.append(n)
+            todo = nxt
+
+        if to_rec not in prev:
+            if compute:
+                self.compute()
+                return self._path_between(from_rec, to_rec, False)
+            return None
+
+        path = []
+        r = to_rec
+        while prev[r] is not None:
+            path.insert(0, (prev[r], r))
+            r = prev[r]
+
+        return path
+
+
+def register_pcb(root):
+    '''
+    Computes the registration store of a PCB, returns (PCB root, number of recordings, number of connected recordings).
+    root: PCB root directory path.
+    '''
+
+    store = RegistrationStore(root)
+    store.compute()
+
+    recs = sorted(PCB(root).recordings())
+    connected = store._component(recs[0]) if recs else set()
+
+    return root, len(recs), len(connected)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Register the recordings of all PCBs of the dataset')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    db = PCBDataset(args.root)
+    pool = multiprocessing.Pool(args.processes)
+
+    for root, num, connected in pool.imap_unordered(register_pcb, [db._pcb_paths[id] for id in db.pcb_ids()]):
+        print('{}: {} of {} recordings registered'.format(os.path.basename(root), connected, num))
+
+    pool.close()
+    pool.join()
@@ -0,0 +1,241 @@
+
+'''
+Headless rendering of IC annotation overlays of the DSLR dataset for visual review.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Every recording is decoded at the smallest JPEG reduction that still provides the thumbnail
+width and all IC boxes are drawn with a single cv2.polylines() call at thumbnail scale.
+Recordings are rendered in parallel worker processes, which also write the thumbnails. The
+result is an HTML gallery (index.html) and optionally contact sheets with a grid of thumbnails.
+'''
+
+import os
+import os.path
+import argparse
+import multiprocessing
+
+from xml.sax.saxutils import escape, quoteattr
+
+from pcb_dataset import PCB, PCBDataset, cv2, np
+from pcb_export import bounded_imap
+from pcb_geometry import as_rects, polygons
+from pcb_index import jpeg_size
+from pcb_masks import MaskRLE
+
+
+def render_recording(pcb, rec, width=320, masked=False):
+    '''
+    Returns a thumbnail of a recording with all ICs drawn, and the list of ICs (None if the recording is not annotated).
+    The scale factor of the PCB is ignored.
+    pcb: PCB object.
+    rec: recording ID.
+    width: thumbnail width in pixels.
+    masked: whether to darken the background (requires a mask).
+    '''
+
+    path = os.path.join(pcb._root, 'rec{}.jpg'.format(rec))
+    w, h = jpeg_size(path)
+
+    r = max([f for f in (1, 2, 4, 8) if w // f >= width] or [1])
+    im = pcb._imread(path, getattr(cv2, 'IMREAD_REDUCED_COLOR_{}'.format(r)) if r > 1 else cv2.IMREAD_COLOR)
+    if im is None or im.size == 0:
+        raise Exception('Could not load the image')
+
+    s = float(width) / w
+    size = (width, max(1, int(round(h * s))))
+
+    t = pcb._tic()
+    im = cv2.resize(im, size, interpolation=cv2.INTER_AREA)
+    pcb._toc('resize', t)
+
+    if masked:
+        mask = _thumbnail_mask(pcb, rec, r, s)
+        if mask.shape != im.shape[:2]:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+
+        im[mask == 0] //= 3
+
+    base = PCB(pcb._root)  # unscaled annotations
+    if not base.has_annotations(rec):
+        return im, None
+
+    ics = base.ics(rec)
+
+    rects = as_rects(ics)
+    rects[:, :4] *= s
+
+    cv2.polylines(im, list(polygons(rects)), True, (0, 255, 0), 1, cv2.LINE_AA)
+
+    return im, ics
+
+
+def _thumbnail_mask(pcb, rec, r, s):
+    '''
+    Returns the mask of a recording at (about) thumbnail size without decoding it at full resolution.
+    pcb: PCB object.
+    rec: recording ID.
+    r: JPEG reduction factor (1, 2, 4 or 8), used for PNG masks.
+    s: thumbnail scale factor, used for .rle masks.
+    '''
+
+    fpath = pcb._mask_rle_path(rec)
+    if fpath is not None:
+        t = pcb._tic()
+        mask = MaskRLE.load(fpath).decode(s)
+        pcb._toc('decode', t)
+        return mask
+
+    mask = pcb._imread(os.path.join(pcb._root, 'rec{}-mask.png'.format(rec)), getattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_{}'.format(r)) if r > 1 else cv2.IMREAD_GRAYSCALE)
+    if mask is None or mask.size == 0:
+        raise Exception('Could not load the mask')
+
+    return mask
+
+
+def _render(task):
+    '''
+    Renders a recording and writes the thumbnail.
+    Returns (PCB ID, recording ID, thumbnail file name, IC labels or None, thumbnail or None, error message or None).
+    task: (PCB root, recording ID, output directory, thumbnail width, whether to darken the background, whether to return the thumbnail).
+    '''
+
+    root, rec, out, width, masked, keep = task
+
+    pcb = PCB(root)
+    try:
+        im, ics = render_recording(pcb, rec, width, masked)
+    except Exception as e:  # reported by render()
+        return pcb.id(), rec, None, None, None, str(e)
+
+    name = 'pcb{}-rec{}.jpg'.format(pcb.id(), rec)
+    cv2.imwrite(os.path.join(out, name), im, [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+    return pcb.id(), rec, name, None if ics is None else [ic.text for ic in ics], im if keep else None, None
+
+
+def contact_sheet(items, columns=8, width=320):
+    '''
+    Returns a contact sheet, an image with a grid of thumbnails and their captions.
+    items: list of (caption, thumbnail or None).
+    columns: number of thumbnails per row.
+    width: thumbnail width.
+    '''
+
+    heights = [im.shape[0] for _, im in items if im is not None]
+    ch, th = 18, max(heights) if heights else width // 2
+
+    rows = (len(items) + columns - 1) // columns
+    sheet = np.full((rows * (th + ch), columns * width, 3), 32, dtype=np.uint8)
+
+    for i, (caption, im) in enumerate(items):
+        x, y = (i % columns) * width, (i // columns) * (th + ch)
+        if im is not None:
+            sheet[y:y+im.shape[0], x:x+im.shape[1]] = im
+
+        cv2.putText(sheet, caption, (x + 4, y + th + ch - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1, cv2.LINE_AA)
+
+    return sheet
+
+
+def write_gallery(path, entries):
+    '''
+    Writes an HTML gallery of thumbnails.
+    path: output file path.
+    entries: list of (PCB ID, recording ID, thumbnail file name relative to path or None, IC labels or None, error message or None).
+    '''
+
+    lines = [
+        '<!DOCTYPE html>',
+        '<html><head><meta charset="utf-8"><title>PCB annotations</title><style>',
+        'body { background: #202020; color: #ddd; font-family: sans-serif; }',
+        'figure { display: inline-block; margin: 4px; } figcaption { font-size: 12px; } .missing { color: #f66; }',
+        '</style></head><body>'
+    ]
+
+    pid = None
+    for id, rec, name, labels, error in entries:
+        if id != pid:
+            lines.append('<h2>PCB {}</h2>'.format(id))
+            pid = id
+
+        if labels is None:
+            caption = '<span class="missing">rec {}: not annotated</span>'.format(rec)
+        else:
+            caption = 'rec {}: {} ICs'.format(rec, len(labels))
+
+        img = '<img src={} title={} loading="lazy">'.format(quoteattr(name), quoteattr('\n'.join(labels or []))) if name else '<span class="missing">{}</span>'.format(escape(error or 'could not load'))
+        lines.append('<figure>{}<figcaption>{}</figcaption></figure>'.format(img, caption))
+
+    lines.append('</body></html>')
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def render(db, out, width=320, masked=False, sheets=0, columns=8, processes=None):
+    '''
+    Renders all recordings of a dataset to out/index.html (and optionally contact sheets out/sheet-N.jpg).
+    Returns the number of rendered recordings and a list of (pcb, rec, reason) of recordings that could not be rendered.
+    db: PCBDataset.
+    out: output directory (created if necessary).
+    width: thumbnail width in pixels.
+    masked: whether to darken the background.
+    sheets: number of thumbnails per contact sheet (0 = no contact sheets).
+    columns: number of thumbnails per row of contact sheets.
+    processes: number of worker processes (None = number of CPUs).
+    '''
+
+    if not os.path.isdir(out):
+        os.makedirs(out)
+
+    tasks = []
+    for id in db.pcb_ids():
+        root = db._pcb_paths[id]
+        for rec in sorted(PCB(root).recordings()):
+            tasks.append((root, rec, out, width, masked, sheets > 0))
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+
+    entries, page = [], []
+
+    def flush():
+        cv2.imwrite(os.path.join(out, 'sheet-{}.jpg'.format((len(entries) - 1) // sheets)), contact_sheet(page, columns, width), [cv2.IMWRITE_JPEG_QUALITY, 85])
+        del page[:]
+
+    try:
+        for id, rec, name, labels, im, error in bounded_imap(pool, _render, tasks, 2*processes):
+            entries.append((id, rec, name, labels, error))
+
+            if sheets > 0:
+                note = ' (failed)' if error is not None else ' (no annotations)' if labels is None else ''
+                page.append(('{}/{}{}'.format(id, rec, note), im))
+                if len(page) == sheets:
+                    flush()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if page:
+        flush()
+
+    write_gallery(os.path.join(out, 'index.html'), entries)
+
+    return sum(1 for e in entries if e[2] is not None), [(e[0], e[1], e[4]) for e in entries if e[4] is not None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render IC annotations of all recordings to an HTML gallery and contact sheets')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--out', type=str, dest='out', required=True, help='Output directory')
+    parser.add_argument('--width', type=int, dest='width', default=320, help='Thumbnail width in pixels')
+    parser.add_argument('--masked', action='store_true', help='Darken the background (requires masks)')
+    parser.add_argument('--sheets', type=int, dest='sheets', default=0, help='Number of thumbnails per contact sheet (0 = no contact sheets)')
+    parser.add_argument('--columns', type=int, dest='columns', default=8, help='Number of thumbnails per row of contact sheets')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    n, failed = render(PCBDataset(args.root), args.out, args.width, args.masked, args.sheets, args.columns, args.processes)
+    for pcb, rec, reason in failed:
+        print('Could not render PCB {} rec {}: {}'.format(pcb, rec, reason))
+    print('Rendered {} recordings to "{}"'.format(n, os.path.join(args.out, 'index.html')))
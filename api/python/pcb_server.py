@@ -0,0 +1,430 @@
+
+'''
+Read-only HTTP server for images, masks and IC annotations of the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Requires Python 3 (asyncio), no other dependencies than the dataset API. Routes (GET or HEAD):
+
+  /pcbs                                   PCB IDs and their recordings (JSON)
+  /pcbs/<pcb>/<rec>/image                 image (?masked=1 for PCB.image_masked())
+  /pcbs/<pcb>/<rec>/mask                  mask (PNG)
+  /pcbs/<pcb>/<rec>/crop?x=&y=&w=&h=      region of the image
+  /pcbs/<pcb>/<rec>/tiles/<size>/<x>/<y>  square tile of the image
+  /pcbs/<pcb>/<rec>/ics                   IC annotations (JSON, ?cropped=1 for masked images)
+  /pcbs/<pcb>/<rec>/ics/<i>               upright patch of an IC (?margin= relative to its size, 0 to 2)
+
+All routes accept ?scale= (coordinates refer to the scaled image), image routes also ?format=jpg|png
+and ?quality= (0 to 100), invalid parameters are answered with status 400. Responses carry an ETag
+derived from the files of the recording, so clients can revalidate with If-None-Match. Decoded
+images are kept in an LRU cache, concurrent requests for the same image wait for a single decode.
+All file system access, decoding and encoding runs in a thread pool, not on the event loop.
+'''
+
+import os
+import os.path
+import json
+import math
+import asyncio
+import hashlib
+import argparse
+import concurrent.futures
+
+from urllib.parse import urlsplit, parse_qsl
+
+from pcb_dataset import PCB, PCBDataset, FrameCache, cv2, np
+from pcb_geometry import as_rects, box_points
+from pcb_verify import recording_files
+
+
+class HTTPError(Exception):
+
+    '''
+    An error that is reported to the client with the given status code.
+    '''
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class DatasetServer:
+
+    '''
+    HTTP server for a PCBDataset.
+    '''
+
+    def __init__(self, db, cache_bytes=512 << 20, workers=None):
+        '''
+        Constructor.
+        db: PCBDataset.
+        cache_bytes: size of the decoded image cache in bytes.
+        workers: number of decode / encode threads (None = number of CPUs).
+        '''
+
+        self._db = db
+        self._cache = FrameCache(cache_bytes, db.stats())
+        self._pending = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count())
+
+    async def start(self, host='127.0.0.1', port=8000):
+        '''
+        Starts serving, returns the asyncio server (port 0 = any free port, see server.sockets).
+        host: interface to listen on.
+        port: TCP port.
+        '''
+
+        return await asyncio.start_server(self._client, host, port)
+
+    def close(self):
+        '''
+        Shuts down the worker threads.
+        '''
+
+        self._executor.shutdown(wait=False)
+
+    async def _client(self, reader, writer):
+        '''
+        Handles the requests of a single connection (with keep-alive).
+        '''
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+
+                parts = line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+
+                method, target, version = parts
+                status, rheaders, body = await self._respond(method, target, headers)
+
+                keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                rheaders['Content-Length'] = str(len(body))
+                rheaders['Connection'] = 'keep-alive' if keep else 'close'
+
+                head = 'HTTP/1.1 {} {}\r\n'.format(status, _REASONS.get(status, ''))
+                head += ''.join('{}: {}\r\n'.format(k, v) for k, v in rheaders.items())
+                writer.write(head.encode('latin-1') + b'\r\n')
+                if method != 'HEAD' and status != 304:
+                    writer.write(body)
+                await writer.drain()
+
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, target, headers):
+        '''
+        Returns (status, headers, body) for a request.
+        '''
+
+        if method not in ('GET', 'HEAD'):
+            return self._error(405, 'Only GET and HEAD are supported')
+
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        path = [p for p in url.path.split('/') if p]
+
+        try:
+            etag = await self._run(self._etag, path, query)
+            if etag is not None and headers.get('if-none-match') == etag:
+                return 304, {'ETag': etag}, b''
+
+            ctype, body = await self._route(path, query)
+        except HTTPError as e:
+            return self._error(e.status, str(e))
+        except Exception as e:
+            return self._error(500, str(e))
+
+        rheaders = {'Content-Type': ctype, 'Cache-Control': 'no-cache'}
+        if etag is not None:
+            rheaders['ETag'] = etag
+
+        return 200, rheaders, body
+
+    def _error(self, status, message):
+        '''
+        Returns an error response.
+        '''
+
+        return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode('utf-8')
+
+    def _pcb_root(self, id):
+        '''
+        Returns the root directory of a PCB.
+        '''
+
+        try:
+            return self._db._pcb_paths[int(id)]
+        except (KeyError, ValueError):
+            raise HTTPError(404, 'Unknown PCB "{}"'.format(id))
+
+    def _signature(self, root, rec):
+        '''
+        Returns a string that changes whenever a file of a recording changes.
+        '''
+
+        ret = []
+        for p in recording_files(root, rec):
+            try:
+                st = os.stat(p)
+                ret.append('{} {} {}'.format(os.path.basename(p), st.st_size, st.st_mtime))
+            except OSError:
+                pass
+
+        return ';'.join(ret)
+
+    def _etag(self, path, query):
+        '''
+        Returns the ETag of a resource, derived from the request and the files of the recording (None for dataset-level routes).
+        '''
+
+        if len(path) < 3 or path[0] != 'pcbs':
+            return None
+
+        h = hashlib.sha1('/'.join(path).encode('utf-8'))
+        h.update(json.dumps(sorted(query.items())).encode('utf-8'))
+        h.update(self._signature(self._pcb_root(path[1]), path[2]).encode('utf-8'))
+
+        return '"{}"'.format(h.hexdigest())
+
+    async def _route(self, path, query):
+        '''
+        Returns (content type, body) of a resource.
+        '''
+
+        if path == ['pcbs']:
+            ret = await self._run(self._pcbs)
+            return 'application/json', json.dumps(ret).encode('utf-8')
+
+        if len(path) < 4 or path[0] != 'pcbs':
+            raise HTTPError(404, 'Unknown resource')
+
+        root = self._pcb_root(path[1])
+        try:
+            rec = int(path[2])
+        except ValueError:
+            raise HTTPError(400, 'Invalid recording "{}"'.format(path[2]))
+
+        if rec not in await self._run(self._recordings, root):
+            raise HTTPError(404, 'Unknown recording "{}"'.format(path[2]))
+
+        scale = self._float(query, 'scale', 1.0)
+        if scale <= 0 or scale > 2:
+            raise HTTPError(400, 'Scale must be > 0 and <= 2')
+
+        kind = path[3]
+        if kind == 'image' and len(path) == 4:
+            im = await self._frame(root, rec, 'masked' if query.get('masked') == '1' else 'image', scale)
+            return await self._encode(im, query)
+
+        if kind == 'mask' and len(path) == 4:
+            im = await self._frame(root, rec, 'mask', scale)
+            return await self._encode(im, dict(query, format='png'))
+
+        if kind == 'crop' and len(path) == 4:
+            im = await self._frame(root, rec, 'image', scale)
+            x, y, w, h = [self._int(query, k) for k in ('x', 'y', 'w', 'h')]
+            return await self._encode(self._crop(im, x, y, w, h), query)
+
+        if kind == 'tiles' and len(path) == 7:
+            im = await self._frame(root, rec, 'image', scale)
+            size, tx, ty = [self._int(dict(v=p), 'v') for p in path[4:7]]
+            return await self._encode(self._crop(im, tx*size, ty*size, size, size), query)
+
+        if kind == 'ics' and len(path) == 4:
+            mask = await self._frame(root, rec, 'mask', scale) if query.get('cropped') == '1' else None
+            ics = await self._run(self._ics, root, rec, scale, mask)
+            rects = as_rects(ics)
+            ret = [{'rect': r.tolist(), 'polygon': c.ravel().tolist(), 'text': ic.text} for ic, r, c in zip(ics, rects, box_points(rects))]
+            return 'application/json', json.dumps(ret).encode('utf-8')
+
+        if kind == 'ics' and len(path) == 5:
+            ics = await self._run(self._ics, root, rec, scale)
+            i = self._int(dict(v=path[4]), 'v')
+            if i < 0 or i >= len(ics):
+                raise HTTPError(404, 'Unknown IC "{}"'.format(path[4]))
+
+            margin = self._float(query, 'margin', 0.1)
+            if margin < 0 or margin > 2:
+                raise HTTPError(400, 'Margin must be >= 0 and <= 2')
+
+            im = await self._frame(root, rec, 'image', scale)
+            patch = await self._run(self._ic_patch, im, ics[i].rect, margin)
+            return await self._encode(patch, query)
+
+        raise HTTPError(404, 'Unknown resource')
+
+    def _pcbs(self):
+        '''
+        Returns a dict that maps PCB IDs (strings) to sorted lists of their recordings.
+        '''
+
+        return dict((str(id), self._recordings(self._db._pcb_paths[id])) for id in self._db.pcb_ids())
+
+    def _recordings(self, root):
+        '''
+        Returns a sorted list of the recordings of a PCB.
+        '''
+
+        return sorted(PCB(root).recordings())
+
+    def _ics(self, root, rec, scale, mask=None):
+        '''
+        Returns the ICs of a recording, with coordinates for cropped images if the (scaled and cached) mask is given.
+        '''
+
+        pcb = PCB(root, scale)
+        if mask is None:
+            return pcb.ics(rec)
+
+        pcb._cropinfo(rec, mask)  # from the cached mask instead of decoding it again
+        return pcb.ics(rec, True)
+
+    def _int(self, query, key, default=None):
+        '''
+        Returns an int query parameter (default if missing, required if default is None).
+        '''
+
+        if key not in query and default is not None:
+            return default
+
+        try:
+            return int(query[key])
+        except (KeyError, ValueError):
+            raise HTTPError(400, 'Missing or invalid parameter "{}"'.format(key))
+
+    def _float(self, query, key, default=None):
+        '''
+        Returns a finite float query parameter (default if missing, required if default is None).
+        '''
+
+        if key not in query and default is not None:
+            return default
+
+        try:
+            ret = float(query[key])
+        except (KeyError, ValueError):
+            ret = None
+
+        if ret is None or not math.isfinite(ret):
+            raise HTTPError(400, 'Missing or invalid parameter "{}"'.format(key))
+
+        return ret
+
+    def _crop(self, im, x, y, w, h):
+        '''
+        Returns a region of an image, clipped to the image bounds.
+        '''
+
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(im.shape[1], x + w), min(im.shape[0], y + h)
+        if w <= 0 or h <= 0 or x1 <= x0 or y1 <= y0:
+            raise HTTPError(400, 'Region lies outside the image')
+
+        return im[y0:y1, x0:x1]
+
+    def _ic_patch(self, im, rect, margin):
+        '''
+        Returns the upright patch of an IC.
+        '''
+
+        (cx, cy), (w, h), angle = rect
+        w, h = w * (1 + 2*margin), h * (1 + 2*margin)
+
+        M = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+        M[:, 2] += (w/2.0 - cx, h/2.0 - cy)
+
+        return cv2.warpAffine(im, M, (max(1, int(round(w))), max(1, int(round(h)))), flags=cv2.INTER_LINEAR)
+
+    async def _run(self, fn, *args):
+        '''
+        Runs a function in the worker pool.
+        '''
+
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _frame(self, root, rec, kind, scale):
+        '''
+        Returns a decoded image ('image', 'mask' or 'masked'), from the cache if possible.
+        Concurrent requests for the same image share a single decode.
+        '''
+
+        key = (root, rec, kind, scale, await self._run(self._signature, root, rec))
+
+        im = self._cache.get(key)
+        if im is not None:
+            return im
+
+        if key not in self._pending:
+            pcb = PCB(root, scale)
+            fn = {'image': pcb.image, 'mask': pcb.mask, 'masked': pcb.image_masked}[kind]
+            self._pending[key] = asyncio.ensure_future(self._run(fn, rec))
+
+        future = self._pending[key]
+        try:
+            im = await future
+        finally:
+            self._pending.pop(key, None)
+
+        return self._cache.put(key, im)  # read-only, shared between requests
+
+    async def _encode(self, im, query):
+        '''
+        Returns (content type, body) of an encoded image.
+        '''
+
+        fmt = query.get('format', 'jpg')
+        if fmt not in ('jpg', 'png'):
+            raise HTTPError(400, 'Format must be jpg or png')
+
+        quality = self._int(query, 'quality', 90)
+        if quality < 0 or quality > 100:
+            raise HTTPError(400, 'Quality must be >= 0 and <= 100')
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == 'jpg' else []
+        ok, data = await self._run(cv2.imencode, '.' + fmt, np.ascontiguousarray(im), params)
+        if not ok:
+            raise HTTPError(500, 'Could not encode the image')
+
+        return 'image/jpeg' if fmt == 'jpg' else 'image/png', data.tobytes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the dataset via HTTP')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--host', type=str, dest='host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, dest='port', default=8000, help='TCP port')
+    parser.add_argument('--workers', type=int, dest='workers', default=os.cpu_count(), help='Number of decode threads')
+    parser.add_argument('--cache-mb', type=int, dest='cache_mb', default=512, help='Size of the decoded image cache in MB')
+    args = parser.parse_args()
+
+    server = DatasetServer(PCBDataset(args.root), args.cache_mb << 20, args.workers)
+
+    loop = asyncio.get_event_loop()
+    s = loop.run_until_complete(server.start(args.host, args.port))
+    print('Serving "{}" on http://{}:{}/pcbs'.format(args.root, args.host, args.port))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+        server.close()
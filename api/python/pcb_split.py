@@ -0,0 +1,155 @@
+
+'''
+Group-aware, stratified and balanced splitting of the DSLR dataset into folds or shards.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+All recordings of a PCB end up in the same part, so images of the same board never appear in
+both training and test data. PCBs of every label (e.g. mainboard or not) are spread evenly over
+the parts, and among the parts that may take a PCB, the one with the least estimated cost
+(image pixels, read from the JPEG headers and stored in the dataset index) is chosen. The result
+depends only on the dataset, the labels and the seed, so distributed workers can compute their
+shard independently.
+'''
+
+import json
+import random
+import argparse
+
+from pcb_dataset import PCBDataset
+
+
+def read_ids(path):
+    '''
+    Returns the set of PCB IDs in a text file (whitespace-separated, e.g. the mainboard ID file).
+    path: file path.
+    '''
+
+    with open(path) as f:
+        return set(int(s) for s in f.read().split())
+
+
+def costs(db, balance=True):
+    '''
+    Returns a dict that maps PCB IDs to their estimated processing cost.
+    db: PCBDataset.
+    balance: whether to use the number of image pixels (computed once and stored in the index), otherwise the number of recordings.
+    '''
+
+    if not balance:
+        return dict((id, len(db.pcb(id).recordings())) for id in db.pcb_ids())
+
+    index = db.index(fields=('size',))
+
+    sizes = {}
+    for id, rec in index.keys():
+        s = index.get(id, rec, 'size')
+        sizes.setdefault(id, []).append(s[0] * s[1] if s is not None else None)
+
+    known = [s for v in sizes.values() for s in v if s is not None]
+    default = float(sum(known)) / len(known) if known else 1.0
+
+    return dict((id, sum(s if s is not None else default for s in sizes.get(id, []))) for id in db.pcb_ids())
+
+
+def split(db, n, labels=None, seed=0, balance=True):
+    '''
+    Splits the recordings of a dataset into n parts, returns a list of n sorted lists of (pcb, rec).
+    All recordings of a PCB are in the same part, the numbers of PCBs per label differ by at most one between parts
+    and parts are balanced by estimated cost (see costs()) as far as this allows.
+    db: PCBDataset.
+    n: number of parts (e.g. folds or workers).
+    labels: dict that maps PCB IDs to labels for stratification (None = no stratification, missing IDs get label None).
+    seed: seed that determines the assignment of PCBs with equal label and similar cost.
+    balance: see costs().
+    '''
+
+    if n < 1:
+        raise Exception('Number of parts must be >= 1')
+
+    cost = costs(db, balance)
+    ids = db.pcb_ids()
+
+    strata = {}
+    for id in ids:
+        label = labels.get(id) if labels is not None else None
+        strata[label] = strata.get(label, 0) + 1
+
+    rng = random.Random(seed)
+    counts = [{} for i in range(n)]
+    totals = [0.0] * n
+    parts = [[] for i in range(n)]
+
+    def allowed(i, label):
+        # every part gets floor(k/n) or ceil(k/n) of the k PCBs with this label
+        if labels is None:
+            return True
+
+        q, r = divmod(strata[label], n)
+        c = counts[i].get(label, 0)
+        full = sum(1 for j in range(n) if counts[j].get(label, 0) > q)
+
+        return c < q or (c == q and full < r)
+
+    # largest PCBs first (random order among equal costs), each to the allowed part with the lowest total cost
+
+    rng.shuffle(ids)
+    ids.sort(key=lambda id: -cost[id])
+
+    for id in ids:
+        label = labels.get(id) if labels is not None else None
+
+        order = list(range(n))
+        rng.shuffle(order)
+
+        p = min([i for i in order if allowed(i, label)], key=lambda i: totals[i])
+        counts[p][label] = counts[p].get(label, 0) + 1
+        totals[p] += cost[id]
+        parts[p].append(id)
+
+    return [sorted((id, rec) for id in ids for rec in db.pcb(id).recordings()) for ids in parts]
+
+
+def shard(db, rank, world_size, seed=0, labels=None, balance=True):
+    '''
+    Returns the sorted list of (pcb, rec) of a worker, see split().
+    db: PCBDataset.
+    rank: index of the worker (0 to world_size-1).
+    world_size: number of workers.
+    seed: see split(), must be the same for all workers.
+    labels: see split().
+    balance: see split().
+    '''
+
+    if rank < 0 or rank >= world_size:
+        raise Exception('Rank must be >= 0 and < world size')
+
+    return split(db, world_size, labels, seed, balance)[rank]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split the dataset into balanced parts of whole PCBs')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--parts', type=int, dest='parts', default=10, help='Number of parts')
+    parser.add_argument('--ids', type=str, dest='ids', help='File with PCB IDs of a class to stratify by (e.g. mainboards)')
+    parser.add_argument('--seed', type=int, dest='seed', default=0, help='Seed')
+    parser.add_argument('--report', type=str, dest='report', help='Write the parts to this JSON file')
+    args = parser.parse_args()
+
+    db = PCBDataset(args.root)
+
+    labels = None
+    if args.ids:
+        ids = read_ids(args.ids)
+        labels = dict((id, int(id in ids)) for id in db.pcb_ids())
+
+    parts = split(db, args.parts, labels, args.seed)
+    cost = costs(db)
+
+    for i, part in enumerate(parts):
+        pcbs = sorted(set(k[0] for k in part))
+        extra = ', {} labeled'.format(sum(labels[id] for id in pcbs)) if labels else ''
+        print('Part {}: {} PCBs, {} recordings, {:.1f} MPixel{}'.format(i, len(pcbs), len(part), sum(cost[id] for id in pcbs) / 1e6, extra))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump([[list(k) for k in part] for part in parts], f)
@@ -0,0 +1,286 @@
+
+'''
+Verify the integrity of the DSLR dataset.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Every recording is checked for readable image and mask files of equal size, a parseable
+annotation file and ICs whose centers lie within the mask. Checks run in a process pool.
+Results are cached per recording together with the size and modification time (and optionally
+a content hash) of its files, so subsequent runs only check recordings whose files changed.
+'''
+
+import os
+import os.path
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+
+from pcb_dataset import PCB, PCBDataset, cv2
+
+
+_CACHE_VERSION = 1
+
+
+def recording_files(root, rec):
+    '''
+    Returns the paths of all files that belong to a recording.
+    root: PCB root directory path.
+    rec: recording ID.
+    '''
+
+    return [os.path.join(root, 'rec{}{}'.format(rec, s)) for s in ('.jpg', '-mask.png', '-mask.rle', '-annot.txt', '-annot.bin')]
+
+
+def file_hash(path):
+    '''
+    Returns the SHA-1 hash of a file.
+    path: file path.
+    '''
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def signature(paths, hashes=None):
+    '''
+    Returns a dict that maps file names to [size, mtime, hash] (None for missing files).
+    paths: file paths.
+    hashes: whether to compute content hashes (otherwise the hash is None).
+    '''
+
+    ret = {}
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            ret[os.path.basename(p)] = None
+            continue
+
+        ret[os.path.basename(p)] = [st.st_size, st.st_mtime, file_hash(p) if hashes else None]
+
+    return ret
+
+
+def unchanged(old, paths, hashes):
+    '''
+    Returns the current signature of the given files if it matches old, None otherwise.
+    Files with a different modification time but the same size and content hash are considered unchanged.
+    old: cached signature (see signature()).
+    paths: file paths.
+    hashes: whether to compare content hashes of files whose modification time changed.
+    '''
+
+    new = signature(paths)
+    if set(old) != set(new):
+        return None
+
+    for p in paths:
+        o, n = old[os.path.basename(p)], new[os.path.basename(p)]
+        if o is None or n is None:
+            if o is not n:
+                return None
+            continue
+
+        if o[0] != n[0]:
+            return None
+
+        if o[1] == n[1]:
+            n[2] = o[2]
+            continue
+
+        if not hashes or o[2] is None:
+            return None
+
+        n[2] = file_hash(p)
+        if n[2] != o[2]:
+            return None
+
+    return new
+
+
+def check_recording(task):
+    '''
+    Checks a single recording, returns a result dict.
+    task: (PCB root, recording ID).
+    '''
+
+    root, rec = task
+
+    pcb = PCB(root)
+    ret = {'pcb': pcb.id(), 'rec': rec, 'errors': [], 'warnings': []}
+
+    im, mask, ics = None, None, None
+
+    try:
+        im = pcb.image(rec)
+        ret['width'], ret['height'] = im.shape[1], im.shape[0]
+    except Exception as e:
+        ret['errors'].append('image: {}'.format(e))
+
+    if not os.path.isfile(os.path.join(root, 'rec{}-mask.png'.format(rec))) and not os.path.isfile(os.path.join(root, 'rec{}-mask.rle'.format(rec))):
+        ret['errors'].append('mask: file does not exist')
+    else:
+        try:
+            mask = pcb.mask(rec)
+        except Exception as e:
+            ret['errors'].append('mask: {}'.format(e))
+
+    if not pcb.has_annotations(rec):
+        ret['errors'].append('annotations: file does not exist')
+    else:
+        try:
+            ics = pcb.ics(rec)
+            ret['ics'] = len(ics)
+        except Exception as e:
+            ret['errors'].append('annotations: {}'.format(e))
+
+    if im is not None and mask is not None and im.shape[:2] != mask.shape[:2]:
+        ret['errors'].append('mask size {}x{} differs from image size {}x{}'.format(mask.shape[1], mask.shape[0], im.shape[1], im.shape[0]))
+        mask = None
+
+    if mask is not None:
+        if not mask.any():
+            ret['errors'].append('mask is empty')
+        else:
+            cnt = cv2.findContours((mask > 0).astype('uint8'), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
+            if len(cnt) > 1:
+                ret['warnings'].append('mask contains {} regions'.format(len(cnt)))
+
+    if mask is not None and ics is not None:
+        for i, ic in enumerate(ics):
+            x, y = int(round(ic.rect[0][0])), int(round(ic.rect[0][1]))
+            if x < 0 or y < 0 or x >= mask.shape[1] or y >= mask.shape[0]:
+                ret['errors'].append('IC {} lies outside the image'.format(i))
+            elif mask[y, x] == 0:
+                ret['errors'].append('IC {} lies outside the mask'.format(i))
+
+    return ret
+
+
+def verify(db, cache=None, processes=None, hashes=False, callback=None):
+    '''
+    Verify a dataset, returns a report dict.
+    db: PCBDataset.
+    cache: path of the cache file (None = no caching).
+    processes: number of worker processes (None = number of CPUs).
+    hashes: whether to compare content hashes of files with changed modification times.
+    callback: optional function that is called with every result that was not cached.
+    '''
+
+    cached = {}
+    if cache is not None and os.path.isfile(cache):
+        with open(cache) as f:
+            data = json.load(f)
+        if data.get('version') == _CACHE_VERSION and data.get('root') == os.path.abspath(db._root):
+            cached = data['recordings']
+
+    results, tasks, sigs = {}, [], {}
+    report = {'errors': [], 'recordings': []}
+
+    for id in db.pcb_ids():
+        root = db._pcb_paths[id]
+        pcb = PCB(root)
+
+        if len(pcb.recordings()) == 0:
+            report['errors'].append('PCB {}: no recordings'.format(id))
+
+        for f in sorted(os.listdir(root)):
+            if f.startswith('rec') and '-' in f:
+                try:
+                    r = int(f[3:f.index('-')])
+                except ValueError:
+                    continue
+
+                if r not in pcb.recordings():
+                    report['errors'].append('PCB {}: "{}" belongs to no recording'.format(id, f))
+
+        for rec in sorted(pcb.recordings()):
+            key = '{}/{}'.format(id, rec)
+            paths = recording_files(root, rec)
+            sig = unchanged(cached[key]['signature'], paths, hashes) if key in cached else None
+
+            if sig is not None:
+                results[key] = cached[key]
+                results[key].update({'signature': sig, 'cached': True})
+            else:
+                tasks.append((root, rec))
+                sigs[key] = paths
+
+    if tasks:
+        pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+        try:
+            for r in pool.imap_unordered(check_recording, tasks):
+                key = '{}/{}'.format(r['pcb'], r['rec'])
+                r['signature'] = signature(sigs[key], hashes)
+                r['cached'] = False
+                results[key] = r
+
+                if callback is not None:
+                    callback(r)
+        finally:
+            pool.close()
+            pool.join()
+
+    if cache is not None:  # atomically, via a unique temporary file so that concurrent runs do not interfere
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(cache) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(cache)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': _CACHE_VERSION, 'root': os.path.abspath(db._root), 'recordings': results}, f)
+            os.chmod(tmp, 0o644)  # mkstemp() creates files readable only by the owner
+            os.rename(tmp, cache)
+        except:
+            os.remove(tmp)
+            raise
+
+    for key in sorted(results, key=lambda k: tuple(map(int, k.split('/')))):
+        r = dict(results[key])
+        del r['signature']
+        report['recordings'].append(r)
+
+    report['summary'] = {
+        'recordings': len(results),
+        'checked': len(tasks),
+        'cached': len(results) - len(tasks),
+        'failed': len([r for r in results.values() if r['errors']]) + len(report['errors']),
+        'warnings': len([r for r in results.values() if r['warnings']])
+    }
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verify the integrity of the dataset')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--cache', type=str, dest='cache', help='Cache file (default: .pcb-verify.json in the dataset root)')
+    parser.add_argument('--no-cache', action='store_true', help='Check all recordings and do not write a cache file')
+    parser.add_argument('--hash', action='store_true', help='Compare content hashes of files whose modification time changed')
+    parser.add_argument('--processes', type=int, dest='processes', default=multiprocessing.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--report', type=str, dest='report', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else (args.cache or os.path.join(args.root, '.pcb-verify.json'))
+
+    report = verify(PCBDataset(args.root), cache, args.processes, args.hash)
+
+    for e in report['errors']:
+        print(e)
+
+    for r in report['recordings']:
+        for e in r['errors']:
+            print('PCB {} rec {}: {}'.format(r['pcb'], r['rec'], e))
+
+    s = report['summary']
+    print('{} recordings ({} checked, {} cached), {} failed, {} with warnings'.format(s['recordings'], s['checked'], s['cached'], s['failed'], s['warnings']))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    sys.exit(1 if s['failed'] > 0 else 0)
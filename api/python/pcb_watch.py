@@ -0,0 +1,332 @@
+
+'''
+Watch the DSLR dataset for changes and keep the dataset index up to date.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+The size and modification time of all recording files (pcbN/recN.jpg, -mask.png, -mask.rle,
+-annot.txt, -annot.bin) are compared to those of the previous scan. Only PCBs with added,
+changed or removed files are refreshed (see PCBDataset.refresh()), which recomputes only the
+affected index records and swaps the index atomically. On Linux, inotify is used (via ctypes)
+to wake up on changes and to rescan only the directories that changed, otherwise the whole
+dataset is scanned periodically.
+'''
+
+import os
+import os.path
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import argparse
+import threading
+
+from pcb_dataset import PCBDataset
+
+
+_FILE = re.compile(r'^rec\d+(\.jpg|-mask\.png|-mask\.rle|-annot\.txt|-annot\.bin)$')
+_PCB = re.compile(r'^pcb(\d+)$')
+
+
+def scan(root, dirs=None):
+    '''
+    Returns a dict that maps the paths of recording files (relative to root) to (size, modification time).
+    root: dataset root directory path.
+    dirs: names of PCB directories to scan (None = all).
+    '''
+
+    if dirs is None:
+        dirs = [d for d in os.listdir(root) if _PCB.match(d)]
+
+    ret = {}
+    for d in dirs:
+        try:
+            files = os.listdir(os.path.join(root, d))
+        except OSError:  # removed or not a directory
+            continue
+
+        for f in files:
+            if _FILE.match(f):
+                try:
+                    st = os.stat(os.path.join(root, d, f))
+                    ret[os.path.join(d, f)] = (st.st_size, st.st_mtime)
+                except OSError:
+                    pass
+
+    return ret
+
+
+def diff(old, new):
+    '''
+    Returns a dict with sorted lists of 'added', 'changed' and 'removed' files between two scans.
+    old: result of scan().
+    new: result of scan().
+    '''
+
+    return {
+        'added': sorted(p for p in new if p not in old),
+        'changed': sorted(p for p in new if p in old and old[p] != new[p]),
+        'removed': sorted(p for p in old if p not in new)
+    }
+
+
+class _Inotify:
+
+    '''
+    Minimal inotify wrapper that reports the names of changed PCB directories.
+    '''
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    _MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400
+
+    def __init__(self, root):
+        '''
+        Constructor, raises an Exception if inotify is not available.
+        root: dataset root directory path.
+        '''
+
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise Exception('inotify is not available')
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self._fd < 0:
+            raise Exception('inotify_init1 failed: {}'.format(os.strerror(ctypes.get_errno())))
+
+        self._root = root
+        self._dirs = {}  # watch descriptor -> PCB directory name ('' = root)
+
+        self._add('')
+        for d in os.listdir(root):
+            if _PCB.match(d):
+                self._add(d)
+
+    def _add(self, d):
+        '''
+        Watches a directory.
+        '''
+
+        wd = self._libc.inotify_add_watch(self._fd, os.path.join(self._root, d).encode(sys.getfilesystemencoding()), self._MASK)
+        if wd >= 0:
+            self._dirs[wd] = d
+
+    def wait(self, timeout):
+        '''
+        Waits for changes, returns the set of names of changed PCB directories (empty on timeout).
+        timeout: maximum waiting time in seconds.
+        '''
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        ret = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            i = 0
+            while i + 16 <= len(data):
+                wd, mask, _, n = struct.unpack_from('iIII', data, i)
+                name = data[i+16:i+16+n].rstrip(b'\0').decode(sys.getfilesystemencoding())
+                i += 16 + n
+
+                if mask & 0x4000:  # queue overflow, events were lost
+                    ret.update(d for d in os.listdir(self._root) if _PCB.match(d))
+                    ret.update(d for d in self._dirs.values() if d)
+
+                d = self._dirs.get(wd)
+                if d is None:
+                    continue
+
+                if d == '':
+                    if _PCB.match(name):
+                        if mask & 0x40000000 and mask & (0x80 | 0x100):  # new PCB directory
+                            self._add(name)
+                        ret.add(name)
+                elif mask & 0x400:  # PCB directory removed
+                    del self._dirs[wd]
+                    ret.add(d)
+                elif _FILE.match(name):
+                    ret.add(d)
+
+        return ret
+
+    def close(self):
+        '''
+        Closes the inotify instance.
+        '''
+
+        os.close(self._fd)
+
+
+class Watcher:
+
+    '''
+    Refreshes a PCBDataset whenever recording files are added, changed or removed.
+    '''
+
+    def __init__(self, db, interval=2.0, callback=None, processes=1, inotify=True, error_callback=None):
+        '''
+        Constructor, performs the initial scan.
+        db: PCBDataset.
+        interval: seconds between scans (maximum reaction time if inotify is used).
+        callback: optional function that is called with (result of diff(), updated (pcb, rec) pairs) after every refresh.
+        processes: number of worker processes for recomputing index fields (see PCBDataset.refresh()).
+        inotify: whether to use inotify if available.
+        error_callback: optional function that is called with the exception if a refresh in the background thread fails (it is retried after interval seconds).
+        '''
+
+        self._db = db
+        self._interval = interval
+        self._callback = callback
+        self._error_callback = error_callback
+        self._processes = processes
+
+        self._inotify = None
+        if inotify:
+            try:
+                self._inotify = _Inotify(db._root)
+            except Exception:  # not Linux, fall back to scanning
+                pass
+
+        self._files = scan(db._root)
+        self._dirty = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        '''
+        Returns a string representation.
+        '''
+
+        return 'Watcher of "{}" ({}, {} files)'.format(self._db._root, 'inotify' if self._inotify else 'scanning', len(self._files))
+
+    def poll(self):
+        '''
+        Checks for changes once and refreshes the dataset if necessary, returns (result of diff(), updated (pcb, rec) pairs).
+        Without inotify the whole dataset is scanned, otherwise only the directories reported since the last successful call.
+        If the refresh raises an exception, the changes are reported again by the next call.
+        '''
+
+        if self._inotify is None:
+            dirs = None
+            new = scan(self._db._root)
+            old = self._files
+        else:
+            self._dirty |= self._inotify.wait(0)
+            dirs = set(self._dirty)
+
+            new = scan(self._db._root, dirs)
+            old = dict((p, v) for p, v in self._files.items() if p.split(os.sep)[0] in dirs)
+
+        changes = diff(old, new)
+
+        paths = changes['added'] + changes['changed'] + changes['removed']
+        if paths:
+            pcbs = sorted(set(int(_PCB.match(p.split(os.sep)[0]).group(1)) for p in paths))
+            updated = self._db.refresh(pcbs, self._processes)
+        else:
+            updated = set()
+
+        # the dataset is up to date, remember the scan
+
+        if dirs is None:
+            self._files = new
+        else:
+            self._files = dict((p, v) for p, v in self._files.items() if p.split(os.sep)[0] not in dirs)
+            self._files.update(new)
+            self._dirty -= dirs
+
+        if paths and self._callback is not None:
+            self._callback(changes, updated)
+
+        return changes, updated
+
+    def start(self):
+        '''
+        Starts watching in a background (daemon) thread.
+        '''
+
+        if self._thread is not None:
+            raise Exception('Watcher is already running')
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops watching and waits for the background thread to finish.
+        '''
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _run(self):
+        '''
+        Thread function.
+        '''
+
+        while not self._stop.is_set():
+            if self._inotify is None:
+                self._stop.wait(self._interval)
+            else:
+                self._dirty |= self._inotify.wait(self._interval)
+                if self._dirty:
+                    time.sleep(0.2)  # let writers finish related files
+
+            if self._stop.is_set():
+                break
+
+            try:
+                self.poll()
+            except Exception as e:  # keep watching, e.g. if files are removed during a refresh
+                if self._error_callback is not None:
+                    self._error_callback(e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Watch the dataset and keep its index up to date')
+    parser.add_argument('--root', type=str, dest='root', required=True, help='Path to the dataset')
+    parser.add_argument('--interval', type=float, dest='interval', default=2.0, help='Seconds between scans')
+    parser.add_argument('--processes', type=int, dest='processes', default=1, help='Number of worker processes for recomputing index fields')
+    parser.add_argument('--no-inotify', action='store_true', dest='no_inotify', help='Always scan the whole dataset')
+    args = parser.parse_args()
+
+    def report(changes, updated):
+        for kind in ('added', 'changed', 'removed'):
+            for p in changes[kind]:
+                print('{}: {}'.format(kind, p))
+        print('{} index records updated'.format(len(updated)))
+
+    db = PCBDataset(args.root)
+    db.index()
+
+    def error(e):
+        print('Could not refresh "{}": {}'.format(args.root, e))
+
+    watcher = Watcher(db, args.interval, report, args.processes, not args.no_inotify, error)
+    watcher.start()
+    print(watcher)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,154 @@
+
+'''
+Benchmark the hot paths of the Python API.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Runs on an existing dataset (--root) or on a synthetic one that is generated on the fly
+(see synth_dataset.py). Results are printed and written as JSON (--out); pass the JSON file
+of a previous run via --compare to show relative changes.
+'''
+
+import os
+import os.path
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import timeit
+
+
+def measure(fn, repeat):
+    '''
+    Returns timing statistics of calling fn() repeatedly, in ms.
+    fn: function to call.
+    repeat: number of calls.
+    '''
+
+    times = []
+    for i in range(repeat):
+        t = timeit.default_timer()
+        fn()
+        times.append((timeit.default_timer() - t) * 1000)
+
+    times.sort()
+    return {
+        'n': repeat,
+        'mean': sum(times) / repeat,
+        'median': times[repeat//2],
+        'min': times[0],
+        'p95': times[min(repeat-1, int(0.95*repeat))]
+    }
+
+
+def run(api, root, scales, repeat):
+    '''
+    Run all benchmarks and return the results as a dict.
+    api: directory that contains the DSLR dataset python API file.
+    root: dataset root directory.
+    scales: scale factors to benchmark.
+    repeat: number of repetitions per benchmark.
+    '''
+
+    results = {}
+
+    # startup
+
+    sys.path.insert(0, api)
+    t = timeit.default_timer()
+    import pcb_dataset
+    results['startup/import'] = {'n': 1, 'mean': (timeit.default_timer() - t) * 1000}
+
+    results['startup/dataset'] = measure(lambda: pcb_dataset.PCBDataset(root), repeat)
+
+    db = pcb_dataset.PCBDataset(root)
+    ids = db.pcb_ids()
+    pcb = db.pcb(ids[0])
+    rec = sorted(pcb.recordings())[0]
+
+    # annotation parsing
+
+    results['ics/parse'] = measure(lambda: pcb.ics(rec), repeat)
+    results['ics/filtered'] = measure(lambda: pcb.ics(rec, size=(0.5, 10), aspect=(1, 3)), repeat)
+
+    # per-sample decoding and cropping
+
+    for s in scales:
+        p = db.pcb(ids[0], s)
+        results['decode/image@{}'.format(s)] = measure(lambda: p.image(rec), repeat)
+        results['decode/mask@{}'.format(s)] = measure(lambda: p.mask(rec), repeat)
+        results['decode/image_masked@{}'.format(s)] = measure(lambda: p.image_masked(rec), repeat)
+        results['crop/cropinfo@{}'.format(s)] = measure(lambda: db.pcb(ids[0], s)._cropinfo(rec), repeat)
+        results['ics/cropped@{}'.format(s)] = measure(lambda: p.ics(rec, True), repeat)
+
+    # full dataset iteration
+
+    def iterate(s):
+        for p in db.pcbs(s):
+            for r in p.recordings():
+                p.image_masked(r)
+                p.ics(r, True)
+
+    for s in scales:
+        results['iterate/image_masked+ics@{}'.format(s)] = measure(lambda: iterate(s), 1)
+
+    return results
+
+
+def versions():
+    '''
+    Returns versions of Python and relevant modules.
+    '''
+
+    import cv2
+    import numpy as np
+
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'cv2': cv2.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count() if hasattr(os, 'cpu_count') else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Python API.')
+    parser.add_argument('--api', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'python'), help='Directory that contains the DSLR dataset python API file.')
+    parser.add_argument('--root', type=str, help='Dataset to use (default: generate a synthetic dataset).')
+    parser.add_argument('--pcbs', type=int, default=10, help='Number of PCBs of the synthetic dataset.')
+    parser.add_argument('--recs', type=int, default=4, help='Number of recordings per PCB of the synthetic dataset.')
+    parser.add_argument('--size', type=str, default='4928x3264', help='Image size of the synthetic dataset (WxH).')
+    parser.add_argument('--scales', type=str, default='1,0.5,0.25', help='Comma-separated scale factors.')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per benchmark.')
+    parser.add_argument('--out', type=str, help='Write results to this JSON file.')
+    parser.add_argument('--compare', type=str, help='JSON file of a previous run to compare to.')
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from synth_dataset import create_dataset
+
+        root = tempfile.mkdtemp(prefix='pcb-bench-')
+        print('Generating synthetic dataset in "{}" ...'.format(root))
+        create_dataset(root, args.pcbs, args.recs, tuple(map(int, args.size.split('x'))))
+
+    try:
+        results = run(os.path.abspath(args.api), root, [float(s) for s in args.scales.split(',')], args.repeat)
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+    dataset = {'root': args.root} if args.root else {'synthetic': True, 'pcbs': args.pcbs, 'recs': args.recs, 'size': args.size}
+    report = {'versions': versions(), 'dataset': dataset, 'results': results}
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    for k in sorted(results):
+        line = '{:40s} {:10.2f} ms'.format(k, results[k]['mean'])
+        if k in previous:
+            line += '  ({:+.1f}%)'.format(100.0 * (results[k]['mean'] / previous[k]['mean'] - 1))
+        print(line)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
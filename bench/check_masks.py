@@ -0,0 +1,98 @@
+
+'''
+Check that run-length encoded masks decode to the same pixels as nearest-neighbor resizing of the original mask.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Random masks (noise of varying density and shapes with touching runs) are encoded with MaskRLE
+and decoded at several scales. The result must equal pixel-center sampling of the original mask,
+and cv2.resize() with INTER_NEAREST_EXACT if the sizes are integer multiples of each other (where
+OpenCV's fixed-point arithmetic has no rounding error). area() must equal the number of decoded
+pixels. Exits with status 1 on any mismatch.
+'''
+
+import os
+import os.path
+import sys
+import argparse
+
+import cv2
+import numpy as np
+
+
+def reference(mask, size):
+    '''
+    Returns the mask sampled at the centers of the pixels of the target size, computed in integer arithmetic.
+    mask: mask as a 2D array.
+    size: target size (width, height).
+    '''
+
+    w, h = size
+    ys = (2*np.arange(h) + 1) * mask.shape[0] // (2*h)
+    xs = (2*np.arange(w) + 1) * mask.shape[1] // (2*w)
+
+    return np.where(mask[ys][:, xs] > 0, 255, 0).astype(np.uint8)
+
+
+def random_mask(rng):
+    '''
+    Returns a random mask, either noise or rectangles separated by one-pixel gaps that downscaling closes.
+    rng: numpy RandomState.
+    '''
+
+    h, w = rng.randint(1, 160, 2)
+    if rng.rand() < 0.5:
+        return ((rng.rand(h, w) < rng.rand()) * 255).astype(np.uint8)
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    x = 0
+    while x < w:
+        n = rng.randint(1, 12)
+        mask[:, x:x+n] = 255
+        x += n + 1
+
+    return mask
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check MaskRLE.decode() against nearest-neighbor resizing.')
+    parser.add_argument('--api', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'python'), help='Directory that contains the DSLR dataset python API file.')
+    parser.add_argument('--masks', type=int, default=500, help='Number of random masks.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.api))
+    from pcb_masks import MaskRLE
+
+    rng = np.random.RandomState(args.seed)
+    failures = 0
+
+    for i in range(args.masks):
+        mask = random_mask(rng)
+        rle = MaskRLE.encode(mask)
+
+        for scale in (0.125, 0.25, 0.3, 0.5, 0.77, 1, 1.5, 2):
+            size = rle.size(scale)
+            if size[0] < 1 or size[1] < 1:
+                continue
+
+            im = rle.decode(scale)
+            errors = []
+
+            if not np.array_equal(im, reference(mask, size)):
+                errors.append('differs from pixel-center sampling')
+
+            exact = all(a % b == 0 or b % a == 0 for a, b in zip(size, (mask.shape[1], mask.shape[0])))
+            if exact and not np.array_equal(im, cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST_EXACT)):
+                errors.append('differs from cv2.resize()')
+
+            if rle.area(scale) != np.count_nonzero(im):
+                errors.append('area() is {}, decoded {}'.format(rle.area(scale), np.count_nonzero(im)))
+
+            if errors:
+                failures += 1
+                print('Mask {} ({}x{}), scale {}: {}'.format(i, mask.shape[1], mask.shape[0], scale, ', '.join(errors)))
+
+    print('{} masks checked, {} failures'.format(args.masks, failures))
+
+    if failures:
+        sys.exit(1)
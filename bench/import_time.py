@@ -0,0 +1,99 @@
+
+'''
+Benchmark the import time of the Python API and check that metadata access does not import heavy modules.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Every run starts a fresh interpreter that imports pcb_dataset and queries PCB IDs, recordings
+and annotations of a metadata-only dataset (empty images). Exits with status 1 if cv2 or numpy
+were imported or if the median import time exceeds --max-ms.
+'''
+
+import os
+import os.path
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+HEAVY_MODULES = ('cv2', 'numpy')
+
+PROBE = '''
+import sys, time, json
+t = time.time()
+import pcb_dataset
+t_import = time.time() - t
+t = time.time()
+db = pcb_dataset.PCBDataset(sys.argv[1])
+n = 0
+for id in db.pcb_ids():
+    pcb = db.pcb(id)
+    for r in pcb.recordings():
+        n += len(pcb.ics(r))
+t_meta = time.time() - t
+print(json.dumps({'import': t_import, 'metadata': t_meta, 'ics': n, 'loaded': [m for m in sys.argv[2:] if m in sys.modules]}))
+'''
+
+
+def create_dataset(root, num_pcbs, num_recs, num_ics):
+    '''
+    Create a metadata-only dataset with empty image files.
+    root: dataset root directory.
+    num_pcbs: number of PCBs.
+    num_recs: number of recordings per PCB.
+    num_ics: number of ICs per recording.
+    '''
+
+    for p in range(1, num_pcbs+1):
+        d = os.path.join(root, 'pcb{}'.format(p))
+        os.makedirs(d)
+
+        for r in range(1, num_recs+1):
+            open(os.path.join(d, 'rec{}.jpg'.format(r)), 'w').close()
+            with open(os.path.join(d, 'rec{}-annot.txt'.format(r)), 'w') as f:
+                for i in range(num_ics):
+                    f.write('{} {} 120 80 -12.500 IC{}\n'.format(100+10*i, 200+10*i, i))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the Python API.')
+    parser.add_argument('--api', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'python'), help='Directory that contains the DSLR dataset python API file.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs.')
+    parser.add_argument('--pcbs', type=int, default=165, help='Number of PCBs of the generated dataset.')
+    parser.add_argument('--max-ms', type=float, default=50, help='Maximum median import time in ms.')
+    parser.add_argument('--out', type=str, help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='pcb-import-')
+    try:
+        create_dataset(root, args.pcbs, 5, 10)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.abspath(args.api)
+
+        runs = []
+        for i in range(args.runs):
+            out = subprocess.check_output([sys.executable, '-c', PROBE, root] + list(HEAVY_MODULES), env=env)
+            runs.append(json.loads(out.decode('utf-8')))
+    finally:
+        shutil.rmtree(root)
+
+    def median(key):
+        return sorted([r[key] for r in runs])[len(runs)//2] * 1000
+
+    loaded = sorted(set(m for r in runs for m in r['loaded']))
+    result = {'import_ms': median('import'), 'metadata_ms': median('metadata'), 'runs': args.runs, 'pcbs': args.pcbs, 'heavy_modules_loaded': loaded}
+
+    print('import: {:.1f} ms, metadata access: {:.1f} ms (median of {} runs)'.format(result['import_ms'], result['metadata_ms'], args.runs))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if loaded:
+        sys.exit('Metadata access imported {}'.format(', '.join(loaded)))
+
+    if result['import_ms'] > args.max_ms:
+        sys.exit('Import time exceeds {} ms'.format(args.max_ms))
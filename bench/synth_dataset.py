@@ -0,0 +1,98 @@
+
+'''
+Generate a synthetic dataset with the layout of the DSLR dataset for benchmarking.
+~ Christopher Pramerdorfer, Computer Vision Lab, Vienna University of Technology
+
+Every PCB is a textured quadrilateral on a uniform background, recordings differ by a random
+perspective transform. Images, masks and annotation files are written as in the real dataset.
+'''
+
+import cv2
+import numpy as np
+
+import os
+import os.path
+import argparse
+
+
+def create_pcb(root, id, num_recs, size, rng, quality=95):
+    '''
+    Create the directory of a single PCB.
+    root: dataset root directory.
+    id: PCB ID.
+    num_recs: number of recordings.
+    size: image size (width, height).
+    rng: numpy RandomState.
+    quality: JPEG quality.
+    '''
+
+    w, h = size
+    d = os.path.join(root, 'pcb{}'.format(id))
+    if not os.path.isdir(d):
+        os.makedirs(d)
+
+    # board texture, smooth enough to compress like a real recording
+
+    tex = (rng.rand(h//16, w//16, 3)*255).astype(np.uint8)
+    tex = cv2.resize(tex, (w, h), interpolation=cv2.INTER_CUBIC)
+
+    bw, bh = rng.uniform(0.4, 0.7)*w, rng.uniform(0.4, 0.7)*h
+    board = np.float32([[w/2-bw/2, h/2-bh/2], [w/2+bw/2, h/2-bh/2], [w/2+bw/2, h/2+bh/2], [w/2-bw/2, h/2+bh/2]])
+
+    ics = []
+    for i in range(rng.randint(1, 30)):
+        center = (rng.uniform(w/2-bw/3, w/2+bw/3), rng.uniform(h/2-bh/3, h/2+bh/3))
+        ics.append((center, (rng.uniform(50, 400), rng.uniform(50, 400)), rng.uniform(-90, 0)))
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.int32(board)], 255)
+    tex[mask == 0] = 60
+
+    for r in range(1, num_recs+1):
+        H = cv2.getPerspectiveTransform(board, board + np.float32(rng.uniform(-0.03, 0.03, (4, 2))*(w, h)))
+
+        im = cv2.warpPerspective(tex, H, (w, h), borderValue=(60, 60, 60))
+        cv2.imwrite(os.path.join(d, 'rec{}.jpg'.format(r)), im, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        cv2.imwrite(os.path.join(d, 'rec{}-mask.png'.format(r)), cv2.warpPerspective(mask, H, (w, h), flags=cv2.INTER_NEAREST))
+
+        with open(os.path.join(d, 'rec{}-annot.txt'.format(r)), 'w') as f:
+            for i, ic in enumerate(ics):
+                pts = cv2.perspectiveTransform(np.float32([cv2.boxPoints(ic)]), H)
+                rect = cv2.minAreaRect(pts)
+                text = 'IC{} {}'.format(i, rng.randint(1000)) if i % 2 == 0 else ''
+                f.write('{:.0f} {:.0f} {:.0f} {:.0f} {:.3f} {}\n'.format(rect[0][0], rect[0][1], rect[1][0], rect[1][1], rect[2], text))
+
+
+def create_dataset(root, num_pcbs, num_recs, size, seed=0):
+    '''
+    Create a synthetic dataset.
+    root: dataset root directory.
+    num_pcbs: number of PCBs.
+    num_recs: number of recordings per PCB.
+    size: image size (width, height).
+    seed: random seed.
+    '''
+
+    rng = np.random.RandomState(seed)
+    for id in range(1, num_pcbs+1):
+        create_pcb(root, id, num_recs, size, rng)
+
+
+if __name__ == '__main__':
+    def imsize(s):
+        try:
+            w, h = map(int, s.split('x'))
+            return w, h
+        except:
+            raise argparse.ArgumentTypeError('size syntax is WxH')
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset.')
+    parser.add_argument('--root', type=str, required=True, help='Output directory.')
+    parser.add_argument('--pcbs', type=int, default=20, help='Number of PCBs.')
+    parser.add_argument('--recs', type=int, default=4, help='Number of recordings per PCB.')
+    parser.add_argument('--size', type=imsize, default='4928x3264', help='Image size (WxH).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    create_dataset(args.root, args.pcbs, args.recs, args.size, args.seed)
+    print('Created {} PCBs with {} recordings each in "{}"'.format(args.pcbs, args.recs, args.root))
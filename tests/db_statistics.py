@@ -71,6 +71,7 @@ ic_size = []  # size of each IC in cm^2
 ic_aspect = []  # aspect ratio of each IC
 
 db = PCBDataset(args.db)
+geometry = db.geometry()  # PCB areas of all recordings
 
 for pcb in db.pcbs():
     print(pcb)
@@ -87,12 +88,8 @@ for pcb in db.pcbs():
         ic_size.append(ic.size_cm2())
         ic_aspect.append(ic.aspect())
 
-    pcbsz = 0
-    for r in pcb.recordings():  # use size of smallest to minimize errors due to perspective
-        sz = np.sum(pcb.mask(rec=r) > 0) / (87.4**2)
-        if pcbsz == 0 or sz < pcbsz:
-            pcbsz = sz
-    pcb_sizes[id] = pcbsz
+    # use size of smallest to minimize errors due to perspective
+    pcb_sizes[id] = min([geometry[(id, r)][0] for r in pcb.recordings()])
 
 # count statistics
 
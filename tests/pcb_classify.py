@@ -5,12 +5,10 @@ size and aspect ratio using a random forest.
 ~ Christopher Pramerdorfer, 2015
 '''
 
-import cv2
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import sklearn.ensemble
-import sklearn.cross_validation
 
 import sys
 import os.path
@@ -70,22 +68,11 @@ print('Loading data ...')
 db = PCBDataset(args.db)
 data = []
 
-for pcb in db.pcbs():
-    print(' {}'.format(pcb))
+# area and minimum area rect of all recordings, masks with multiple components are reported by pcb_verify.py
 
-    id = pcb.id()
-
-    for r in pcb.recordings():  # use size of smallest to minimize errors due to perspective
-        sz = np.sum(pcb.mask(rec=r) > 0) / (87.4**2)
-
-        cnt, _ = cv2.findContours(pcb.mask(rec=r), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-        if len(cnt) != 1:
-            print(' Warning: Mask of recording {} contains {} components!'.format(r, len(cnt)))
-
-        rect = cv2.minAreaRect(cnt[0])
-        asp = max(rect[1][0], rect[1][1]) / min(rect[1][0], rect[1][1])
-
-        data.append((id, r, sz, asp))
+for (id, r), (sz, rect) in sorted(db.geometry().items()):
+    asp = max(rect[1][0], rect[1][1]) / min(rect[1][0], rect[1][1])
+    data.append((id, r, sz, asp))
 
 # create feature vectors
 
@@ -104,16 +91,24 @@ plt.xlabel('Size in cm$^2$')
 plt.ylabel('Aspect Ratio')
 savefig(fig, 'scatter-pcb-size-shape.pdf')
 
-# test classification performance using 10-fold cross validation
+# test classification performance using 10-fold cross validation, folds contain whole PCBs and are stratified by class
 
 print('Classifying ...')
 
-X = np.vstack((features_mb, features_others))
-y = np.hstack((np.zeros((features_mb.shape[0]), dtype=np.int16), np.ones((features_others.shape[0]), dtype=np.int16)))
+X = np.array([(d[2], d[3]) for d in data], dtype=np.float32)
+y = np.array([0 if d[0] in mbids else 1 for d in data], dtype=np.int16)
+keys = [(d[0], d[1]) for d in data]
+
+folds = db.split(10, labels=dict((id, int(id in mbids)) for id in db.pcb_ids()), seed=0, balance=False)
 
-rf = sklearn.ensemble.RandomForestClassifier(n_estimators=50, max_depth=3)
-cv = sklearn.cross_validation.StratifiedKFold(y, n_folds=10, random_state=0)
-result = sklearn.cross_validation.cross_val_score(rf, X, y, cv=cv)  # 10-fold stratified
+rf = sklearn.ensemble.RandomForestClassifier(n_estimators=50, max_depth=3, random_state=0)
+result = []
+for fold in folds:
+    fold = set(fold)
+    test = np.array([k in fold for k in keys])
+    if test.any() and not test.all():
+        rf.fit(X[~test], y[~test])
+        result.append(rf.score(X[test], y[test]))
 
 print('Done, crossval scores: {}'.format(result))
 print(' avg: {}, sd: {}'.format(np.mean(result), np.std(result)))